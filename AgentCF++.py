@@ -1,39 +1,44 @@
 from prompt import *
-import random
 import re
-from fuzzywuzzy import fuzz
-import shutil
-import os
-from dataPrepare import createInterDF, createItemDF, createRandomDF
-from config import model, cross_domain, inter_data_source, random_domain0_source, random_domain1_source, random_domain2_source, item_data_source, domain_list, get_main_kind, random_domain3_source
+from dataPrepare import InteractionReader, createItemDF
+from config import model, inter_data_source, random_domain_source_list, item_data_source, domain_list, is_live_group_memory, prompt_section_token_caps, is_memory_compaction
+from domainRegistry import DomainRegistry
 from request import get_response_from_openai
+from rankParser import TitleMatcher
 from functions import concatenate_crossdomain_preference
+from user_group_mem.createGroupMemory import load_group_memory_builder
+from memoryStore import open_memory_store, memory_store_exists, MemoryArchive
+from tokenBudget import PromptBudget
 from tqdm import tqdm
-import pandas as pd
 
 exp_name = "AgentCF++" + " " + " ".join(domain_list)
+name_suffix = exp_name.replace("AgentCF++ ", "")
 mode = "train"
 
 def initialize_memory(exp_name, domain_list):
     '''
-    Initialize user and item memory (directly copy from the saved initial memory)
+    Initialize user and item memory (directly copy from the saved initial memory) and open the memory store
     '''
-    memory_dir = f".\\memory\\{exp_name}"  # Memory directory
-    if os.path.exists(os.path.join(memory_dir, "item")) or os.path.exists(os.path.join(memory_dir, "user")):
+    memory_dir = f"memory/{exp_name}"  # Memory directory
+    if memory_store_exists(memory_dir):
         exit()
-        shutil.rmtree(os.path.join(memory_dir, "item"))
-        shutil.rmtree(os.path.join(memory_dir, "user"))
-    shutil.copytree(f"dataset\\crossDomainData\\initial\\{' '.join(domain_list)}\\AgentCF++\\item", os.path.join(memory_dir, "item"))
-    shutil.copytree(f"dataset\\crossDomainData\\initial\\{' '.join(domain_list)}\\AgentCF++\\user", os.path.join(memory_dir, "user"))
+    open_memory_store(f"dataset/crossDomainData/initial/{' '.join(domain_list)}/AgentCF++").copy_to(memory_dir)
+    return open_memory_store(memory_dir)
 
 def save_memory(ratio):
-    src_folder = f"memory\\{exp_name}"
-    dst_folder = f"memory\\{exp_name + '_' + ratio}"
+    src_folder = f"memory/{exp_name}"
+    dst_folder = f"memory/{exp_name + '_' + ratio}"
+    # Snapshots include the compactions scheduled so far
+    prompt_budget.wait()
+    memory_store.flush()
     try:
-        shutil.copytree(src_folder, dst_folder)
+        memory_store.copy_to(dst_folder)
         print(f"Folder '{src_folder}' successfully copied to '{dst_folder}'")
     except Exception as e:
         print(f"Error copying folder: {e}")
+    # Drop the superseded records accumulated since the last snapshot
+    if isinstance(memory_store, MemoryArchive):
+        memory_store.compact()
 
 def save_old_memory(userId, pos_itemId, main_kind, single_domain_memory, cross_domain_preference, pos_item_memory):
     additional_text = '===before update===\n'
@@ -62,61 +67,39 @@ def save_new_memory(userId, pos_itemId, main_kind, single_domain_memory, private
 
     return
 
-def process_interaction(interDF, itemDF, random_domain0_DF, random_domain1_DF, random_domain2_DF, random_domain3_DF, exp_name, model, domain_list):
+def process_interaction(interactions, all_inter_num, itemDF, domain_registry, exp_name, model, domain_list, group_memory_builder=None):
     """
     Start interaction
     """
-    all_inter_num = interDF.shape[0]
     save_interval = int(all_inter_num * 0.1)
-    for index, record in tqdm(interDF.iterrows()):
+    for index, record in tqdm(interactions, total=all_inter_num):
         try:
             # Save intermediate results every 10%
             if index % save_interval == 0 and index != 0:
+                if group_memory_builder is not None:
+                    group_memory_builder.save(memory_store)
                 save_memory(str(int(index / save_interval)))  # Call save function
             pos_itemId = record["parent_asin"]
             userId = record["user_id"]
+            # Keep group memory live with the interaction stream
+            if group_memory_builder is not None:
+                group_memory_builder.add_interaction(userId, pos_itemId)
 
-            with open(f".\\memory\\{exp_name}\\item\\item.{pos_itemId}", "r", encoding="utf-8") as file:
-                pos_item_memory = file.read()
+            pos_item_memory = prompt_budget.fit("item_memory", memory_store.read(f"item/item.{pos_itemId}"), f"item/item.{pos_itemId}")
 
             # Extract the name of the positive item
             pos_item_title = itemDF[itemDF["parent_asin"] == pos_itemId]["title"].values[0]
 
             # Extract the main category of the currently interacted item
-            main_kind = itemDF[itemDF["parent_asin"] == pos_itemId]["main_category"].values[0]
-            if len(domain_list) == 4:
-                neg_itemId = get_neg_item_id_4domains(main_kind, userId, random_domain0_DF, random_domain1_DF, random_domain2_DF, random_domain3_DF, domain_list)
-            else:
-                neg_itemId = get_neg_item_id(main_kind, userId, random_domain0_DF, random_domain1_DF, random_domain2_DF, domain_list)
+            domain_idx = domain_registry.index_of(itemDF[itemDF["parent_asin"] == pos_itemId]["main_category"].values[0])
+            neg_itemId = domain_registry.sample_neg_item(domain_idx, userId)
 
-            with open(f".\\memory\\{exp_name}\\item\\item.{neg_itemId}", "r", encoding="utf-8") as file:
-                neg_item_memory = file.read()
+            neg_item_memory = prompt_budget.fit("item_memory", memory_store.read(f"item/item.{neg_itemId}"), f"item/item.{neg_itemId}")
             neg_item_title = itemDF[itemDF["parent_asin"] == neg_itemId]["title"].values[0]
 
-            if main_kind == get_main_kind(domain_list[0]):
-                main_kind = domain_list[0]
-                with open(f".\\memory\\{exp_name}\\user\\user.{userId}\\private-{domain_list[0]}.txt", "r", encoding="utf-8") as file:
-                    single_domain_memory = file.read()
-                with open(f".\\memory\\{exp_name}\\user\\user.{userId}\\crossDomain-{domain_list[0]}.txt", "r", encoding="utf-8") as file:
-                    cross_domain_preference = file.read()
-            elif main_kind == get_main_kind(domain_list[1]):
-                main_kind = domain_list[1]
-                with open(f".\\memory\\{exp_name}\\user\\user.{userId}\\private-{domain_list[1]}.txt", "r", encoding="utf-8") as file:
-                    single_domain_memory = file.read()
-                with open(f".\\memory\\{exp_name}\\user\\user.{userId}\\crossDomain-{domain_list[1]}.txt", "r", encoding="utf-8") as file:
-                    cross_domain_preference = file.read()
-            elif main_kind == get_main_kind(domain_list[2]):
-                main_kind = domain_list[2]
-                with open(f".\\memory\\{exp_name}\\user\\user.{userId}\\private-{domain_list[2]}.txt", "r", encoding="utf-8") as file:
-                    single_domain_memory = file.read()
-                with open(f".\\memory\\{exp_name}\\user\\user.{userId}\\crossDomain-{domain_list[2]}.txt", "r", encoding="utf-8") as file:
-                    cross_domain_preference = file.read()
-            elif len(domain_list) == 4 and main_kind == get_main_kind(domain_list[3]):
-                main_kind = domain_list[3]
-                with open(f".\\memory\\{exp_name}\\user\\user.{userId}\\private-{domain_list[3]}.txt", "r", encoding="utf-8") as file:
-                    single_domain_memory = file.read()
-                with open(f".\\memory\\{exp_name}\\user\\user.{userId}\\crossDomain-{domain_list[3]}.txt", "r", encoding="utf-8") as file:
-                    cross_domain_preference = file.read()
+            main_kind = domain_list[domain_idx]
+            single_domain_memory = prompt_budget.fit("user_memory", memory_store.read(f"user/user.{userId}/private-{main_kind}.txt"), f"user/user.{userId}/private-{main_kind}.txt")
+            cross_domain_preference = prompt_budget.fit("cross_domain_memory", memory_store.read(f"user/user.{userId}/crossDomain-{main_kind}.txt"), f"user/user.{userId}/crossDomain-{main_kind}.txt")
 
             save_old_memory(userId, pos_itemId, main_kind, single_domain_memory, cross_domain_preference, pos_item_memory)
 
@@ -131,9 +114,7 @@ def process_interaction(interDF, itemDF, random_domain0_DF, random_domain1_DF, r
             selected_item_title, system_reason = parse_response(responseText)
 
             # Determine which item the model chose and whether the choice was correct
-            pos_similarity = fuzz.ratio(selected_item_title.lower(), pos_item_title.lower())
-            neg_similarity = fuzz.ratio(selected_item_title.lower(), neg_item_title.lower())
-            is_choice_right = pos_similarity > neg_similarity
+            is_choice_right = TitleMatcher([neg_item_title, pos_item_title]).best(selected_item_title) == 1
 
             # Create backward prompt for user
             user_prompt = create_user_prompt(user_description, list_of_item_description, pos_item_title, neg_item_title, system_reason, is_choice_right)
@@ -142,23 +123,12 @@ def process_interaction(interDF, itemDF, random_domain0_DF, random_domain1_DF, r
             responseText = get_response_from_openai(user_prompt, model)
             new_single_memory = update_user_memory(userId, exp_name, responseText, main_kind)
 
-            private_domain_description = concatenate_crossdomain_preference(f"memory\\{exp_name}\\user\\user.{userId}")
+            private_domain_description = concatenate_crossdomain_preference(memory_store, userId, prompt_budget)
             cross_domain_prompt = system_prompt_crossdomain(cross_domain_preference, private_domain_description, main_kind)
             responseText = get_response_from_openai(cross_domain_prompt, model)
             new_cross_domain_preference = update_user_crossdomain_memory(userId, exp_name, responseText, main_kind)
 
-            if main_kind == domain_list[0]:
-                with open(f".\\memory\\{exp_name}\\user\\user.{userId}\\crossDomain-{domain_list[0]}.txt", "r", encoding="utf-8") as file:
-                    cross_domain_preference = file.read()
-            elif main_kind == domain_list[1]:
-                with open(f".\\memory\\{exp_name}\\user\\user.{userId}\\crossDomain-{domain_list[1]}.txt", "r", encoding="utf-8") as file:
-                    cross_domain_preference = file.read()
-            elif main_kind == domain_list[2]:
-                with open(f".\\memory\\{exp_name}\\user\\user.{userId}\\crossDomain-{domain_list[2]}.txt", "r", encoding="utf-8") as file:
-                    cross_domain_preference = file.read()
-            elif len(domain_list) == 4 and main_kind == domain_list[3]:
-                with open(f".\\memory\\{exp_name}\\user\\user.{userId}\\crossDomain-{domain_list[3]}.txt", "r", encoding="utf-8") as file:
-                    cross_domain_preference = file.read()
+            cross_domain_preference = prompt_budget.fit("cross_domain_memory", memory_store.read(f"user/user.{userId}/crossDomain-{main_kind}.txt"), f"user/user.{userId}/crossDomain-{main_kind}.txt")
 
             item_prompt = create_item_prompt(cross_domain_preference, list_of_item_description, pos_item_title, neg_item_title, system_reason, is_choice_right)
             # Get output from the large model: updated information for the item
@@ -172,33 +142,6 @@ def process_interaction(interDF, itemDF, random_domain0_DF, random_domain1_DF, r
             print(f"Error processing interaction for user {userId} and item {pos_itemId}: {e}")
             continue
 
-# TODO: Parse different domains
-def get_neg_item_id(main_kind, userId, random_domain0_DF, random_domain1_DF, random_domain2_DF, domain_list):
-    main_kind = str(main_kind).strip()
-    if main_kind == get_main_kind(domain_list[0]):
-        df = random_domain0_DF
-    elif main_kind == get_main_kind(domain_list[1]):
-        df = random_domain1_DF
-    elif main_kind == get_main_kind(domain_list[2]):
-        df = random_domain2_DF
-    else:
-        raise ValueError(f"Unknown main kind: {main_kind}")
-    return df.loc[df["Unnamed: 0"] == userId, f"item_{random.randint(0, 99)}"].values[0]
-
-def get_neg_item_id_4domains(main_kind, userId, random_domain0_DF, random_domain1_DF, random_domain2_DF, random_domain3_DF, domain_list):
-    main_kind = str(main_kind).strip()
-    if main_kind == get_main_kind(domain_list[0]):
-        df = random_domain0_DF
-    elif main_kind == get_main_kind(domain_list[1]):
-        df = random_domain1_DF
-    elif main_kind == get_main_kind(domain_list[2]):
-        df = random_domain2_DF
-    elif main_kind == get_main_kind(domain_list[3]):
-        df = random_domain3_DF
-    else:
-        raise ValueError(f"Unknown main kind: {main_kind}")
-    return df.loc[df["Unnamed: 0"] == userId, f"item_{random.randint(0, 99)}"].values[0]
-
 def parse_response(responseText):
     selected_item_title = re.split(r"Choice:|\n", responseText)[1]
     system_reason = re.split(r"Explanation:", responseText)[-1].strip()
@@ -220,41 +163,39 @@ def create_item_prompt(cross_domain_preference, list_of_item_description, pos_it
 
 def update_user_memory(userId, exp_name, responseText, main_kind):
     responseText = responseText.split("My updated self-introduction:")[-1].strip()
-    user_memory_path = os.path.join(f".\\memory\\{exp_name}\\user", f"user.{userId}", f"private-{main_kind}.txt")
-    with open(user_memory_path, "w", encoding="utf-8") as file:
-        file.write(responseText)
+    prompt_budget.write(f"user/user.{userId}/private-{main_kind}.txt", responseText)
     return responseText
 
 def update_user_crossdomain_memory(userId, exp_name, responseText, main_kind):
     responseText = responseText.split("My deduced preference:")[-1].strip()
-    cross_domain_memory_path = os.path.join(f".\\memory\\{exp_name}\\user", f"user.{userId}", f"crossDomain-{main_kind}.txt")
-    with open(cross_domain_memory_path, "w", encoding="utf-8") as file:
-        file.write(responseText)
+    prompt_budget.write(f"user/user.{userId}/crossDomain-{main_kind}.txt", responseText)
     return responseText
  
 def update_item_memory(pos_itemId, neg_itemId, exp_name, responseText):
     updated_pos_item_intro = responseText.split("The updated description of the second item is: ")[-1]
     updated_neg_item_intro = re.split(r"The updated description of the first item is: |The updated description of the second item is: ", responseText)[1]
     # Update the item's self-description
-    with open(f".\\memory\\{exp_name}\\item\\item.{pos_itemId}", "w", encoding="utf-8") as file:
-        file.write(updated_pos_item_intro)
-    with open(f".\\memory\\{exp_name}\\item\\item.{neg_itemId}", "w", encoding="utf-8") as file:
-        file.write(updated_neg_item_intro)
+    prompt_budget.write(f"item/item.{pos_itemId}", updated_pos_item_intro)
+    prompt_budget.write(f"item/item.{neg_itemId}", updated_neg_item_intro)
     return updated_pos_item_intro
 
 
 if __name__ == "__main__":
     # Build interaction dataset
-    interDF = createInterDF(inter_data_source(mode), crossDomain=cross_domain)
-    # Build random selection dataset
-    random_domain0_DF = createRandomDF(random_domain0_source, crossDomain=cross_domain)
-    random_domain1_DF = createRandomDF(random_domain1_source, crossDomain=cross_domain)
-    random_domain2_DF = createRandomDF(random_domain2_source, crossDomain=cross_domain)
-    random_domain3_DF = pd.DataFrame()
-    if len(domain_list) == 4:
-        random_domain3_DF = createRandomDF(random_domain3_source, crossDomain=cross_domain)
+    inter_reader = InteractionReader(inter_data_source(mode))
+    # Domain dispatch and negative candidate pools
+    domain_registry = DomainRegistry.from_sources(domain_list, random_domain_source_list)
     # Build the complete item information table
-    itemDF = createItemDF(item_data_source, crossDomain=cross_domain)
-
-    initialize_memory(exp_name, domain_list)
-    process_interaction(interDF, itemDF, random_domain0_DF, random_domain1_DF, random_domain2_DF, random_domain3_DF, exp_name, model, domain_list)
\ No newline at end of file
+    itemDF = createItemDF(item_data_source)
+
+    # Build group memory during training if a user grouping is available
+    group_memory_builder = load_group_memory_builder(name_suffix) if is_live_group_memory else None
+
+    memory_store = initialize_memory(exp_name, domain_list)
+    # Per-section token caps for prompt memories; over-long memories are compacted in the background
+    prompt_budget = PromptBudget(prompt_section_token_caps, model, memory_store, compact=is_memory_compaction)
+    process_interaction(inter_reader.iter_records(), inter_reader.count_rows(), itemDF, domain_registry, exp_name, model, domain_list, group_memory_builder)
+    if group_memory_builder is not None:
+        group_memory_builder.save(memory_store)
+    prompt_budget.close()
+    memory_store.flush()
@@ -0,0 +1,96 @@
+"""
+Two-stage recommendation: a fast retriever picks retrieval_top_n items of the target domain, AgentCF++ ranks only those
+"""
+import time
+from dataPrepare import createInterDF, createItemDF
+from config import model, inter_data_source, item_data_source, domain_list, random_domain_source_list, retriever_type, retrieval_top_n, retrieval_factor_dir_dict, retrieval_embedding_model, retrieval_embedding_dim
+from domainRegistry import DomainRegistry
+from memoryStore import open_memory_store
+from agentRanker import AgentRanker
+from candidateRetrieval import PopularityRetriever, FactorCandidateRetriever, MemoryEmbeddingRetriever, build_memory_item_index, memory_index_exists
+from evaluationMetrics import calculate_ndcg
+from user_group_mem.groupMembership import load_group_membership
+from baselines.popularityScorer import PopularityScorer
+
+exp_name = "AgentCF++" + " " + " ".join(domain_list)
+
+name_suffix = exp_name.replace("AgentCF++ ", "")
+mode = "test"
+memory_store = open_memory_store(f"memory/{exp_name}")
+memory_item_index_dir = f"memory/{exp_name}/item-embedding-index"
+
+def open_candidate_retriever(retriever_type, inter_train_DF, item_domain):
+    '''
+    The first-stage retriever; "popularity" counts the training interactions as the Pop baseline does,
+    the "memory" item index is built on first use and reused afterwards
+    '''
+    if retriever_type == "popularity":
+        popularity_scorer = PopularityScorer.from_interactions(inter_train_DF["parent_asin"])
+        return PopularityRetriever(list(popularity_scorer.item_index), popularity_scorer.popularity[:-1], item_domain)
+    if retriever_type in retrieval_factor_dir_dict:
+        return FactorCandidateRetriever(retrieval_factor_dir_dict[retriever_type], item_domain)
+    if retriever_type == "memory":
+        from embeddingClient import EmbeddingClient
+        embedding_client = EmbeddingClient(retrieval_embedding_model)
+        if not memory_index_exists(memory_item_index_dir):
+            build_memory_item_index(memory_store, embedding_client, list(item_domain), memory_item_index_dir, embedding_dim=retrieval_embedding_dim)
+        return MemoryEmbeddingRetriever(memory_item_index_dir, item_domain, memory_store, embedding_client, embedding_dim=retrieval_embedding_dim)
+    raise ValueError(f"Unknown retriever type: {retriever_type}")
+
+if __name__ == "__main__":
+    # Construct interaction and item tables
+    interDF = createInterDF(inter_data_source(mode))
+    inter_train_DF = createInterDF(inter_data_source("train"))
+    itemDF = createItemDF(item_data_source)
+
+    # Domain of every item of the experiment domains
+    domain_registry = DomainRegistry.from_sources(domain_list, random_domain_source_list)
+    item_domain = {}
+    for itemId, main_category in zip(itemDF["parent_asin"], itemDF["main_category"]):
+        domain_idx = domain_registry.index_of(main_category)
+        if domain_idx is not None:
+            item_domain.setdefault(itemId, domain_idx)
+
+    # Test interactions of the experiment domains; the training items of a user are never retrieved
+    user_items = inter_train_DF.groupby("user_id")["parent_asin"].apply(set).to_dict()
+    interDF = interDF[interDF["parent_asin"].map(item_domain).notna()]
+    retriever = open_candidate_retriever(retriever_type, inter_train_DF, item_domain)
+    agent_ranker = AgentRanker(memory_store, dict(zip(itemDF["parent_asin"], itemDF["title"].map(str))), is_plus=True, group_membership=load_group_membership(name_suffix), model=model)
+
+    hit_list = []
+    ndcg_10_list = []
+    ndcg_5_list = []
+    ndcg_1_list = []
+    mrr_list = []
+    retrieval_seconds_list = []
+    rank_seconds_list = []
+    for userId, target_itemId in zip(interDF["user_id"], interDF["parent_asin"]):
+        domain_idx = item_domain[target_itemId]
+        # Stage 1: top-N items of the target domain
+        start = time.perf_counter()
+        candidate_itemId_list = retriever.retrieve([userId], [domain_idx], retrieval_top_n, [user_items.get(userId, set())])[0]
+        retrieval_seconds_list.append(time.perf_counter() - start)
+
+        # Stage 2: AgentCF++ ranks the short list
+        ranked_itemId_list = []
+        if candidate_itemId_list:
+            start = time.perf_counter()
+            try:
+                ranked_itemId_list = agent_ranker.rank(userId, domain_idx, candidate_itemId_list)
+            except Exception as e:
+                # Print error message and count the request as a miss
+                print(f"Error processing user {userId}: {e}")
+            rank_seconds_list.append(time.perf_counter() - start)
+
+        # An empty retrieval, a failed ranking or a target missing from the retrieved list counts as a miss for every metric
+        relevance_score_list = [1 if x == target_itemId else 0 for x in ranked_itemId_list]
+        hit_list.append(1 in relevance_score_list)
+        ndcg_10_list.append(calculate_ndcg(relevance_score_list, 10))
+        ndcg_5_list.append(calculate_ndcg(relevance_score_list, 5))
+        ndcg_1_list.append(calculate_ndcg(relevance_score_list, 1))
+        mrr_list.append(1.0 / (relevance_score_list.index(1) + 1) if 1 in relevance_score_list else 0.0)
+        print(f"recall@{retrieval_top_n}: {sum(hit_list) / len(hit_list)} ndcg@10 mean: {sum(ndcg_10_list) / len(ndcg_10_list)} mrr: {sum(mrr_list) / len(mrr_list)}")
+
+    with open(".\\log\\result.txt", mode="a", encoding="utf-8") as file:
+        file.write(f"{exp_name}:\nTwo-stage: {retriever_type} top {retrieval_top_n}\nRecall@{retrieval_top_n}:  {sum(hit_list) / len(hit_list)}\nNDCG@10:  {sum(ndcg_10_list) / len(ndcg_10_list)}\nNDCG@5:  {sum(ndcg_5_list) / len(ndcg_5_list)}\nNDCG@1:  {sum(ndcg_1_list) / len(ndcg_1_list)}\nMRR:  {sum(mrr_list) / len(mrr_list)}\n"
+                   f"Retrieval seconds per request:  {sum(retrieval_seconds_list) / len(retrieval_seconds_list)}\nRanking seconds per request:  {sum(rank_seconds_list) / max(len(rank_seconds_list), 1)}\n\n")
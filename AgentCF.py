@@ -1,17 +1,19 @@
 from prompt import *
-import random
 import re
-from fuzzywuzzy import fuzz
 import shutil
 import os
-from dataPrepare import createInterDF, createItemDF, createRandomDF, prepare_data_from_interDF
-from config import model, inter_data_source, random_domain0_source, random_domain1_source, random_domain2_source, item_data_source, domain_list, get_main_kind, random_domain3_source
+from dataPrepare import InteractionReader, createItemDF, prepare_data_from_interDF
+from config import model, inter_data_source, random_domain_source_list, item_data_source, domain_list
+from domainRegistry import DomainRegistry
 from request import get_response_from_openai
+from rankParser import TitleMatcher
+from memoryIndex import LongMemoryIndex
 from tqdm import tqdm
-import pandas as pd
 
 mode = "train"
 exp_name = "AgentCF" + " " + " ".join(domain_list)
+# Retrieval index over user-long, kept up to date as long-term memory grows
+memory_index = LongMemoryIndex(f"memory/{exp_name}/user-long-index", f"memory/{exp_name}/user-long")
 
 def initialize_memory(exp_name, domain_list):
     '''
@@ -30,19 +32,19 @@ def initialize_memory(exp_name, domain_list):
 def save_memory(ratio):
     src_folder = f"memory\\{exp_name}"
     dst_folder = f"memory\\{exp_name + '_' + ratio}"
+    memory_index.save()
     try:
         shutil.copytree(src_folder, dst_folder)
         print(f"Folder '{src_folder}' successfully copied to '{dst_folder}'")
     except Exception as e:
         print(f"Error copying folder: {e}")
 
-def process_interaction(interDF, itemDF, random_domain0_DF, random_domain1_DF, random_domain2_DF, random_domain3_DF, exp_name, model, domain_list):
+def process_interaction(interactions, all_inter_num, itemDF, domain_registry, exp_name, model, domain_list):
     """
     Start interaction
     """
-    all_inter_num = interDF.shape[0]
     save_interval = int(all_inter_num * 0.1)
-    for index, record in tqdm(interDF.iterrows()):         
+    for index, record in tqdm(interactions, total=all_inter_num):
         try:
             # Save intermediate results every 10%
             if index % save_interval == 0 and index != 0:
@@ -58,11 +60,8 @@ def process_interaction(interDF, itemDF, random_domain0_DF, random_domain1_DF, r
             pos_item_title = itemDF[itemDF["parent_asin"] == pos_itemId]["title"].values[0]
 
             # Extract the main category of the currently interacted item
-            main_kind = itemDF[itemDF["parent_asin"] == pos_itemId]["main_category"].values[0]
-            if len(domain_list) == 4:
-                neg_itemId = get_neg_item_id_4domains(main_kind, userId, random_domain0_DF, random_domain1_DF, random_domain2_DF, random_domain3_DF, domain_list)
-            else:
-                neg_itemId = get_neg_item_id(main_kind, userId, random_domain0_DF, random_domain1_DF, random_domain2_DF, domain_list)
+            domain_idx = domain_registry.index_of(itemDF[itemDF["parent_asin"] == pos_itemId]["main_category"].values[0])
+            neg_itemId = domain_registry.sample_neg_item(domain_idx, userId)
 
             with open(f".\\memory\\{exp_name}\\item\\item.{neg_itemId}", "r", encoding="utf-8") as file:
                 neg_item_memory = file.read()
@@ -78,9 +77,7 @@ def process_interaction(interDF, itemDF, random_domain0_DF, random_domain1_DF, r
             selected_item_title, system_reason = parse_response(responseText)
 
             # Determine which item the model chose and whether the choice was correct
-            pos_similarity = fuzz.ratio(selected_item_title.lower(), pos_item_title.lower())
-            neg_similarity = fuzz.ratio(selected_item_title.lower(), neg_item_title.lower())
-            is_choice_right = pos_similarity > neg_similarity
+            is_choice_right = TitleMatcher([neg_item_title, pos_item_title]).best(selected_item_title) == 1
 
             # Create backward prompts for user and item
             user_prompt, item_prompt = create_prompts(user_description, list_of_item_description, pos_item_title, neg_item_title, system_reason, is_choice_right)
@@ -99,33 +96,6 @@ def process_interaction(interDF, itemDF, random_domain0_DF, random_domain1_DF, r
             print(f"Error processing interaction for user {userId} and item {pos_itemId}: {e}")
             continue
 
-def get_neg_item_id(main_kind, userId, random_domain0_DF, random_domain1_DF, random_domain2_DF, domain_list):
-    main_kind = str(main_kind).strip()
-    if main_kind == get_main_kind(domain_list[0]):
-        df = random_domain0_DF
-    elif main_kind == get_main_kind(domain_list[1]):
-        df = random_domain1_DF
-    elif main_kind == get_main_kind(domain_list[2]):
-        df = random_domain2_DF
-    else:
-        raise ValueError(f"Unknown main kind: {main_kind}")
-    return df.loc[df["Unnamed: 0"] == userId, f"item_{random.randint(0, 99)}"].values[0]
-
-# TODO: Parse different domains
-def get_neg_item_id_4domains(main_kind, userId, random_domain0_DF, random_domain1_DF, random_domain2_DF, random_domain3_DF, domain_list):
-    main_kind = str(main_kind).strip()
-    if main_kind == get_main_kind(domain_list[0]):
-        df = random_domain0_DF
-    elif main_kind == get_main_kind(domain_list[1]):
-        df = random_domain1_DF
-    elif main_kind == get_main_kind(domain_list[2]):
-        df = random_domain2_DF
-    elif len(domain_list) == 4 and main_kind == get_main_kind(domain_list[3]):
-        df = random_domain3_DF
-    else:
-        raise ValueError(f"Unknown main kind: {main_kind}")
-    return df.loc[df["Unnamed: 0"] == userId, f"item_{random.randint(0, 99)}"].values[0]
-
 def parse_response(responseText):
     selected_item_title = re.split(r"Choice:|\n", responseText)[1]
     system_reason = re.split(r"Explanation:", responseText)[-1].strip()
@@ -146,6 +116,7 @@ def update_user_memory(userId, exp_name, responseText):
     with open(user_memory_path, "w", encoding="utf-8") as file:
         file.write(responseText)
     long_memory_path = os.path.join(f".\\memory\\{exp_name}\\user-long", f"user.{userId}")
+    memory_index.add(userId, responseText)
     with open(long_memory_path, "a", encoding="utf-8") as file:
         file.write("\n=====\n")
         file.write(responseText)
@@ -161,16 +132,13 @@ def update_item_memory(pos_itemId, neg_itemId, exp_name, responseText):
 
 if __name__ == "__main__":
     # Build interaction dataset
-    interDF = createInterDF(inter_data_source(mode))
-    # Build random selection dataset
-    random_domain0_DF = createRandomDF(random_domain0_source)
-    random_domain1_DF = createRandomDF(random_domain1_source)
-    random_domain2_DF = createRandomDF(random_domain2_source)
-    random_domain3_DF = pd.DataFrame()
-    if len(domain_list) == 4:
-        random_domain3_DF = createRandomDF(random_domain3_source)
+    inter_reader = InteractionReader(inter_data_source(mode))
+    # Domain dispatch and negative candidate pools
+    domain_registry = DomainRegistry.from_sources(domain_list, random_domain_source_list)
     # Build the complete item information table
     itemDF = createItemDF(item_data_source)
 
     initialize_memory(exp_name, domain_list)
-    process_interaction(interDF, itemDF, random_domain0_DF, random_domain1_DF, random_domain2_DF, random_domain3_DF, exp_name, model, domain_list)
\ No newline at end of file
+    process_interaction(inter_reader.iter_records(), inter_reader.count_rows(), itemDF, domain_registry, exp_name, model, domain_list)
+    # Index the users never updated during training too, so evaluation opens a complete index
+    memory_index.build()
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""
+Rank candidate lists of any length with trained AgentCF / AgentCF++ memories under the basic prompt strategy
+"""
+from config import domain_list, model, candidate_id_style, group_Mem_length, is_use_intermediate_node, prompt_section_token_caps
+from prompt import system_prompt_template_evaluation_basic, system_prompt_template_evaluation_basic_g, get_rank_format
+from request import get_response_from_openai
+from rankParser import RankingParser, get_candidate_labels
+from tokenBudget import PromptBudget
+from evaluationMetrics import max_retries
+
+class AgentRanker:
+    '''
+    Build the ranking prompt of one user, target domain and candidate list from the memory store and map the LLM's
+    answer back to the candidates. With is_plus the prompt holds the private and cross-domain memories of AgentCF++,
+    otherwise the single user memory of AgentCF; with a group_membership it also holds the user's group memories,
+    read from group_memory_store (default: memory_store). Reading a missing user memory raises.
+    '''
+    def __init__(self, memory_store, item_title_dict, is_plus=True, group_membership=None, prompt_budget=None, model=model, candidate_id_style=candidate_id_style, group_memory_store=None):
+        self.memory_store = memory_store
+        self.group_memory_store = group_memory_store if group_memory_store is not None else memory_store
+        self.item_title_dict = item_title_dict
+        self.is_plus = is_plus
+        self.group_membership = group_membership
+        # Evaluated memories are truncated in the prompt, never compacted
+        self.prompt_budget = prompt_budget if prompt_budget is not None else PromptBudget(prompt_section_token_caps, model)
+        self.model = model
+        self.candidate_id_style = candidate_id_style
+
+    def user_description(self, userId, main_kind):
+        if not self.is_plus:
+            return self.memory_store.read(f"user/user.{userId}")
+        user_memory = self.prompt_budget.fit("user_memory", self.memory_store.read(f"user/user.{userId}/private-{main_kind}.txt"))
+        cross_domain_preference = self.prompt_budget.fit("cross_domain_memory", self.memory_store.read(f"user/user.{userId}/crossDomain-{main_kind}.txt"))
+        if is_use_intermediate_node:
+            return f"===My preferences in the type of goods in {main_kind}:===\n" + user_memory + "\n" + "===Moreover: ===\n" + cross_domain_preference
+        return f"===My preferences in the type of goods in {main_kind}:===\n" + cross_domain_preference
+
+    def group_memory_text(self, userId, domain_idx):
+        '''
+        First line of every group memory of the user, followed by the group's latest items of the target domain
+        '''
+        if self.group_membership is None:
+            return ""
+        main_kind = domain_list[domain_idx]
+        group_Mem_txt = ""
+        for group in self.group_membership.group_ids_of(userId):
+            lines = self.group_memory_store.read_lines(f"groupMem/{group}.txt")
+            group_Mem_txt += lines[0]
+            # Domain lines are separated by blank lines, the last domain is on the last line
+            domain_line = lines[-(2 * (len(domain_list) - domain_idx) - 1)]
+            intered_domain = domain_line.split(f"{main_kind}:")[-1].split(";")
+            group_Mem_txt += f"{main_kind}:" + ";".join(intered_domain[-group_Mem_length-1:]) + "\n"
+        return group_Mem_txt
+
+    def item_memory(self, itemId):
+        try:
+            return self.prompt_budget.fit("item_memory", self.memory_store.read(f"item/item.{itemId}"))
+        except Exception as e:
+            print(f"Error processing item {itemId}: {e}")
+            return 'nan'
+
+    def candidate_description(self, candidate_itemId_list):
+        '''
+        Return (item description block of the prompt, candidate memories, candidate titles, candidate labels)
+        '''
+        cdt_item_memory_list = [self.item_memory(cdt_itemId) for cdt_itemId in candidate_itemId_list]
+        cdt_item_title_list = [self.item_title_dict.get(cdt_itemId, 'nan') for cdt_itemId in candidate_itemId_list]
+        # Optionally tag candidates with short IDs so the ranking can be parsed exactly
+        candidate_labels = get_candidate_labels(candidate_itemId_list, self.candidate_id_style)
+        example_list_of_item_description = ''
+        for cdt_idx, (cdt_item_memory, cdt_item_title) in enumerate(zip(cdt_item_memory_list, cdt_item_title_list)):
+            cdt_label = f"[{candidate_labels[cdt_idx]}] " if candidate_labels else ""
+            example_list_of_item_description += f"{cdt_label}title:{cdt_item_title.strip()}. description:{cdt_item_memory.strip()}\n"
+        return example_list_of_item_description, cdt_item_memory_list, cdt_item_title_list, candidate_labels
+
+    def build(self, userId, domain_idx, candidate_itemId_list):
+        '''
+        Return (prompt, RankingParser) of the basic strategy for the candidates in the given order
+        '''
+        user_description = self.user_description(userId, domain_list[domain_idx])
+        example_list_of_item_description, _, cdt_item_title_list, candidate_labels = self.candidate_description(candidate_itemId_list)
+        rank_format = get_rank_format(self.candidate_id_style)
+        if self.group_membership is not None:
+            system_evaluation_prompt = system_prompt_template_evaluation_basic_g(user_description, len(candidate_itemId_list), example_list_of_item_description, self.group_memory_text(userId, domain_idx), rank_format=rank_format)
+        else:
+            system_evaluation_prompt = system_prompt_template_evaluation_basic(user_description, len(candidate_itemId_list), example_list_of_item_description, rank_format=rank_format)
+        return system_evaluation_prompt, RankingParser(cdt_item_title_list, candidate_labels)
+
+    def _ask(self, system_evaluation_prompt, parse):
+        result, is_complete = parse(get_response_from_openai(system_evaluation_prompt, self.model))
+        retries = 0
+        # If the ranking is incomplete, regenerate
+        while not is_complete and retries < max_retries:
+            retries += 1
+            print(f"retry {retries} ...")
+            result, is_complete = parse(get_response_from_openai(system_evaluation_prompt, self.model))
+        return result
+
+    def relevance(self, userId, domain_idx, candidate_itemId_list, target_idx):
+        '''
+        Relevance score list of the LLM's ranking, as in the evaluators
+        '''
+        system_evaluation_prompt, ranking_parser = self.build(userId, domain_idx, candidate_itemId_list)
+        return self._ask(system_evaluation_prompt, lambda responseText: ranking_parser.parse(responseText, target_idx))
+
+    def rank(self, userId, domain_idx, candidate_itemId_list):
+        '''
+        All candidates in the order ranked by the LLM
+        '''
+        system_evaluation_prompt, ranking_parser = self.build(userId, domain_idx, candidate_itemId_list)
+        ranking = self._ask(system_evaluation_prompt, ranking_parser.ranking)
+        return [candidate_itemId_list[idx] for idx in ranking]
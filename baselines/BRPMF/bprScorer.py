@@ -0,0 +1,69 @@
+"""
+Score candidate items for users with the factors of a trained BPR model
+"""
+import numpy as np
+from scipy.sparse import csr_matrix
+from factorIndex import save_factors
+
+class BPRScorer:
+    '''
+    Scores only the requested (user, candidates) pairs: item bias + user factor . item factor, as cornac's BPR.score,
+    computed for a batch of users in one product. Pairs seen in training, unknown users and unknown items get
+    default_score, as they are missing from predict_ranking(..., remove_seen=True).
+    '''
+    def __init__(self, user_factors, item_factors, item_biases, user_index, item_index, seen=None, default_score=0.0):
+        self.user_factors = np.asarray(user_factors, dtype=np.float32)
+        self.item_factors = np.asarray(item_factors, dtype=np.float32)
+        self.item_biases = np.asarray(item_biases, dtype=np.float32).ravel()
+        self.user_index = dict(user_index)  # Raw user ID -> row of user_factors
+        self.item_index = dict(item_index)  # Raw item ID -> row of item_factors
+        self.seen = csr_matrix(seen, dtype=bool) if seen is not None else None  # Users x items, training interactions
+        self.default_score = default_score
+
+    @classmethod
+    def from_cornac(cls, bpr, remove_seen=True):
+        train_set = bpr.train_set
+        seen = train_set.csr_matrix if remove_seen else None
+        return cls(bpr.u_factors, bpr.i_factors, bpr.i_biases, train_set.uid_map, train_set.iid_map, seen)
+
+    def score(self, user_ids, candidate_lists):
+        '''
+        (batch, k) scores for a batch of users and their candidate lists (all of length k), in raw IDs
+        '''
+        user_idx = np.array([self.user_index.get(user_id, -1) for user_id in user_ids], dtype=np.int64)
+        item_idx = np.array([[self.item_index.get(item_id, -1) for item_id in candidates] for candidates in candidate_lists], dtype=np.int64).reshape(len(user_idx), -1)
+        valid = (user_idx[:, None] >= 0) & (item_idx >= 0)
+        safe_user_idx = np.maximum(user_idx, 0)
+        safe_item_idx = np.maximum(item_idx, 0)
+        scores = np.einsum("bd,bkd->bk", self.user_factors[safe_user_idx], self.item_factors[safe_item_idx]) + self.item_biases[safe_item_idx]
+        if self.seen is not None and valid.any():
+            rows, cols = np.nonzero(valid)
+            # Pointwise lookups in the CSR matrix, no dense users x items matrix
+            is_seen = np.asarray(self.seen[safe_user_idx[rows], safe_item_idx[rows, cols]]).ravel()
+            valid[rows[is_seen], cols[is_seen]] = False
+        return np.where(valid, scores, self.default_score)
+
+    def score_batches(self, user_ids, candidate_lists, batch_size=4096):
+        '''
+        Scores of any number of users, computed batch_size users at a time
+        '''
+        score_batches = [self.score(user_ids[i:i + batch_size], candidate_lists[i:i + batch_size]) for i in range(0, len(user_ids), batch_size)]
+        if not score_batches:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(score_batches)
+
+    def rank(self, user_id, candidates):
+        '''
+        Candidates sorted by descending score; ties keep their order
+        '''
+        scores = self.score([user_id], [candidates])[0]
+        return [candidates[i] for i in np.argsort(-scores, kind="stable")]
+
+    def export_factors(self, directory):
+        '''
+        Write the factors and the ID vocabularies for ANN retrieval; the item bias becomes one more dimension
+        '''
+        user_ids = sorted(self.user_index, key=self.user_index.get)
+        item_ids = sorted(self.item_index, key=self.item_index.get)
+        save_factors(directory, user_ids, self.user_factors[[self.user_index[u] for u in user_ids]], item_ids,
+                     self.item_factors[[self.item_index[i] for i in item_ids]], self.item_biases[[self.item_index[i] for i in item_ids]], model_name="BPR")
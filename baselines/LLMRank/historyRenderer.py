@@ -0,0 +1,57 @@
+"""
+Render item attributes once and cache each user's history text for LLMRank prompts
+"""
+import pandas as pd
+from tokenBudget import TokenCounter
+
+def render_items(itemDF, fields):
+    '''
+    {parent_asin: "name:value||name:value..."} for all items in one vectorized pass; fields is a list of (prefix, column)
+    '''
+    itemDF = itemDF.drop_duplicates("parent_asin")
+    text = pd.Series("", index=itemDF.index)
+    for prefix, column in fields:
+        text = text + prefix + itemDF[column].map(str)  # str() of each value, "nan" for missing ones
+    return dict(zip(itemDF["parent_asin"], text))
+
+HISTORY_FIELDS = [("title:", "title"), ("|| subtitle:", "subtitle"), ("||main_category:", "main_category"), ("|| average_rating:", "average_rating"), ("|| rating_number:", "rating_number"), ("|| price:", "price"), ("|| store:", "store"), ("|| item id:", "parent_asin")]
+CANDIDATE_FIELDS = [("title:", "title"), ("||main_category:", "main_category"), ("||subtitle:", "subtitle"), ("|| price:", "price"), ("|| average_rating:", "average_rating"), ("|| rating_number:", "rating_number"), ("|| item id:", "parent_asin")]
+
+class HistoryRenderer:
+    '''
+    Item texts are rendered once; a user's history text is built on first use and cached by user.
+    With a token budget, the history keeps the most recent items that fit.
+    '''
+    def __init__(self, itemDF, user_items, token_budget=None, model=None):
+        self.history_item_text = render_items(itemDF, HISTORY_FIELDS)
+        self.candidate_item_text = render_items(itemDF, CANDIDATE_FIELDS)
+        self.user_items = user_items  # {user_id: [parent_asin, ...]} in time order
+        self.token_budget = token_budget
+        self.counter = TokenCounter(model) if token_budget is not None else None
+        self.item_tokens = {}
+        self.history_cache = {}
+
+    def _fit_budget(self, item_texts):
+        if self.token_budget is None:
+            return item_texts
+        num_tokens = 0
+        for start in range(len(item_texts) - 1, -1, -1):
+            if item_texts[start] not in self.item_tokens:
+                self.item_tokens[item_texts[start]] = self.counter.count(item_texts[start])
+            num_tokens += self.item_tokens[item_texts[start]]
+            if num_tokens > self.token_budget:
+                return item_texts[start + 1:]
+        return item_texts
+
+    def user_history_text(self, user_id):
+        if user_id not in self.history_cache:
+            item_ids = self.user_items.get(user_id)
+            if not item_ids:
+                self.history_cache[user_id] = "Temporarily unavailable"
+            else:
+                item_texts = [self.history_item_text[item_id] for item_id in item_ids if item_id in self.history_item_text]
+                self.history_cache[user_id] = "".join(self._fit_budget(item_texts))
+        return self.history_cache[user_id]
+
+    def candidate_texts(self, item_ids):
+        return [self.candidate_item_text.get(item_id, 'nan') for item_id in item_ids]
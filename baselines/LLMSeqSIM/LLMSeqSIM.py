@@ -1,55 +1,31 @@
 import sys
 import os
 import pandas as pd
-import numpy as np
-from tqdm import tqdm
-import pickle
-from config import domain_list, item_data_source
-from dataPrepare import createItemDF
-from openai import OpenAI
-
-# Set the OpenAI API key
-os.environ['OPENAI_API_KEY'] = ''
-client = OpenAI()
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from config import domain_list, llmseqsim_embedding_source
+from embeddingStore import EmbeddingStore
+from userEmbedding import UserHistory, build_user_embeddings
 
 embedding_dims = 8
-
-def normalize_l2(x):
-    x = np.array(x)
-    norm = np.linalg.norm(x, axis=1, keepdims=True) if x.ndim > 1 else np.linalg.norm(x)
-    return np.where(norm == 0, x, x / norm)
-
-def get_embeddings_batch(texts, dim, model="text-embedding-ada-002"):
-    texts = [text.replace("\n", " ") for text in texts]
-    response = client.embeddings.create(input=texts, model=model)
-    return [response.data[i].embedding[:dim] for i in range(len(response.data))]
+embedding_model = 'text-embedding-ada-002'
+user_pooling = "last"  # "last", "last_k_mean", "exp_recency" or "max"
+pooling_last_k = 5
+pooling_decay = 0.8
 
 if __name__ == "__main__":
     # 1. Import item interaction list for each user
     inter_train_df = pd.read_csv(f"dataset/crossDomainData/user_item_data/{' '.join(domain_list)}/timesequence/inter_crossdomain_timesequence_train.csv", encoding="utf-8", dtype=str)
     
     # Load item embeddings
-    with open(f"baseline/LLMSeqSIM/item_embeddings_{' '.join(domain_list)}.pkl", 'rb') as f:
-        item_embedding_dict = pickle.load(f)
-
-    # Group user interactions
-    combined_user_item_df = inter_train_df.groupby('user_id')['parent_asin'].apply(list).reset_index()
-    combined_user_item_df.columns = ['user_id', 'parent_asin_list']
-    combined_user_item_df.set_index('user_id', inplace=True)
+    item_store = EmbeddingStore.load(llmseqsim_embedding_source("item"))
 
-    # 2. Write the names of items interacted with by each user
-    itemDF = createItemDF(item_data_source)
-    item_dict = itemDF.set_index("parent_asin")["title"].to_dict()
-    combined_user_item_df['item_title_list'] = combined_user_item_df['parent_asin_list'].apply(lambda ids: [item_dict[item_id] for item_id in ids])
+    # 2. Group user interactions in time order (CSR layout)
+    user_history = UserHistory(inter_train_df["user_id"].values, inter_train_df["parent_asin"].values)
 
-    # 3. Calculate user embeddings
-    user_embeddings = {}
-    for index, row in combined_user_item_df.iterrows():
-        embeddings = [item_embedding_dict[i] for i in row["parent_asin_list"]]
-        user_embeddings[row.name] = embeddings[-1]  # Use the last embedding
+    # 3. Calculate user embeddings by pooling the item embeddings of each history
+    user_store = build_user_embeddings(user_history, item_store, pooling=user_pooling, last_k=pooling_last_k, decay=pooling_decay)
 
     # Save user embeddings
-    with open(f"user_group_mem/user_group_via_history/user_embeddings_{' '.join(domain_list)}.pkl", 'wb') as f:
-        pickle.dump(user_embeddings, f)
+    user_store.save(llmseqsim_embedding_source("user"))
 
     exit()
\ No newline at end of file
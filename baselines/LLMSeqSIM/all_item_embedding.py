@@ -2,10 +2,11 @@ import sys
 import os
 import pandas as pd
 import numpy as np
-from tqdm import tqdm
-from config import domain_list, item_data_source
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from config import domain_list, item_data_source, llmseqsim_embedding_source
 from dataPrepare import createItemDF
-from LLMSeqSIM import get_embeddings_batch, embedding_dims
+from LLMSeqSIM import embedding_dims, embedding_model
+from embeddingClient import EmbeddingClient
 import pickle
 
 if __name__ == "__main__":
@@ -22,15 +23,12 @@ if __name__ == "__main__":
 
     # 3. Calculate embeddings for all items
     df = pd.DataFrame({'text': item_title_list, 'id': item_id_list})
-    item_embeddings = {}
-
-    for i in tqdm(range(len(df))):
-        batch_texts = df['text'][i:i + 1].tolist()
-        batch_embeddings = get_embeddings_batch(batch_texts, dim=embedding_dims, model='text-embedding-ada-002')
-        item_embeddings[df["id"].iloc[i]] = batch_embeddings
+    embedding_client = EmbeddingClient(embedding_model)
+    embeddings = embedding_client.embed(df['text'].tolist(), dim=embedding_dims)
+    item_embeddings = dict(zip(df["id"], embeddings))
 
     # Save item embeddings
-    with open(f"baseline/LLMSeqSIM/item_embeddings_{' '.join(domain_list)}.pkl", 'wb') as f:
+    with open(llmseqsim_embedding_source("item"), 'wb') as f:
         pickle.dump(item_embeddings, f)
 
     exit()
\ No newline at end of file
@@ -0,0 +1,63 @@
+"""
+Embeddings held as one contiguous float32 matrix with an ID -> row index, for vectorized cosine ranking
+"""
+import pickle
+import numpy as np
+
+class EmbeddingStore:
+    '''
+    Rows are L2-normalized once at load time, so cosine similarity is a dot product.
+    The last row is all zeros and stands for unknown IDs, which then score 0 against everything.
+    '''
+    def __init__(self, ids, matrix):
+        matrix = np.asarray(matrix, dtype=np.float32).reshape(len(ids), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+        self.ids = list(ids)
+        self.matrix = np.vstack([matrix, np.zeros((1, matrix.shape[1]), dtype=np.float32)])
+        self.index = {embedding_id: row for row, embedding_id in enumerate(self.ids)}
+
+    @classmethod
+    def from_dict(cls, embedding_dict):
+        return cls(list(embedding_dict.keys()), np.array(list(embedding_dict.values()), dtype=np.float32))
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Load an EmbeddingStore saved as .npz or a pickled {id: embedding} dict
+        '''
+        if path.endswith(".npz"):
+            data = np.load(path, allow_pickle=False)
+            return cls(data["ids"].tolist(), data["matrix"])
+        with open(path, "rb") as file:
+            return cls.from_dict(pickle.load(file))
+
+    def save(self, path):
+        '''
+        Save as .npz, or as a pickled {id: embedding} dict for any other extension, the format load reads back
+        '''
+        if path.endswith(".npz"):
+            np.savez(path, ids=np.array(self.ids, dtype=str), matrix=self.matrix[:-1])
+            return
+        with open(path, "wb") as file:
+            pickle.dump(dict(zip(self.ids, self.matrix[:-1])), file)
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+    def rows(self, ids):
+        unknown_row = len(self.ids)
+        return np.array([self.index.get(embedding_id, unknown_row) for embedding_id in ids], dtype=np.int64)
+
+    def vectors(self, ids):
+        return self.matrix[self.rows(ids)]
+
+def cosine_scores(user_store, item_store, user_ids, candidate_matrix):
+    '''
+    (n, k) cosine similarities between user_ids[i] and the candidates in row i of candidate_matrix, in one einsum
+    '''
+    candidate_matrix = np.asarray(candidate_matrix)
+    user_vectors = user_store.vectors(user_ids)  # (n, d)
+    item_vectors = item_store.vectors(candidate_matrix.ravel()).reshape(candidate_matrix.shape + (item_store.dim,))  # (n, k, d)
+    return np.einsum("nd,nkd->nk", user_vectors, item_vectors)
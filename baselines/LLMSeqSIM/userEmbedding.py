@@ -0,0 +1,73 @@
+"""
+Pool item embeddings of user histories into user embeddings with segment reductions
+"""
+import numpy as np
+import pandas as pd
+from embeddingStore import EmbeddingStore
+
+class UserHistory:
+    '''
+    Interactions grouped by user in CSR layout: the items of users[u] are items[offsets[u]:offsets[u + 1]],
+    in the order of the interaction table (time order for the timesequence files).
+    '''
+    def __init__(self, user_column, item_column):
+        user_codes, self.users = pd.factorize(pd.Series(user_column))
+        order = np.argsort(user_codes, kind="stable")
+        self.items = np.asarray(item_column)[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(user_codes, minlength=len(self.users)))])
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def steps_from_end(self):
+        '''
+        For every interaction, how many later interactions the user has (0 for the most recent)
+        '''
+        return np.repeat(self.offsets[1:], self.lengths) - 1 - np.arange(len(self.items))
+
+def build_user_embeddings(user_history, item_store, pooling="last", last_k=5, decay=0.8, user_ids=None):
+    '''
+    Float32 user embeddings from the item embeddings of each user's history.
+    pooling: "last" (most recent item, the original LLMSeqSIM), "last_k_mean" (mean of the last_k most recent items),
+    "exp_recency" (mean weighted by decay ** steps from the end) or "max" (element-wise max).
+    Items without an embedding are left out. Returns an EmbeddingStore whose rows follow user_ids if given
+    (users without history get a zero row), otherwise the order of first appearance in the history.
+    '''
+    item_rows = item_store.rows(user_history.items)
+    item_vectors = item_store.matrix[item_rows]  # (interactions, d)
+    is_known = item_rows < len(item_store.ids)
+    steps = user_history.steps_from_end()
+    starts = user_history.offsets[:-1]
+    has_history = user_history.lengths > 0
+    pooled = np.zeros((len(user_history.users), item_store.dim), dtype=np.float32)
+
+    if pooling == "max":
+        item_vectors = np.where(is_known[:, None], item_vectors, -np.inf)
+        pooled[has_history] = np.maximum.reduceat(item_vectors, starts[has_history], axis=0)
+        pooled[~np.isfinite(pooled)] = 0
+    else:
+        if pooling == "last":
+            # Most recent item that has an embedding
+            known_steps = np.where(is_known, steps, np.iinfo(np.int64).max)
+            last_known_step = np.zeros(len(starts), dtype=np.int64)
+            last_known_step[has_history] = np.minimum.reduceat(known_steps, starts[has_history])
+            weights = (steps == np.repeat(last_known_step, user_history.lengths)).astype(np.float32)
+        elif pooling == "last_k_mean":
+            weights = (steps < last_k).astype(np.float32)
+        elif pooling == "exp_recency":
+            weights = np.power(decay, steps).astype(np.float32)
+        else:
+            raise ValueError(f"Unknown pooling: {pooling}")
+        weights *= is_known
+        weighted_sum = np.add.reduceat(item_vectors * weights[:, None], starts[has_history], axis=0)
+        weight_sum = np.add.reduceat(weights, starts[has_history])
+        pooled[has_history] = weighted_sum / np.maximum(weight_sum, 1e-12)[:, None]
+
+    if user_ids is None:
+        return EmbeddingStore(list(user_history.users), pooled)
+    user_index = {user_id: row for row, user_id in enumerate(user_history.users)}
+    rows = np.array([user_index.get(user_id, -1) for user_id in user_ids], dtype=np.int64)
+    aligned = np.zeros((len(rows), item_store.dim), dtype=np.float32)
+    aligned[rows >= 0] = pooled[rows[rows >= 0]]
+    return EmbeddingStore(list(user_ids), aligned)
@@ -396,6 +396,7 @@ class SASREC(tf.keras.Model):
         self.best_score=0
         self.val_users = []
         self.history = pd.DataFrame(columns=['epoch','NDCG@10','HR@10'])
+        self.user_encoding_cache = {}  # encoded user label -> encoder output of the user's sequence
 
         self.item_num = kwargs.get("item_num", None)
         self.seq_max_len = kwargs.get("seq_max_len", 100)
@@ -643,7 +644,7 @@ class SASREC(tf.keras.Model):
 
         Args:
             dataset (:obj:`util.SASRecDataSet`): SASRecDataSet containing users-item interaction history.
-            sampler (:obj:`util.WarpSampler`): WarpSampler.
+            sampler (:obj:`sampler.WarpSampler`): WarpSampler or SharedWarpSampler.
             num_epochs (int, optional): Epoch. Defaults to 10.
             batch_size (int, optional): Batch size. Defaults to 128.
             lr (float, optional): Learning rate. Defaults to 0.001.
@@ -701,6 +702,7 @@ class SASREC(tf.keras.Model):
             print(f'epoch {epoch} / {num_epochs} -----------------------------')
             
             self.epoch = epoch
+            self.user_encoding_cache = {}  # Weights change, cached encoder outputs are stale
             step_loss = []
             train_loss.reset_state()
             for step in tqdm(
@@ -1040,20 +1042,16 @@ class SASREC(tf.keras.Model):
         return inputs
     
 
-    def batch_predict(self, inputs,cand_n):
-        """Returns the logits for the item candidates.
+    def encode_sequences(self, input_seq):
+        """Encoder output at the last position of each sequence.
 
         Args:
-            inputs (tf.Tensor): Input tensor.
-            cand_n (int): Num of candidates.
+            input_seq (np.ndarray): Pre-padded item sequences, (b, seq_max_len).
 
         Returns:
-            tf.Tensor: Output tensor
+            tf.Tensor: Sequence representations, (b, d)
         """
         training = False
-        input_seq = inputs["input_seq"]
-        candidate = inputs["candidate"]
-
         mask = tf.expand_dims(tf.cast(tf.not_equal(input_seq, 0), tf.float32), -1)
         seq_embeddings, positional_embeddings = self.embedding(input_seq)
         seq_embeddings += positional_embeddings
@@ -1062,24 +1060,69 @@ class SASREC(tf.keras.Model):
         seq_attention = seq_embeddings
         seq_attention = self.encoder(seq_attention, training=training, mask=mask)
         seq_attention = self.layer_normalization(seq_attention)  # (b, s, d)
-        seq_emb = tf.reshape(
-            seq_attention,
-            [tf.shape(input_seq)[0] * self.seq_max_len, self.embedding_dim],
-        )  # (b*s, d)
-        # print(candidate)
-        candidate_emb = self.item_embedding_layer(candidate)  # (b, s, d)
-        candidate_emb = tf.transpose(candidate_emb, perm=[0, 2, 1])  # (b, d, s)
+        return seq_attention[:, -1, :]  # (b, d)
 
-        test_logits = tf.matmul(seq_emb, candidate_emb)
-        # (200, 100) * (1, 101, 100)'
+    def batch_predict(self, inputs,cand_n):
+        """Returns the logits for the item candidates.
 
-        test_logits = tf.reshape(
-            test_logits,
-            [tf.shape(input_seq)[0], self.seq_max_len, 1+cand_n],
-        )  # (1, 50, 1+can)
-        test_logits = test_logits[:, -1, :]  # (1, 101)
+        Args:
+            inputs (tf.Tensor): Input tensor. inputs["candidate"] is either one candidate list shared by
+                all sequences, (1, 1+cand_n), or one candidate list per sequence, (b, 1+cand_n).
+            cand_n (int): Num of candidates.
+
+        Returns:
+            tf.Tensor: Output tensor
+        """
+        seq_emb = self.encode_sequences(inputs["input_seq"])  # (b, d)
+        candidate_emb = self.item_embedding_layer(inputs["candidate"])  # (1 or b, 1+can, d)
+        test_logits = tf.reduce_sum(tf.expand_dims(seq_emb, 1) * candidate_emb, -1)  # (b, 1+can)
         return test_logits
 
+    def encode_users(self, dataset, user_array, batch_size=1024):
+        """Encoder outputs of users' full histories. Users not in the cache are encoded in padded batches.
+
+        Args:
+            dataset (:obj:`SASRecDataSet`): SASRecDataSet containing users-item interaction history.
+            user_array (np.ndarray): Encoded user labels, may repeat.
+            batch_size (int, optional): Sequences per forward pass. Defaults to 1024.
+
+        Returns:
+            np.ndarray: User representations, (n, d)
+        """
+        user_list = np.asarray(user_array).tolist()
+        missing = [u for u in dict.fromkeys(user_list) if u not in self.user_encoding_cache]
+        for start in range(0, len(missing), batch_size):
+            users = missing[start:start + batch_size]
+            seq = tf.keras.preprocessing.sequence.pad_sequences(
+                [dataset.User[u] for u in users], padding="pre", truncating="pre", maxlen=self.seq_max_len
+            )
+            self.user_encoding_cache.update(zip(users, np.array(self.encode_sequences(seq))))
+        if not user_list:
+            return np.zeros((0, self.embedding_dim), dtype=np.float32)
+        return np.stack([self.user_encoding_cache[u] for u in user_list])
+
+    def score_candidates(self, dataset, user_array, candidate_matrix, batch_size=1024):
+        """Score a different candidate set for each row, for many users at once.
+
+        Args:
+            dataset (:obj:`SASRecDataSet`): SASRecDataSet containing users-item interaction history.
+            user_array (np.ndarray): Encoded user labels, (n,).
+            candidate_matrix (np.ndarray): Encoded item labels, (n, k); row i holds the candidates of user_array[i].
+            batch_size (int, optional): Sequences per forward pass. Defaults to 1024.
+
+        Returns:
+            np.ndarray: Scores, (n, k)
+
+        Examples:
+            >>> scores = model.score_candidates(data, users, candidates)
+            >>> ranking = np.argsort(-scores, axis=1)
+        """
+        candidate_matrix = np.asarray(candidate_matrix, dtype=np.int64)
+        # Each user is encoded once, however many rows they have
+        user_emb = self.encode_users(dataset, user_array, batch_size)  # (n, d)
+        item_emb = self.item_embedding_layer.embeddings.numpy()  # (item_num + 1, d)
+        return np.einsum("nd,nkd->nk", user_emb, item_emb[candidate_matrix])
+
     
     def save(self,path, exp_name='sas_experiment'):
         """Save trained SASRec Model
@@ -1,6 +1,6 @@
 import multiprocessing
 import numpy as np
-from multiprocessing import Process, Queue
+from multiprocessing import Process, Queue, shared_memory
 import tensorflow as tf
 
 
@@ -103,6 +103,151 @@ class WarpSampler(object):
             p.terminate()
             p.join()
 
+class UserHistoryCSR(object):
+    """User histories in a flat CSR layout: the items of user u are items[offsets[u]:offsets[u + 1]] in time order.
+    keys holds u * (itemnum + 1) + item for every interaction, sorted, so that "has user u seen item i" for a
+    whole batch is one searchsorted.
+
+    Args:
+        offsets (np.ndarray): Row offsets, (usernum + 2,), indexed by user label.
+        items (np.ndarray): Items of all users, concatenated.
+        keys (np.ndarray): Sorted user-item keys.
+        itemnum (int): number of items
+    """
+
+    def __init__(self, offsets, items, keys, itemnum):
+        self.offsets = offsets
+        self.items = items
+        self.keys = keys
+        self.itemnum = itemnum
+        self.eligible_users = np.flatnonzero(np.diff(offsets) > 1)  # Users with at least one (input, target) pair
+
+    @classmethod
+    def from_dict(cls, User, usernum, itemnum):
+        lengths = np.zeros(usernum + 2, dtype=np.int64)
+        for user, user_items in User.items():
+            lengths[user + 1] = len(user_items)
+        offsets = np.cumsum(lengths)
+        items = np.zeros(offsets[-1], dtype=np.int32)
+        for user, user_items in User.items():
+            items[offsets[user]:offsets[user + 1]] = user_items
+        user_of_item = np.repeat(np.arange(usernum + 1, dtype=np.int64), np.diff(offsets))
+        keys = np.unique(user_of_item * (itemnum + 1) + items)
+        return cls(offsets, items, keys, itemnum)
+
+    def arrays(self):
+        return {"offsets": self.offsets, "items": self.items, "keys": self.keys}
+
+    def has_seen(self, users, items):
+        keys = users * (self.itemnum + 1) + items
+        found = np.searchsorted(self.keys, keys)
+        return self.keys[np.minimum(found, len(self.keys) - 1)] == keys
+
+    def sample_batch(self, rng, batch_size, maxlen, max_rounds=100):
+        """Sample a batch as sample_function does, with whole-batch array operations.
+
+        Returns:
+            tuple: users (b,), seq (b, maxlen), pos (b, maxlen), neg (b, maxlen)
+        """
+        users = self.eligible_users[rng.integers(0, len(self.eligible_users), batch_size)]
+        start, end = self.offsets[users], self.offsets[users + 1]
+        # Column c holds the input item j = maxlen - 1 - c steps before the last input item
+        steps = np.arange(maxlen - 1, -1, -1)
+        seq_index = end[:, None] - 2 - steps[None, :]
+        is_valid = seq_index >= start[:, None]
+        seq_index = np.where(is_valid, seq_index, 0)
+        seq = np.where(is_valid, self.items[seq_index], 0).astype(np.int32)
+        pos = np.where(is_valid, self.items[seq_index + 1], 0).astype(np.int32)
+
+        # Negatives: items the user has not interacted with, by rejection
+        neg = np.zeros_like(seq)
+        rows, cols = np.nonzero(is_valid)
+        for _ in range(max_rounds):
+            if len(rows) == 0:
+                break
+            neg[rows, cols] = rng.integers(1, self.itemnum + 1, len(rows))
+            is_seen = self.has_seen(users[rows], neg[rows, cols])
+            rows, cols = rows[is_seen], cols[is_seen]
+        return users, seq, pos, neg
+
+
+def shared_sample_function(shared_arrays, itemnum, batch_size, maxlen, result_queue, seed):
+    """Worker of SharedWarpSampler: attaches to the shared user histories and puts whole batches on the queue.
+
+    Args:
+        shared_arrays (dict): name -> (shared memory name, shape, dtype) of the UserHistoryCSR arrays
+        itemnum (int): number of items
+        batch_size (int): batch size
+        maxlen (int): maximum input sequence length
+        result_queue (multiprocessing.Queue): queue for storing sample results
+        seed (int): seed for random generator
+    """
+    blocks = {}
+    arrays = {}
+    for key, (shm_name, shape, dtype) in shared_arrays.items():
+        blocks[key] = shared_memory.SharedMemory(name=shm_name)
+        arrays[key] = np.ndarray(shape, dtype=dtype, buffer=blocks[key].buf)
+    history = UserHistoryCSR(arrays["offsets"], arrays["items"], arrays["keys"], itemnum)
+    rng = np.random.default_rng(seed)
+    while True:
+        result_queue.put(history.sample_batch(rng, batch_size, maxlen))
+
+
+class SharedWarpSampler(object):
+    """Drop-in replacement of WarpSampler. The user histories are placed once in shared memory as a
+    UserHistoryCSR, so workers do not each receive a pickled copy of User, and every batch is sampled
+    with array operations instead of per-sample loops.
+
+    Attributes:
+        User: dict, all the users (keys) with items as values
+        usernum: integer, total number of users
+        itemnum: integer, total number of items
+        batch_size (int): batch size
+        maxlen (int): maximum input sequence length
+        n_workers (int): number of workers for parallel execution
+    """
+
+    def __init__(self, User, usernum, itemnum, batch_size=64, maxlen=10, n_workers=1):
+
+        history = UserHistoryCSR.from_dict(User, usernum, itemnum)
+        self.blocks = []
+        shared_arrays = {}
+        for key, array in history.arrays().items():
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+            self.blocks.append(block)
+            shared_arrays[key] = (block.name, array.shape, array.dtype.str)
+
+        self.result_queue = Queue(maxsize=n_workers * 10)
+        self.processors = []
+        for i in range(n_workers):
+            self.processors.append(
+                Process(
+                    target=shared_sample_function,
+                    args=(
+                        shared_arrays,
+                        itemnum,
+                        batch_size,
+                        maxlen,
+                        self.result_queue,
+                        np.random.randint(2e9),
+                    ),
+                )
+            )
+            self.processors[-1].daemon = True
+            self.processors[-1].start()
+
+    def next_batch(self):
+        return self.result_queue.get()
+
+    def close(self):
+        for p in self.processors:
+            p.terminate()
+            p.join()
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
 # class PredictSampler(object):
 #     """Sampler object that creates an iterator for feeding batch data while predicting.
 
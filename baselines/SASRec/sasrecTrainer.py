@@ -0,0 +1,114 @@
+"""
+Train SASRec on the cross-domain interactions and score candidate matrices in raw IDs
+"""
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from sasrec.model import SASREC
+from sasrec.sampler import SharedWarpSampler
+from sasrec.util import SASRecDataSet
+from factorIndex import save_factors
+
+"""
+Hyperparameters
+"""
+max_len = 80
+hidden_units = 8
+batch_size = 128
+num_epochs = 3
+
+def train_sasrec(inter_all_DF, path="baselines/SASRec"):
+    '''
+    Map the raw IDs to labels from 1 (0 is padding), write the SASRec data file and fit the model.
+    Returns (model, data, user_map, item_map).
+    '''
+    inter_all_DF = (inter_all_DF.rename(columns={'user_id': 'userID', 'parent_asin': 'itemID', 'timestamp': 'time'})
+                    .sort_values(by=['userID', 'time'])
+                    .drop(['rating', 'time'], axis=1)
+                    .reset_index(drop=True)[["userID", "itemID"]])
+
+    user_set, item_set = set(inter_all_DF['userID'].unique()), set(inter_all_DF['itemID'].unique())
+    user_map = {user: idx + 1 for idx, user in enumerate(user_set)}
+    item_map = {item: idx + 1 for idx, item in enumerate(item_set)}
+
+    inter_all_DF["userID"] = inter_all_DF["userID"].map(user_map)
+    inter_all_DF["itemID"] = inter_all_DF["itemID"].map(item_map)
+
+    # Save SASRec data
+    inter_all_DF.to_csv(f'{path}/sasrec_data.txt', sep="\t", header=False, index=False)
+
+    # Save maps
+    with open(f'{path}/maps.pkl', 'wb') as f:
+        pickle.dump((user_map, item_map), f)
+
+    # Prepare the dataset
+    data = SASRecDataSet(f'{path}/sasrec_data.txt')
+    data.split()  # Train, validation, test split
+
+    model = SASREC(
+        item_num=data.itemnum,
+        seq_max_len=max_len,
+        num_blocks=1,
+        embedding_dim=hidden_units,
+        attention_dim=hidden_units,
+        attention_num_heads=1,
+        dropout_rate=0.4,
+        conv_dims=[hidden_units, hidden_units],
+        l2_reg=0.00001
+    )
+
+    # Workers share one copy of the training histories and sample whole batches
+    sampler = SharedWarpSampler(data.user_train, data.usernum, data.itemnum, batch_size=batch_size, maxlen=max_len, n_workers=min(4, os.cpu_count() or 1))
+    model.build((None, max_len))
+    model.train(
+        data,
+        sampler,
+        num_epochs=num_epochs,
+        batch_size=batch_size,
+        lr=0.001,
+        val_epoch=1,
+        val_target_user_n=100,
+        target_item_n=-1,
+        auto_save=True,
+        path=path,
+        exp_name='exp_example',
+    )
+    sampler.close()
+    return model, data, user_map, item_map
+
+def score_raw_candidates(model, data, user_map, item_map, user_ids, candidate_matrix):
+    '''
+    (n, k) scores of raw-ID candidates and a mask of the rows that could be scored:
+    label 0 is padding, so rows with an unknown user or item are left out
+    '''
+    user_array = np.array([user_map.get(userId, 0) for userId in user_ids], dtype=np.int64)
+    encoded_candidate_matrix = np.array([[item_map.get(itemId, 0) for itemId in row] for row in candidate_matrix], dtype=np.int64).reshape(np.shape(candidate_matrix))
+    is_valid = (user_array > 0) & (encoded_candidate_matrix > 0).all(axis=1)
+    score_matrix = np.zeros(np.shape(candidate_matrix), dtype=np.float32)
+    if is_valid.any():
+        # A handful of forward passes, each user's sequence is encoded once
+        score_matrix[is_valid] = model.score_candidates(data, user_array[is_valid], encoded_candidate_matrix[is_valid], batch_size=1024)
+    return score_matrix, is_valid
+
+def export_sasrec_factors(model, user_map, item_map, inter_train_DF, directory, batch_size=1024):
+    '''
+    Write the item embedding table and, for every user, the encoding of their training sequence only
+    (inter_train_DF, i.e. inter_crossdomain_timesequence_train.csv, in time order), in raw IDs, for ANN retrieval.
+    dataset.User holds the full sequences including the test interactions, so it is not used: a retriever
+    evaluated on the test split must not have seen the targets.
+    '''
+    train_DF = inter_train_DF[inter_train_DF["user_id"].isin(user_map.keys()) & inter_train_DF["parent_asin"].isin(item_map.keys())]
+    train_DF = train_DF.assign(time=pd.to_numeric(train_DF["timestamp"])).sort_values(by=["user_id", "time"], kind="stable")
+    user_sequences = train_DF.groupby("user_id", sort=False)["parent_asin"].apply(lambda items: [item_map[item_id] for item_id in items])
+    user_ids = user_sequences.index.tolist()
+    user_factors = np.zeros((len(user_ids), model.embedding_dim), dtype=np.float32)
+    for start in range(0, len(user_ids), batch_size):
+        seq = tf.keras.preprocessing.sequence.pad_sequences(
+            user_sequences.values[start:start + batch_size].tolist(), padding="pre", truncating="pre", maxlen=model.seq_max_len
+        )
+        user_factors[start:start + batch_size] = np.array(model.encode_sequences(seq))
+    item_ids = list(item_map)
+    item_emb = model.item_embedding_layer.embeddings.numpy()  # (item_num + 1, d), row 0 is padding
+    save_factors(directory, user_ids, user_factors, item_ids, item_emb[[item_map[item_id] for item_id in item_ids]], model_name="SASRec")
@@ -0,0 +1,61 @@
+"""
+Popularity scores of candidate matrices, from item metadata or from interactions before each test timestamp
+"""
+import numpy as np
+
+class PopularityScorer:
+    '''
+    Popularity held as an array indexed by item code; unknown items have popularity 0
+    '''
+    def __init__(self, item_ids, popularity):
+        self.item_index = {item_id: code for code, item_id in enumerate(item_ids)}
+        self.popularity = np.append(np.asarray(popularity, dtype=np.float64), 0)  # Last entry: unknown items
+
+    @classmethod
+    def from_rating_number(cls, itemDF):
+        '''
+        Static popularity: the number of ratings in the item metadata
+        '''
+        item_popularity = itemDF.drop_duplicates("parent_asin").set_index("parent_asin")["rating_number"]
+        return cls(item_popularity.index.tolist(), item_popularity.fillna(0).values)
+
+    @classmethod
+    def from_interactions(cls, item_column):
+        item_ids, counts = np.unique(np.asarray(item_column), return_counts=True)
+        return cls(item_ids.tolist(), counts)
+
+    def codes(self, item_ids):
+        unknown_code = len(self.item_index)
+        return np.array([self.item_index.get(item_id, unknown_code) for item_id in np.ravel(item_ids)], dtype=np.int64).reshape(np.shape(item_ids))
+
+    def score(self, candidate_matrix, timestamps=None):
+        return self.popularity[self.codes(candidate_matrix)]
+
+class TimeAwarePopularityScorer(PopularityScorer):
+    '''
+    Popularity of an item at a point in time: the number of its interactions strictly before that time,
+    so test interactions never count towards their own ranking
+    '''
+    def __init__(self, item_column, timestamp_column):
+        item_ids, item_codes = np.unique(np.asarray(item_column), return_inverse=True)
+        super().__init__(item_ids.tolist(), np.zeros(len(item_ids)))
+        self.timestamps = np.unique(np.asarray(timestamp_column, dtype=np.int64))
+        # Interactions sorted by (item code, time) as one sorted key array
+        self.keys = np.sort(item_codes.astype(np.int64) * (len(self.timestamps) + 1) + np.searchsorted(self.timestamps, np.asarray(timestamp_column, dtype=np.int64)))
+
+    def score(self, candidate_matrix, timestamps=None):
+        '''
+        (n, k) popularity of the candidates in row i at timestamps[i]
+        '''
+        codes = self.codes(candidate_matrix)
+        time_ranks = np.searchsorted(self.timestamps, np.asarray(timestamps, dtype=np.int64))  # Timestamps strictly earlier
+        stride = len(self.timestamps) + 1
+        counts = np.searchsorted(self.keys, codes * stride + time_ranks[:, None]) - np.searchsorted(self.keys, codes * stride)
+        return np.where(codes < len(self.item_index), counts, 0).astype(np.float64)
+
+def rank_candidates(candidate_matrix, score_matrix):
+    '''
+    Every row of candidates sorted by descending score in one argsort; ties keep their order
+    '''
+    order = np.argsort(-np.asarray(score_matrix), axis=1, kind="stable")
+    return np.take_along_axis(np.asarray(candidate_matrix), order, axis=1)
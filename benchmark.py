@@ -0,0 +1,301 @@
+"""
+Run the baselines and AgentCF variants on one shared candidate set and compare them in one table
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from config import domain_list, candidate_num, model, inter_data_source, item_data_source, random_domain_source_list, llmseqsim_embedding_source
+from dataPrepare import createItemDF
+from domainRegistry import DomainRegistry
+from evaluationMetrics import relevance_matrix, ranking_metrics
+
+"""
+Hyperparameters
+"""
+benchmark_methods = ["Pop", "Pop-time", "BPRMF", "SASRec", "LLMSeqSIM"]  # Keys of BENCHMARK_PLUGINS; "LLMRank", "AgentCF" and "AgentCF++" call the LLM
+benchmark_workers = 4  # Methods run in parallel, each in a fresh process
+benchmark_seed = 42  # Seed of the shared candidate set
+benchmark_sample_num = None  # Evaluate a seeded sample of this many test interactions instead of all of them
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+def save_table(directory, table_DF):
+    '''
+    Write a parsed table as one .npy file per column: numeric columns as they are, text columns as their
+    concatenated UTF-8 bytes with row offsets and a missing-value mask, so load_table can memory-map all of them
+    '''
+    os.makedirs(directory, exist_ok=True)
+    column_kinds = []
+    for code, column in enumerate(table_DF.columns):
+        values = table_DF[column]
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            np.save(os.path.join(directory, f"{code}.npy"), values.to_numpy())
+            column_kinds.append((column, "numeric"))
+            continue
+        is_missing = values.isna().to_numpy()
+        encoded = [b"" if missing else str(value).encode("utf-8") for value, missing in zip(values, is_missing)]
+        np.save(os.path.join(directory, f"{code}.data.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        np.save(os.path.join(directory, f"{code}.offsets.npy"), np.concatenate([[0], np.cumsum([len(value) for value in encoded], dtype=np.int64)]))
+        np.save(os.path.join(directory, f"{code}.missing.npy"), is_missing)
+        column_kinds.append((column, "text"))
+    with open(os.path.join(directory, "columns.json"), "w", encoding="utf-8") as file:
+        json.dump(column_kinds, file)
+
+def load_table(directory):
+    '''
+    Rebuild a table written by save_table; the column files are memory-mapped and only decoded, never parsed
+    '''
+    with open(os.path.join(directory, "columns.json"), "r", encoding="utf-8") as file:
+        column_kinds = json.load(file)
+    columns = {}
+    for code, (column, kind) in enumerate(column_kinds):
+        if kind == "numeric":
+            columns[column] = np.load(os.path.join(directory, f"{code}.npy"), mmap_mode="r")
+            continue
+        data = np.load(os.path.join(directory, f"{code}.data.npy"), mmap_mode="r")
+        offsets = np.load(os.path.join(directory, f"{code}.offsets.npy"), mmap_mode="r")
+        is_missing = np.load(os.path.join(directory, f"{code}.missing.npy"), mmap_mode="r")
+        text = bytes(data).decode("utf-8")
+        bounds = list(zip(offsets[:-1].tolist(), offsets[1:].tolist()))
+        if len(text) == len(data):
+            # Pure ASCII: byte offsets are character offsets
+            values = [text[start:stop] for start, stop in bounds]
+        else:
+            values = [bytes(data[start:stop]).decode("utf-8") for start, stop in bounds]
+        columns[column] = pd.Series(values).where(~np.asarray(is_missing), np.nan)
+    return pd.DataFrame(columns)
+
+class BenchmarkData:
+    '''
+    Everything the methods read: the interaction tables, the items and one candidate matrix shared by all methods,
+    so every method ranks exactly the same candidates. The runner parses the tables and samples the rows once and
+    writes both with save; workers open them with load, which memory-maps the row arrays and rebuilds a table from
+    its memory-mapped columns only when a method first reads it. Workers must not modify the data.
+    '''
+    ROW_ARRAYS = ("user_ids", "target_ids", "timestamps", "domain_idx", "candidate_matrix")
+    TABLES = ("inter_train_DF", "inter_all_DF", "itemDF")
+
+    def __init__(self, seed=42, sample_num=None):
+        self.table_dir = None
+        self.tables = {
+            "inter_train_DF": pd.read_csv(inter_data_source("train"), encoding="utf-8", dtype=str),
+            "inter_all_DF": pd.read_csv(inter_data_source("all"), encoding="utf-8", dtype=str),
+            "itemDF": createItemDF(item_data_source),
+        }
+        inter_test_DF = pd.read_csv(inter_data_source("test"), encoding="utf-8", dtype=str)
+
+        # Candidates of the whole test set from the random selection datasets
+        domain_registry = DomainRegistry.from_sources(domain_list, random_domain_source_list)
+        item_main_category = dict(zip(self.itemDF["parent_asin"], self.itemDF["main_category"]))
+        domain_idx_list = [domain_registry.index_of(item_main_category.get(target_itemId)) for target_itemId in inter_test_DF["parent_asin"]]
+        rng = np.random.default_rng(seed)
+        candidate_matrix, is_valid = domain_registry.candidate_matrix(domain_idx_list, inter_test_DF["user_id"].tolist(), inter_test_DF["parent_asin"].tolist(), candidate_num, rng=rng)
+        rows = np.flatnonzero(is_valid)
+        if sample_num is not None:
+            rows = np.sort(rng.permutation(rows)[:sample_num])
+
+        # Fixed-width string arrays, so the saved rows can be memory-mapped
+        self.user_ids = np.asarray(inter_test_DF["user_id"].values[rows], dtype=str)
+        self.target_ids = np.asarray(inter_test_DF["parent_asin"].values[rows], dtype=str)
+        self.timestamps = np.asarray(inter_test_DF["timestamp"].values[rows], dtype=str)
+        self.domain_idx = np.array([domain_idx_list[row] for row in rows], dtype=np.int64)
+        self.candidate_matrix = np.asarray(candidate_matrix[rows], dtype=str)
+
+    def table(self, name):
+        if name not in self.tables:
+            self.tables[name] = load_table(os.path.join(self.table_dir, name))
+        return self.tables[name]
+
+    @property
+    def inter_train_DF(self):
+        return self.table("inter_train_DF")
+
+    @property
+    def inter_all_DF(self):
+        return self.table("inter_all_DF")
+
+    @property
+    def itemDF(self):
+        return self.table("itemDF")
+
+    def save(self, directory):
+        for name in self.ROW_ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        for name in self.TABLES:
+            save_table(os.path.join(directory, name), self.table(name))
+
+    @classmethod
+    def load(cls, directory):
+        data = cls.__new__(cls)
+        data.table_dir = directory
+        data.tables = {}
+        for name in cls.ROW_ARRAYS:
+            setattr(data, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r"))
+        return data
+
+    @property
+    def num_rows(self):
+        return len(self.target_ids)
+
+    def item_title_dict(self):
+        return dict(zip(self.itemDF["parent_asin"], self.itemDF["title"].map(str)))
+
+    def user_items(self):
+        '''
+        {user_id: [parent_asin, ...]} of the training interactions, in time order
+        '''
+        return self.inter_train_DF.groupby('user_id')['parent_asin'].apply(list).to_dict()
+
+def use_baseline(*subdirs):
+    # The baselines import their helper modules from their own directory
+    path = os.path.join(BASELINE_DIR, *subdirs)
+    if path not in sys.path:
+        sys.path.append(path)
+
+"""
+Plugins: each takes the BenchmarkData and returns the (n, candidate_num) relevance matrix of its rankings
+"""
+def run_pop(data):
+    use_baseline()
+    from popularityScorer import PopularityScorer
+    score_matrix = PopularityScorer.from_rating_number(data.itemDF).score(data.candidate_matrix)
+    return relevance_matrix(data.candidate_matrix, score_matrix, data.target_ids)
+
+def run_time_aware_pop(data):
+    use_baseline()
+    from popularityScorer import TimeAwarePopularityScorer
+    popularity_scorer = TimeAwarePopularityScorer(data.inter_all_DF["parent_asin"].values, data.inter_all_DF["timestamp"].values)
+    score_matrix = popularity_scorer.score(data.candidate_matrix, data.timestamps)
+    return relevance_matrix(data.candidate_matrix, score_matrix, data.target_ids)
+
+def run_bprmf(data):
+    use_baseline("BRPMF")
+    from bprmf import train_bpr
+    # Unknown users and items get the default score
+    score_matrix = train_bpr(data.inter_train_DF).score_batches(data.user_ids.tolist(), data.candidate_matrix.tolist())
+    return relevance_matrix(data.candidate_matrix, score_matrix, data.target_ids)
+
+def run_sasrec(data):
+    use_baseline("SASRec")
+    from sasrecTrainer import train_sasrec, score_raw_candidates
+    model, sasrec_data, user_map, item_map = train_sasrec(data.inter_all_DF, path=os.path.join(BASELINE_DIR, "SASRec"))
+    # Rows the model cannot score keep score 0 for all candidates, i.e. their shuffled order
+    score_matrix, _ = score_raw_candidates(model, sasrec_data, user_map, item_map, data.user_ids, data.candidate_matrix)
+    return relevance_matrix(data.candidate_matrix, score_matrix, data.target_ids)
+
+def run_llmseqsim(data):
+    use_baseline("LLMSeqSIM")
+    from embeddingStore import EmbeddingStore, cosine_scores
+    item_store = EmbeddingStore.load(llmseqsim_embedding_source("item"))
+    user_store = EmbeddingStore.load(llmseqsim_embedding_source("user"))
+    score_matrix = cosine_scores(user_store, item_store, data.user_ids, data.candidate_matrix)
+    return relevance_matrix(data.candidate_matrix, score_matrix, data.target_ids)
+
+def run_llmrank(data):
+    use_baseline("LLMRank")
+    from historyRenderer import HistoryRenderer
+    from LLMRank import llmrank_relevance, history_token_budget
+    history_renderer = HistoryRenderer(data.itemDF, data.user_items(), token_budget=history_token_budget, model=model)
+    item_title_dict = data.item_title_dict()
+    return np.array([llmrank_relevance(history_renderer, item_title_dict, userId, random_itemId_list.tolist(), target_itemId)
+                     for userId, target_itemId, random_itemId_list in zip(data.user_ids, data.target_ids, data.candidate_matrix)], dtype=np.int64)
+
+def run_agentcf_variant(data, exp_name, is_plus):
+    '''
+    Rank with the memories trained by AgentCF (is_plus False) or AgentCF++ under the basic prompt strategy.
+    A test interaction without user memory ranks its target last, so all methods keep the same rows.
+    '''
+    from memoryStore import open_memory_store
+    from agentRanker import AgentRanker
+    from user_group_mem.groupMembership import load_group_membership
+
+    group_membership = load_group_membership(" ".join(domain_list)) if is_plus else None
+    agent_ranker = AgentRanker(open_memory_store(f"memory/{exp_name}"), data.item_title_dict(), is_plus=is_plus, group_membership=group_membership)
+    relevance_rows = []
+    for userId, target_itemId, domain_idx, random_itemId_list in zip(data.user_ids, data.target_ids, data.domain_idx, data.candidate_matrix):
+        random_itemId_list = random_itemId_list.tolist()
+        try:
+            relevance_rows.append(agent_ranker.relevance(userId, domain_idx, random_itemId_list, random_itemId_list.index(target_itemId)))
+        except Exception as e:
+            print(f"Error processing user {userId}: {e}")
+            relevance_rows.append([0] * (candidate_num - 1) + [1])
+    return np.array(relevance_rows, dtype=np.int64).reshape(-1, candidate_num)
+
+def run_agentcf(data):
+    return run_agentcf_variant(data, "AgentCF" + " " + " ".join(domain_list), is_plus=False)
+
+def run_agentcf_plus(data):
+    return run_agentcf_variant(data, "AgentCF++" + " " + " ".join(domain_list), is_plus=True)
+
+BENCHMARK_PLUGINS = {
+    "Pop": run_pop,
+    "Pop-time": run_time_aware_pop,
+    "BPRMF": run_bprmf,
+    "SASRec": run_sasrec,
+    "LLMSeqSIM": run_llmseqsim,
+    "LLMRank": run_llmrank,
+    "AgentCF": run_agentcf,
+    "AgentCF++": run_agentcf_plus,
+}
+
+_benchmark_data = None
+
+def _init_worker(data_dir):
+    # Every worker maps the data saved by the runner instead of receiving a pickled copy or parsing the sources again
+    global _benchmark_data
+    _benchmark_data = BenchmarkData.load(data_dir)
+
+def run_method(method):
+    '''
+    Run one plugin in a worker; returns (method, wall-clock seconds, metrics)
+    '''
+    start = time.perf_counter()
+    method_relevance_matrix = BENCHMARK_PLUGINS[method](_benchmark_data)
+    return method, time.perf_counter() - start, ranking_metrics(method_relevance_matrix)
+
+def format_table(results, metric_names=("NDCG@10", "NDCG@5", "NDCG@1", "MRR")):
+    lines = [f"{'Method':<12}{'Seconds':>10}" + "".join(f"{name:>10}" for name in metric_names)]
+    for method, seconds, metrics in results:
+        if metrics is None:
+            lines.append(f"{method:<12}{seconds:>10.1f}  failed")
+        else:
+            lines.append(f"{method:<12}{seconds:>10.1f}" + "".join(f"{metrics[name]:>10.4f}" for name in metric_names))
+    return "\n".join(lines)
+
+def run_benchmark(methods, workers=4, seed=42, sample_num=None):
+    '''
+    Parse the tables and sample the shared rows once, then run the methods in parallel processes; each method gets
+    a fresh process so model state and memory are released when it finishes (max_tasks_per_child, Python 3.11 or later).
+    Failing methods are reported in the table.
+    '''
+    unknown_methods = [method for method in methods if method not in BENCHMARK_PLUGINS]
+    if unknown_methods:
+        raise ValueError(f"Unknown benchmark methods: {unknown_methods}")
+    data = BenchmarkData(seed=seed, sample_num=sample_num)
+    print(f"{data.num_rows} test interactions, {candidate_num} candidates each")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as data_dir:
+        data.save(data_dir)
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(methods))), initializer=_init_worker, initargs=(data_dir,), max_tasks_per_child=1) as executor:
+            start_times = {method: time.perf_counter() for method in methods}
+            futures = {method: executor.submit(run_method, method) for method in methods}
+            for method, future in futures.items():
+                try:
+                    results[method] = future.result()
+                except Exception as e:
+                    print(f"{method} failed: {e}")
+                    results[method] = (method, time.perf_counter() - start_times[method], None)
+    return data, [results[method] for method in methods]
+
+if __name__ == "__main__":
+    data, results = run_benchmark(benchmark_methods, workers=benchmark_workers, seed=benchmark_seed, sample_num=benchmark_sample_num)
+    table = format_table(results)
+    print(table)
+    with open("./log/result.txt", mode="a", encoding="utf-8") as file:
+        file.write(f"Benchmark {' '.join(domain_list)}:\nSeed: {benchmark_seed}, test interactions: {data.num_rows}, candidates: {candidate_num}\n{table}\n\n")
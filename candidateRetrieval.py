@@ -0,0 +1,97 @@
+"""
+First-stage candidate retrievers: top-N items of the target domain per user, from popularity, exported factors or memory embeddings
+"""
+import os
+import numpy as np
+from config import domain_list
+from factorIndex import FactorRetriever, save_factors, build_factor_index
+
+class CandidateRetriever:
+    '''
+    retrieve(user_ids, domain_idx_list, top_n, exclude_items) -> for every request the top_n item IDs of its domain, best first.
+    item_domain maps item IDs to domain indices; exclude_items[i] holds the items never returned for request i.
+    '''
+    def __init__(self, item_domain):
+        self.item_domain = item_domain
+
+    def retrieve(self, user_ids, domain_idx_list, top_n, exclude_items=None):
+        raise NotImplementedError
+
+class PopularityRetriever(CandidateRetriever):
+    '''
+    The most popular items of the domain; one sorted item list per domain is computed up front
+    '''
+    def __init__(self, item_ids, popularity, item_domain):
+        super().__init__(item_domain)
+        order = np.argsort(-np.asarray(popularity, dtype=np.float64), kind="stable")
+        self.domain_ranking = {}
+        for item_id in np.asarray(item_ids)[order].tolist():
+            domain_idx = item_domain.get(item_id)
+            if domain_idx is not None:
+                self.domain_ranking.setdefault(domain_idx, []).append(item_id)
+
+    def retrieve(self, user_ids, domain_idx_list, top_n, exclude_items=None):
+        candidate_lists = []
+        for i, domain_idx in enumerate(domain_idx_list):
+            excluded = set(exclude_items[i]) if exclude_items is not None else set()
+            candidates = []
+            for item_id in self.domain_ranking.get(domain_idx, []):
+                if item_id not in excluded:
+                    candidates.append(item_id)
+                    if len(candidates) == top_n:
+                        break
+            candidate_lists.append(candidates)
+        return candidate_lists
+
+class FactorCandidateRetriever(CandidateRetriever):
+    '''
+    ANN retrieval from a factor export (BPR or SASRec, see factorIndex). The index covers all domains, so
+    overfetch times more items are requested and the items of other domains are dropped.
+    '''
+    def __init__(self, factor_dir, item_domain, overfetch=4):
+        super().__init__(item_domain)
+        self.factor_retriever = FactorRetriever(factor_dir)
+        self.overfetch = overfetch
+
+    def filter_domains(self, item_lists, domain_idx_list, top_n):
+        return [[item_id for item_id in item_list if self.item_domain.get(item_id) == domain_idx][:top_n] for item_list, domain_idx in zip(item_lists, domain_idx_list)]
+
+    def retrieve(self, user_ids, domain_idx_list, top_n, exclude_items=None):
+        item_lists = self.factor_retriever.retrieve(user_ids, top_n * self.overfetch, exclude_items)
+        return self.filter_domains(item_lists, domain_idx_list, top_n)
+
+class MemoryEmbeddingRetriever(FactorCandidateRetriever):
+    '''
+    Items whose memory embeddings are closest to the embedding of the user's memory for the target domain.
+    The item side is a factor export built once by build_memory_item_index; user memories are embedded at query time
+    (through the embedding cache, so repeated users cost nothing).
+    '''
+    def __init__(self, factor_dir, item_domain, memory_store, embedding_client, embedding_dim=None, overfetch=4):
+        super().__init__(factor_dir, item_domain, overfetch)
+        self.memory_store = memory_store
+        self.embedding_client = embedding_client
+        self.embedding_dim = embedding_dim
+
+    def user_memory_text(self, user_id, main_kind):
+        for key in (f"user/user.{user_id}/crossDomain-{main_kind}.txt", f"user/user.{user_id}/private-{main_kind}.txt"):
+            if self.memory_store.exists(key):
+                return self.memory_store.read(key)
+        return ""
+
+    def retrieve(self, user_ids, domain_idx_list, top_n, exclude_items=None):
+        texts = [self.user_memory_text(user_id, domain_list[domain_idx]) for user_id, domain_idx in zip(user_ids, domain_idx_list)]
+        query_vectors = self.embedding_client.embed(texts, dim=self.embedding_dim)
+        item_lists = self.factor_retriever.retrieve_vectors(query_vectors, top_n * self.overfetch, exclude_items)
+        return self.filter_domains(item_lists, domain_idx_list, top_n)
+
+def build_memory_item_index(memory_store, embedding_client, item_ids, factor_dir, embedding_dim=None, method="hnsw"):
+    '''
+    Embed the memory of every item once and save the embeddings with their ANN index as an item-only factor export
+    '''
+    item_ids = [item_id for item_id in item_ids if memory_store.exists(f"item/item.{item_id}")]
+    item_vectors = embedding_client.embed([memory_store.read(f"item/item.{item_id}") for item_id in item_ids], dim=embedding_dim)
+    save_factors(factor_dir, [], np.zeros((0, item_vectors.shape[1]), dtype=np.float32), item_ids, item_vectors, model_name="memory")
+    return build_factor_index(factor_dir, method=method)
+
+def memory_index_exists(factor_dir):
+    return os.path.exists(os.path.join(factor_dir, "meta.json"))
@@ -12,6 +12,10 @@ candidate_num = 10
 model = "gpt-4o-mini"  # Model type
 prompt_strategy = "B"
 evaluation_times = 1
+is_sampled_evaluation = False  # Evaluate a stratified sample of the test set instead of all of it
+evaluation_ci_width = 0.05  # Stop sampling once the 95% CIs of NDCG@10 and MRR are narrower than this
+evaluation_llm_budget = None  # Stop sampling after this many ranking LLM calls
+candidate_id_style = "title"  # How candidates are referred to in ranking prompts: "title", "letter" (A-J) or "asin"
 # domain_list = ["Books", "CDs_and_Vinyl", "Movies_and_TV"]
 # domain_list = ["Video_Games", "CDs_and_Vinyl", "Movies_and_TV"]
 domain_list = ["Books", "Video_Games", "Movies_and_TV"]
@@ -26,15 +30,29 @@ def inter_data_source(mode):
 def get_main_kind(domain):
     return domain_main_category_dict[domain]
 
-random_domain0_source = f"dataset\\crossDomainData\\user_item_data\\{' '.join(domain_list)}\\random\\random_{domain_list[0]}.csv"
-random_domain1_source = f"dataset\\crossDomainData\\user_item_data\\{' '.join(domain_list)}\\random\\random_{domain_list[1]}.csv"
-random_domain2_source = f"dataset\\crossDomainData\\user_item_data\\{' '.join(domain_list)}\\random\\random_{domain_list[2]}.csv"
-random_domain3_source = ''
-if len(domain_list) == 4:
-    random_domain3_source = f"dataset\\crossDomainData\\user_item_data\\{' '.join(domain_list)}\\random\\random_{domain_list[3]}.csv"
+# Negative candidate pool of every domain, in domain_list order
+random_domain_source_list = [f"dataset\\crossDomainData\\user_item_data\\{' '.join(domain_list)}\\random\\random_{domain}.csv" for domain in domain_list]
 
 item_data_source = f"dataset\\crossDomainData\\user_item_data\\{' '.join(domain_list)}\\meta_crossdomain.csv"
 
 group_Mem_length = 5
 group_n_cluster = 384
-is_use_intermediate_node = True
\ No newline at end of file
+is_use_intermediate_node = True
+memory_format = "directory"  # "directory" (one file per memory) or "archive" (packed memory.data + offset table)
+is_memory_compressed = False  # zstd-compress archive records (requires zstandard)
+is_live_group_memory = False  # Maintain group memory during training from an existing user grouping
+# Token caps of the memory sections in prompts; memories over their cap are compacted by the LLM in the background
+prompt_section_token_caps = {"user_memory": 300, "cross_domain_memory": 320, "item_memory": 200}
+is_memory_compaction = True
+# Two-stage inference (AgentCF++Recommend.py): a fast retriever picks the top items of the target domain, only those are ranked by the LLM
+retriever_type = "bpr"  # "popularity", "bpr", "sasrec" or "memory" (embeddings of user and item memories)
+retrieval_top_n = 20  # Candidates passed to the ranking prompt: fewer is faster, more finds the target more often
+retrieval_factor_dir_dict = {"bpr": f"baselines/BRPMF/factors/{' '.join(domain_list)}", "sasrec": f"baselines/SASRec/factors/{' '.join(domain_list)}"}
+retrieval_embedding_model = "text-embedding-3-small"
+retrieval_embedding_dim = 256
+# LLMSeqSIM embeddings: written by all_item_embedding.py and LLMSeqSIM.py, read by LLMSeqSIM/Test.py and benchmark.py
+llmseqsim_embedding_dir = "baselines/LLMSeqSIM"
+
+def llmseqsim_embedding_source(kind):
+    # kind: "item" or "user"
+    return f"{llmseqsim_embedding_dir}/{kind}_embeddings_{' '.join(domain_list)}.pkl"
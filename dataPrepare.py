@@ -1,7 +1,9 @@
 import pandas as pd
 import os
 import shutil
-from config import inter_data_source, item_data_source, random_domain0_source, random_domain1_source, random_domain2_source, random_domain3_source
+from memoryStore import open_memory_store
+from config import inter_data_source, item_data_source, random_domain_source_list
+from domainRegistry import DomainRegistry
 
 def createRandomDF(file_path):
     return pd.read_csv(file_path, dtype=str)
@@ -18,6 +20,117 @@ def createInterDF(file_path):
     '''
     return pd.read_csv(file_path)
 
+class InteractionReader:
+    '''
+    Stream the interaction dataset in time order in fixed-size chunks without loading the whole file.
+    Supports CSV files with one interaction per line and, when pyarrow is installed, Parquet files.
+    A row window [start, stop) is read by seeking past the preceding rows, so only the window is materialized.
+    '''
+    def __init__(self, file_path, chunksize=100000, dtype=None):
+        self.file_path = file_path
+        self.chunksize = chunksize
+        self.dtype = dtype
+        self.is_parquet = file_path.endswith(".parquet")
+        self._num_rows = None
+        self._columns = None
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            if self.is_parquet:
+                import pyarrow.parquet as pq
+                self._columns = pq.ParquetFile(self.file_path).schema_arrow.names
+            else:
+                self._columns = list(pd.read_csv(self.file_path, nrows=0).columns)
+        return self._columns
+
+    def count_rows(self):
+        '''
+        Number of interactions, from Parquet metadata or by counting lines in binary blocks
+        '''
+        if self._num_rows is None:
+            if self.is_parquet:
+                import pyarrow.parquet as pq
+                self._num_rows = pq.ParquetFile(self.file_path).metadata.num_rows
+            else:
+                num_lines = 0
+                last_block = b""
+                with open(self.file_path, "rb") as file:
+                    for block in iter(lambda: file.read(1 << 24), b""):
+                        num_lines += block.count(b"\n")
+                        last_block = block
+                if last_block and not last_block.endswith(b"\n"):
+                    num_lines += 1
+                self._num_rows = max(num_lines - 1, 0)  # Header line
+        return self._num_rows
+
+    def _seek_csv(self, file, start):
+        # Skip the header and the first start rows line by line, without parsing them
+        file.readline()
+        for _ in range(start):
+            if not file.readline():
+                break
+
+    def iter_batches(self, start=0, stop=None):
+        '''
+        Yield DataFrames of at most chunksize rows covering rows [start, stop), indexed by global row number
+        '''
+        stop = self.count_rows() if stop is None else min(stop, self.count_rows())
+        if start >= stop:
+            return
+        if self.is_parquet:
+            import pyarrow.parquet as pq
+            parquet_file = pq.ParquetFile(self.file_path)
+            row_offset = 0
+            for row_group in range(parquet_file.num_row_groups):
+                num_group_rows = parquet_file.metadata.row_group(row_group).num_rows
+                if row_offset + num_group_rows > start and row_offset < stop:
+                    for batch in parquet_file.iter_batches(batch_size=self.chunksize, row_groups=[row_group]):
+                        batch_df = batch.to_pandas()
+                        batch_df.index = pd.RangeIndex(row_offset, row_offset + len(batch_df))
+                        row_offset += len(batch_df)
+                        batch_df = batch_df.loc[max(start, batch_df.index[0]):min(stop, row_offset) - 1]
+                        if len(batch_df):
+                            yield batch_df.astype(self.dtype) if self.dtype is not None else batch_df
+                        if row_offset >= stop:
+                            return
+                else:
+                    row_offset += num_group_rows
+                if row_offset >= stop:
+                    return
+            return
+        with open(self.file_path, "r", encoding="utf-8", newline="") as file:
+            self._seek_csv(file, start)
+            row_offset = start
+            for batch_df in pd.read_csv(file, header=None, names=self.columns, dtype=self.dtype, chunksize=self.chunksize, nrows=stop - start):
+                batch_df.index = pd.RangeIndex(row_offset, row_offset + len(batch_df))
+                row_offset += len(batch_df)
+                yield batch_df
+
+    def iter_records(self, start=0, stop=None):
+        '''
+        Yield (row number, record dict) pairs in time order, like DataFrame.iterrows without building the DataFrame
+        '''
+        for batch_df in self.iter_batches(start, stop):
+            for index, record in zip(batch_df.index, batch_df.to_dict("records")):
+                yield index, record
+
+    def read(self, start=0, stop=None):
+        '''
+        Materialize rows [start, stop) as one DataFrame
+        '''
+        batches = list(self.iter_batches(start, stop))
+        if not batches:
+            return pd.DataFrame(columns=self.columns)
+        return pd.concat(batches)
+
+    def read_ratio_window(self, start_ratio, end_ratio):
+        '''
+        Materialize the rows between two fractions of the dataset
+        '''
+        num_rows = self.count_rows()
+        return self.read(int(num_rows * start_ratio), int(num_rows * end_ratio))
+
 def prepare_data_from_interDF(mode, domain_list, crossDomain):
     '''
     Collect users and items from interDF
@@ -55,10 +168,7 @@ def prepare_data_from_interDF(mode, domain_list, crossDomain):
 
     # Initialize user memory
     for userId in interDF['user_id'].values:
-        if len(domain_list) == 4:
-            init_user_memory = f"I enjoy {domain_list[0]}, {domain_list[1]}, {domain_list[2]} and {domain_list[3]} very much."
-        else:
-            init_user_memory = f"I enjoy {domain_list[0]}, {domain_list[1]} and {domain_list[2]} very much."
+        init_user_memory = f"I enjoy {', '.join(domain_list[:-1])} and {domain_list[-1]} very much."
 
         output_dir = f".\\dataset\\crossDomainData\\initial\\{' '.join(domain_list)}\\user"
         os.makedirs(output_dir, exist_ok=True)  # Create the folder if it doesn't exist
@@ -75,78 +185,30 @@ def prepare_initial_mem_from_interDF(mode, domain_list):
     interDF = createInterDF(inter_data_source(mode))
     itemDF = createItemDF(item_data_source)
 
-    random_domain0_df = createRandomDF(random_domain0_source)
-    random_domain1_df = createRandomDF(random_domain1_source)
-    random_domain2_df = createRandomDF(random_domain2_source)
-    if len(domain_list) == 4:
-        random_domain3_df = createRandomDF(random_domain3_source)
+    domain_registry = DomainRegistry.from_sources(domain_list, random_domain_source_list)
+    # Initial memories are written to a memory store (one file per memory or a packed archive, see memory_format)
+    memory_store = open_memory_store(f"dataset/crossDomainData/initial/{' '.join(domain_list)}/AgentCF++")
 
-    itemList = set(interDF["parent_asin"])
-
-    # Initialize item memory
-    for itemId in itemList:
-        item_main_category = itemDF[itemDF['parent_asin'] == itemId]['main_category'].values[0]
-        item_title = itemDF[itemDF['parent_asin'] == itemId]['title'].values[0]
-        item_subtitle = itemDF[itemDF['parent_asin'] == itemId]['subtitle'].values[0]
-        item_class = itemDF[itemDF['parent_asin'] == itemId]['categories'].values[0]
-        item_price = itemDF[itemDF['parent_asin'] == itemId]['price'].values[0]
-
-        init_item_memory = f"'main_category':{item_main_category}, 'item_title': '{item_title}', 'item_subtitle': '{item_subtitle}', 'item_class': '{item_class}', 'item_price': '{item_price}'"
-        
-        output_dir = f".\\dataset\\crossDomainData\\initial\\{' '.join(domain_list)}\\AgentCF++\\item"
-        os.makedirs(output_dir, exist_ok=True)  # Create the folder if it doesn't exist
-        with open(f".\\dataset\\crossDomainData\\initial\\{' '.join(domain_list)}\\AgentCF++\\item\\item.{itemId}", "w", encoding="utf-8") as file:
-            file.write(init_item_memory)
+    # Initialize item memory: one merge for the attributes of all items
+    item_attr_df = pd.DataFrame({"parent_asin": interDF["parent_asin"].unique()}).merge(
+        itemDF.drop_duplicates("parent_asin")[["parent_asin", "main_category", "title", "subtitle", "categories", "price"]], on="parent_asin", how="left")
+    memory_store.write_many([
+        (f"item/item.{itemId}", f"'main_category':{item_main_category}, 'item_title': '{item_title}', 'item_subtitle': '{item_subtitle}', 'item_class': '{item_class}', 'item_price': '{item_price}'")
+        for itemId, item_main_category, item_title, item_subtitle, item_class, item_price in zip(
+            item_attr_df["parent_asin"], item_attr_df["main_category"], item_attr_df["title"], item_attr_df["subtitle"], item_attr_df["categories"], item_attr_df["price"])
+    ])
 
     # Determine which domains each user interacted with
-    user_domains = {}
-    # Iterate through each user
-    for index, row in random_domain0_df.iterrows():
-        user_id = row['Unnamed: 0']  # Get user ID
-        item_types = []
-        # Check df1
-        if not row.iloc[1:].eq('0').all():  # Check from the second column
-            item_types.append(domain_list[0])
-        # Check df2
-        if not random_domain1_df.loc[random_domain1_df['Unnamed: 0'] == user_id].iloc[0, 1:].eq('0').all():
-            item_types.append(domain_list[1])
-        # Check df3
-        if not random_domain2_df.loc[random_domain2_df['Unnamed: 0'] == user_id].iloc[0, 1:].eq('0').all():
-            item_types.append(domain_list[2])
-        if len(domain_list) == 4 and not random_domain3_df.loc[random_domain3_df['Unnamed: 0'] == user_id].iloc[0, 1:].eq('0').all():
-            item_types.append(domain_list[3])
-        # Store the item types that the user interacted with
-        user_domains[user_id] = item_types
+    user_ids = interDF["user_id"].unique()
+    user_domain_matrix = domain_registry.user_domain_matrix(user_ids)
 
     # Initialize user memory
-    for userId in interDF['user_id'].values:
-        if not os.path.exists(f".\\dataset\\crossDomainData\\initial\\{' '.join(domain_list)}\\AgentCF++\\user\\user.{userId}"):
-            os.makedirs(f".\\dataset\\crossDomainData\\initial\\{' '.join(domain_list)}\\AgentCF++\\user\\user.{userId}")
-
-        if domain_list[0] in user_domains[userId]:
-            init_user_memory_domain0 = f"I am an Amazon buyer, and I enjoy {domain_list[0]} very much."
-            with open(f".\\dataset\\crossDomainData\\initial\\{' '.join(domain_list)}\\AgentCF++\\user\\user.{userId}\\private-{domain_list[0]}.txt", "w", encoding="utf-8") as file:
-                file.write(init_user_memory_domain0)
-            with open(f".\\dataset\\crossDomainData\\initial\\{' '.join(domain_list)}\\AgentCF++\\user\\user.{userId}\\crossDomain-{domain_list[0]}.txt", "w", encoding="utf-8") as file:
-                file.write(init_user_memory_domain0)
-
-        if domain_list[1] in user_domains[userId]:
-            init_user_memory_domain1 = f"I am an Amazon buyer, and I enjoy {domain_list[1]} very much."
-            with open(f".\\dataset\\crossDomainData\\initial\\{' '.join(domain_list)}\\AgentCF++\\user\\user.{userId}\\private-{domain_list[1]}.txt", "w", encoding="utf-8") as file:
-                file.write(init_user_memory_domain1)
-            with open(f".\\dataset\\crossDomainData\\initial\\{' '.join(domain_list)}\\AgentCF++\\user\\user.{userId}\\crossDomain-{domain_list[1]}.txt", "w", encoding="utf-8") as file:
-                file.write(init_user_memory_domain1)
-
-        if domain_list[2] in user_domains[userId]:
-            init_user_memory_domain2 = f"I am an Amazon buyer, and I enjoy {domain_list[2]} very much."
-            with open(f".\\dataset\\crossDomainData\\initial\\{' '.join(domain_list)}\\AgentCF++\\user\\user.{userId}\\private-{domain_list[2]}.txt", "w", encoding="utf-8") as file:
-                file.write(init_user_memory_domain2)
-            with open(f".\\dataset\\crossDomainData\\initial\\{' '.join(domain_list)}\\AgentCF++\\user\\user.{userId}\\crossDomain-{domain_list[2]}.txt", "w", encoding="utf-8") as file:
-                file.write(init_user_memory_domain2)
-            
-        if len(domain_list) == 4 and domain_list[3] in user_domains[userId]:
-            init_user_memory_domain3 = f"I am an Amazon buyer, and I enjoy {domain_list[3]} very much."
-            with open(f".\\dataset\\crossDomainData\\initial\\{' '.join(domain_list)}\\AgentCF++\\user\\user.{userId}\\private-{domain_list[3]}.txt", "w", encoding="utf-8") as file:
-                file.write(init_user_memory_domain3)
-            with open(f".\\dataset\\crossDomainData\\initial\\{' '.join(domain_list)}\\AgentCF++\\user\\user.{userId}\\crossDomain-{domain_list[3]}.txt", "w", encoding="utf-8") as file:
-                file.write(init_user_memory_domain3)
\ No newline at end of file
+    key_text_list = []
+    for userId, user_domains in zip(user_ids, user_domain_matrix):
+        for domain, has_domain in zip(domain_list, user_domains):
+            if has_domain:
+                init_user_memory = f"I am an Amazon buyer, and I enjoy {domain} very much."
+                key_text_list.append((f"user/user.{userId}/private-{domain}.txt", init_user_memory))
+                key_text_list.append((f"user/user.{userId}/crossDomain-{domain}.txt", init_user_memory))
+    memory_store.write_many(key_text_list)
+    memory_store.flush()
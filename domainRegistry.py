@@ -0,0 +1,97 @@
+"""
+Table-driven dispatch over the experiment domains
+"""
+import random
+import numpy as np
+import pandas as pd
+from config import get_main_kind
+
+class DomainRegistry:
+    '''
+    Map an item's main_category to its domain index in O(1) and hold the per-domain negative candidate pools
+    (the random_{domain}.csv tables) as arrays: one row of item IDs per user.
+    Works for any number of domains.
+    '''
+    def __init__(self, domain_list, random_df_list=()):
+        self.domain_list = list(domain_list)
+        self.main_kind_list = [get_main_kind(domain) for domain in self.domain_list]
+        self.domain_index = {main_kind: idx for idx, main_kind in enumerate(self.main_kind_list)}
+        self.neg_pools = []  # Per domain: (num_users, n_random_item) array of item IDs
+        self.neg_user_index = []  # Per domain: user_id -> row of the pool
+        for random_df in random_df_list:
+            self.add_negative_pool(random_df)
+
+    @classmethod
+    def from_sources(cls, domain_list, random_source_list):
+        return cls(domain_list, [pd.read_csv(random_source, dtype=str) for random_source in random_source_list])
+
+    def add_negative_pool(self, random_df):
+        item_columns = [column for column in random_df.columns if column.startswith("item_")]
+        self.neg_pools.append(random_df[item_columns].to_numpy(dtype=str))
+        user_index = {}
+        for row, user_id in enumerate(random_df["Unnamed: 0"].values):
+            user_index.setdefault(user_id, row)  # The first row of a user wins, as with .values[0]
+        self.neg_user_index.append(user_index)
+
+    @property
+    def num_domains(self):
+        return len(self.domain_list)
+
+    def index_of(self, main_kind):
+        '''
+        Domain index of a main_category, or None if it belongs to no experiment domain
+        '''
+        return self.domain_index.get(str(main_kind).strip())
+
+    def neg_pool(self, domain_idx, user_id):
+        return self.neg_pools[domain_idx][self.neg_user_index[domain_idx][user_id]]
+
+    def sample_neg_item(self, domain_idx, user_id):
+        if domain_idx is None:
+            raise ValueError("Item does not belong to any experiment domain")
+        pool = self.neg_pool(domain_idx, user_id)
+        return pool[random.randint(0, len(pool) - 1)]
+
+    def sample_candidates(self, domain_idx, user_id, target_item_id, candidate_num):
+        '''
+        candidate_num - 1 random negatives from the user's pool in the target's domain, followed by the target
+        '''
+        pool = self.neg_pool(domain_idx, user_id)
+        return [pool[random.randint(0, len(pool) - 1)] for _ in range(candidate_num - 1)] + [target_item_id]
+
+    def candidate_matrix(self, domain_idx_list, user_ids, target_item_ids, candidate_num, shuffle=True, rng=None):
+        '''
+        Candidates of many test interactions at once, for batched scorers. Returns an (n, candidate_num) array of
+        item IDs, candidate_num - 1 random negatives from each user's pool in the target's domain and the target,
+        and a boolean mask of the rows that could be built (target in an experiment domain, user with a pool).
+        Rows are shuffled unless shuffle is False, in which case the target is the last column.
+        '''
+        rng = np.random.default_rng() if rng is None else rng
+        num_rows = len(user_ids)
+        candidates = np.empty((num_rows, candidate_num), dtype=object)
+        candidates[:, -1] = list(target_item_ids)
+        is_valid = np.zeros(num_rows, dtype=bool)
+        domain_idx_array = np.array([-1 if domain_idx is None else domain_idx for domain_idx in domain_idx_list], dtype=np.int64)
+        for domain_idx in range(len(self.neg_pools)):
+            rows = np.flatnonzero(domain_idx_array == domain_idx)
+            pool_rows = np.array([self.neg_user_index[domain_idx].get(user_ids[row], -1) for row in rows], dtype=np.int64)
+            rows, pool_rows = rows[pool_rows >= 0], pool_rows[pool_rows >= 0]
+            pool = self.neg_pools[domain_idx]
+            columns = rng.integers(0, pool.shape[1], size=(len(rows), candidate_num - 1))
+            candidates[rows, :-1] = pool[pool_rows[:, None], columns]
+            is_valid[rows] = True
+        if shuffle:
+            order = np.argsort(rng.random((num_rows, candidate_num)), axis=1)
+            candidates = np.take_along_axis(candidates, order, axis=1)
+        return candidates, is_valid
+
+    def user_domain_matrix(self, user_ids):
+        '''
+        Boolean users x domains matrix: a user has interacted with a domain if their pool row is not all '0'
+        '''
+        user_domain_matrix = np.zeros((len(user_ids), self.num_domains), dtype=bool)
+        for domain_idx, (pool, user_index) in enumerate(zip(self.neg_pools, self.neg_user_index)):
+            has_domain = (pool != '0').any(axis=1)
+            rows = np.array([user_index.get(user_id, -1) for user_id in user_ids], dtype=np.int64)
+            user_domain_matrix[rows >= 0, domain_idx] = has_domain[rows[rows >= 0]]
+        return user_domain_matrix
@@ -0,0 +1,90 @@
+"""
+Batched embedding client with a persistent on-disk cache
+"""
+import os
+import sqlite3
+import hashlib
+from contextlib import closing, contextmanager
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from openai import OpenAI
+
+def normalize_l2(x):
+    x = np.array(x)
+    if x.ndim == 1:
+        norm = np.linalg.norm(x)
+        if norm == 0:
+            return x
+        return x / norm
+    else:
+        norm = np.linalg.norm(x, 2, axis=1, keepdims=True)
+        return np.where(norm == 0, x, x / norm)
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+class EmbeddingClient:
+    '''
+    Embed texts in large concurrent batches and cache the full-length embeddings in SQLite, keyed by (model, text hash).
+    Truncation to dim and L2 normalization happen when embeddings are read, so changing dim never re-embeds anything.
+    '''
+    def __init__(self, model, cache_path="cache/embeddings.sqlite", batch_size=2048, max_workers=4, client=None):
+        self.model = model
+        self.cache_path = cache_path
+        self.batch_size = batch_size  # The embeddings endpoint accepts at most 2048 inputs per request
+        self.max_workers = max_workers
+        self.client = client
+        if os.path.dirname(cache_path):
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS embedding (model TEXT, text_hash TEXT, vector BLOB, PRIMARY KEY (model, text_hash))")
+
+    @contextmanager
+    def _connect(self):
+        # The connection's own context manager only commits or rolls back, so the connection is closed here
+        with closing(sqlite3.connect(self.cache_path)) as conn:
+            with conn:
+                yield conn
+
+    def _request(self, texts):
+        if self.client is None:
+            self.client = OpenAI()
+        response = self.client.embeddings.create(input=texts, model=self.model)
+        return [np.asarray(data.embedding, dtype=np.float32) for data in sorted(response.data, key=lambda data: data.index)]
+
+    def _lookup(self, hashes):
+        cached = {}
+        with self._connect() as conn:
+            # Stay below SQLite's limit on the number of bound parameters
+            for i in range(0, len(hashes), 500):
+                chunk = hashes[i:i + 500]
+                rows = conn.execute(f"SELECT text_hash, vector FROM embedding WHERE model = ? AND text_hash IN ({','.join('?' * len(chunk))})", [self.model, *chunk])
+                for hash_value, vector in rows:
+                    cached[hash_value] = np.frombuffer(vector, dtype=np.float32)
+        return cached
+
+    def embed(self, texts, dim=None, normalize=True):
+        '''
+        Return a (len(texts), dim) float32 array; only texts missing from the cache are sent to the API
+        '''
+        texts = [str(text).replace("\n", " ") or " " for text in texts]
+        hashes = [text_hash(text) for text in texts]
+        cached = self._lookup(list(set(hashes)))
+
+        missing = {}
+        for text, hash_value in zip(texts, hashes):
+            if hash_value not in cached:
+                missing.setdefault(hash_value, text)
+        if missing:
+            missing_hashes = list(missing)
+            batches = [missing_hashes[i:i + self.batch_size] for i in range(0, len(missing_hashes), self.batch_size)]
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = executor.map(lambda batch: self._request([missing[hash_value] for hash_value in batch]), batches)
+                with self._connect() as conn:
+                    for batch, vectors in zip(batches, results):
+                        conn.executemany("INSERT OR REPLACE INTO embedding VALUES (?, ?, ?)", [(self.model, hash_value, vector.tobytes()) for hash_value, vector in zip(batch, vectors)])
+                        conn.commit()
+                        cached.update(zip(batch, vectors))
+
+        embeddings = np.stack([cached[hash_value][:dim] for hash_value in hashes]) if texts else np.zeros((0, dim or 0), dtype=np.float32)
+        return normalize_l2(embeddings).astype(np.float32) if normalize else embeddings
@@ -0,0 +1,49 @@
+"""
+Ranking metrics shared by the evaluators, the baselines and the benchmark runner
+"""
+import math
+import numpy as np
+
+max_retries = 3
+
+def calculate_dcg(relevance_scores, k):
+    dcg = 0.0
+    for i in range(k):
+        if i < len(relevance_scores):
+            dcg += relevance_scores[i] / math.log2(i + 2)  # i+2 because ranks start from 0 and log2(1) = 0
+        else:
+            break  # Stop if the list length is less than k
+    return dcg
+
+def calculate_idcg(relevance_scores, k):
+    sorted_scores = sorted(relevance_scores, reverse=True)  # Sort from high to low
+    return calculate_dcg(sorted_scores[:k], k)  # DCG of the top k as iDCG
+
+def calculate_ndcg(relevance_scores, k):
+    dcg_k = calculate_dcg(relevance_scores, k)
+    idcg_k = calculate_idcg(relevance_scores, k)
+    if idcg_k == 0:  # Avoid division by zero
+        return 0.0
+    return dcg_k / idcg_k
+
+def relevance_matrix(candidate_matrix, score_matrix, target_array):
+    '''
+    (n, k) 0/1 relevance of every row of candidates sorted by descending score; ties keep the candidate order
+    '''
+    order = np.argsort(-np.asarray(score_matrix, dtype=np.float64), axis=1, kind="stable")
+    ranked_candidates = np.take_along_axis(np.asarray(candidate_matrix), order, axis=1)
+    return (ranked_candidates == np.asarray(target_array)[:, None]).astype(np.int64)
+
+def ranking_metrics(relevance_matrix, k_list=(10, 5, 1)):
+    '''
+    Mean NDCG@k and MRR over the rows of a relevance matrix with one relevant item per row,
+    the same values as calculate_ndcg and 1 / rank row by row. Rows without the target are left out.
+    '''
+    relevance_matrix = np.asarray(relevance_matrix)
+    has_target = relevance_matrix.any(axis=1)
+    ranks = np.argmax(relevance_matrix[has_target], axis=1) + 1
+    metrics = {}
+    for k in k_list:
+        metrics[f"NDCG@{k}"] = float(np.mean(np.where(ranks <= k, 1.0 / np.log2(ranks + 1), 0.0))) if len(ranks) else 0.0
+    metrics["MRR"] = float(np.mean(1.0 / ranks)) if len(ranks) else 0.0
+    return metrics
@@ -0,0 +1,85 @@
+"""
+Sampled evaluation: stratified ordering of the test set and confidence-bounded early stopping
+"""
+import math
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+
+def stratified_order(interDF, itemDF, activity_df=None, n_activity_buckets=4, seed=42):
+    '''
+    Reorder the test interactions so that every prefix is a stratified random sample by domain (main_category)
+    and user activity (quantile bucket of the user's interaction count in activity_df, the test set by default).
+    Evaluating the first n rows is then a proportional stratified sample of size n.
+    '''
+    if activity_df is None:
+        activity_df = interDF
+    main_category = interDF["parent_asin"].map(itemDF.drop_duplicates("parent_asin").set_index("parent_asin")["main_category"])
+    # One activity bucket per user, from the quantiles over users, so all rows of a user share a stratum
+    user_activity = activity_df["user_id"].value_counts().reindex(interDF["user_id"].unique(), fill_value=0)
+    n_buckets = max(1, min(n_activity_buckets, user_activity.nunique()))
+    user_bucket = pd.qcut(user_activity.rank(method="first"), q=n_buckets, labels=False)
+    activity_bucket = interDF["user_id"].map(user_bucket)
+    stratum = main_category.astype(str).values + "|" + activity_bucket.astype(str).values
+
+    # Shuffle within each stratum, then interleave strata by relative position
+    rng = np.random.default_rng(seed)
+    order_df = pd.DataFrame({"stratum": stratum, "random_key": rng.random(len(interDF))})
+    rank_in_stratum = order_df.groupby("stratum")["random_key"].rank(method="first")
+    stratum_size = order_df.groupby("stratum")["random_key"].transform("size")
+    relative_position = (rank_in_stratum - order_df["random_key"]) / stratum_size
+    order = np.lexsort((order_df["random_key"].values, relative_position.values))
+    return interDF.iloc[order]
+
+class RunningMetric:
+    '''
+    Running mean and normal-approximation confidence interval (Welford's algorithm)
+    '''
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+    def ci_half_width(self, confidence=0.95):
+        if self.n < 2:
+            return math.inf
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        return z * math.sqrt(self.m2 / (self.n - 1) / self.n)
+
+class EvaluationSamplingPlan:
+    '''
+    Track NDCG@10 and MRR while evaluating a stratified sample; stop when both confidence intervals are narrower
+    than ci_width or when the LLM call budget is exhausted.
+    '''
+    def __init__(self, ci_width=None, llm_budget=None, confidence=0.95, min_samples=30):
+        self.ci_width = ci_width
+        self.llm_budget = llm_budget
+        self.confidence = confidence
+        self.min_samples = min_samples
+        self.metrics = {"NDCG@10": RunningMetric(), "MRR": RunningMetric()}
+        self.num_llm_calls = 0
+
+    def add(self, ndcg_at_10, reciprocal_rank, num_llm_calls=1):
+        self.metrics["NDCG@10"].add(ndcg_at_10)
+        self.metrics["MRR"].add(reciprocal_rank)
+        self.num_llm_calls += num_llm_calls
+
+    def should_stop(self):
+        if self.llm_budget is not None and self.num_llm_calls >= self.llm_budget:
+            return True
+        if self.ci_width is None or self.metrics["MRR"].n < self.min_samples:
+            return False
+        return all(2 * metric.ci_half_width(self.confidence) <= self.ci_width for metric in self.metrics.values())
+
+    def report(self):
+        report_txt = f"Sampled evaluation: {self.metrics['MRR'].n} interactions, {self.num_llm_calls} LLM calls\n"
+        for name, metric in self.metrics.items():
+            half_width = metric.ci_half_width(self.confidence)
+            report_txt += f"{name}:  {metric.mean} ± {half_width} ({int(self.confidence * 100)}% CI)\n"
+        return report_txt
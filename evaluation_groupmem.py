@@ -1,148 +1,82 @@
 """
 Evaluate experimental effects
 """
-import math
-from dataPrepare import createInterDF, createItemDF, createRandomDF
-from config import candidate_num, model, prompt_strategy, evaluation_times, inter_data_source, item_data_source, random_domain0_source, random_domain1_source, random_domain2_source, get_main_kind, domain_list, group_Mem_length, random_domain3_source
+from dataPrepare import createInterDF, createItemDF
+from config import candidate_num, model, prompt_strategy, evaluation_times, inter_data_source, item_data_source, domain_list, candidate_id_style, is_sampled_evaluation, evaluation_ci_width, evaluation_llm_budget, random_domain_source_list
 import random
-from prompt import system_prompt_template_evaluation_basic_g, system_prompt_template_evaluation_sequential_g, system_prompt_template_evaluation_retrieval_g
-import re
-import pandas as pd
-from fuzzywuzzy import fuzz
+from prompt import system_prompt_template_evaluation_sequential_g, system_prompt_template_evaluation_retrieval_g, get_rank_format
 from request import get_response_from_openai
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from domainRegistry import DomainRegistry
+from evaluationMetrics import calculate_ndcg, max_retries
+from rankParser import RankingParser
+from memoryStore import open_memory_store
+from agentRanker import AgentRanker
+from user_group_mem.groupMembership import load_group_membership
+from memoryIndex import LongMemoryIndex
+from evaluationSampling import stratified_order, EvaluationSamplingPlan
 
 exp_name = "AgentCF" + " " + " ".join(domain_list)
 name_suffix = exp_name.replace("AgentCF ", "")
 group_mem_exp_name = "AgentCF++" + " " + " ".join(domain_list)
 mode = "test"
-max_retries = 3
-
-def find_most_similar_memory(string_list, target):
-    '''
-    The current retrieval method uses TF-IDF vector retrieval for the most similar memory; there is room for improvement.
-    '''
-    # Add the target string to the list for vectorization
-    combined_list = string_list + [target]
-    # Use TfidfVectorizer to convert text to TF-IDF feature vectors
-    vectorizer = TfidfVectorizer()
-    tfidf_matrix = vectorizer.fit_transform(combined_list)
-    # Extract the TF-IDF vector of the target string (note the index; the last one is the target string)
-    target_vector = tfidf_matrix[-1].reshape(1, -1)
-    # Calculate the cosine similarity of all strings with the target string (excluding the target string itself)
-    cosine_sims = cosine_similarity(tfidf_matrix[:-1], target_vector)
-    # Find the index of the highest similarity
-    most_similar_idx = cosine_sims.argmax(axis=0)[0]
-    # Return the string with the highest similarity
-    return string_list[most_similar_idx]
-
-def calculate_dcg(relevance_scores, k):
-    dcg = 0.0
-    for i in range(k):  
-        if i < len(relevance_scores):  
-            dcg += relevance_scores[i] / math.log2(i + 2)  # Note that here i+2 is used because counting starts from 0, but log2(1) is meaningless, so i+2 is commonly used for smoothing
-        else:
-            break  # Stop if the list length is less than k
-    return dcg
-  
-def calculate_idcg(relevance_scores, k):  
-    sorted_scores = sorted(relevance_scores, reverse=True)  # Sort from high to low  
-    return calculate_dcg(sorted_scores[:k], k)  # Calculate DCG for the top k as iDCG  
-  
-def calculate_ndcg(relevance_scores, k):
-    dcg_k = calculate_dcg(relevance_scores, k)
-    idcg_k = calculate_idcg(relevance_scores, k)
-    if idcg_k == 0:  # Avoid division by zero
-        return 0.0
-    return dcg_k / idcg_k
-
-def get_similarity_score_list(system_evaluation_prompt, model):
-    # Get the output from the large model and sort the final results
-    responseText = get_response_from_openai(system_evaluation_prompt, model)
-
-    # Final recommendation results and relevance scores
-    result_list = []
-    similarity_score_list = []
-    # Split the text data into a list by line
-    lines = responseText.split("Rank:")[-1].splitlines()
-
-    # Iterate through each line and check if it starts with a number
-    for line_num, line in enumerate(lines, start=1):  
-        if line.strip() and line[0].isdigit():  # Use strip() to remove leading and trailing whitespace, check if the first character is a number
-            temp_title = re.split('\d\.', line)[-1].strip()
-            result_list.append(temp_title)
-            similarity_score_list.append(fuzz.ratio(temp_title.lower(), target_item_title.lower()))
-    return similarity_score_list
+# AgentCF memories with the group memories of AgentCF++
+memory_store = open_memory_store(f"memory/{exp_name}")
+group_memory_store = open_memory_store(f"memory/{group_mem_exp_name}")
+group_membership = load_group_membership(name_suffix)
+# Built after training (memoryIndex.py), read-only here
+memory_index = LongMemoryIndex(f"memory/{exp_name}/user-long-index", read_only=True)
 
 if __name__ == "__main__":
     # Construct three large tables
     interDF = createInterDF(inter_data_source(mode))
     itemDF = createItemDF(item_data_source)
+    agent_ranker = AgentRanker(memory_store, dict(zip(itemDF["parent_asin"], itemDF["title"].map(str))), is_plus=False, group_membership=group_membership, group_memory_store=group_memory_store)
 
     # Build random selection datasets
-    random_domain0_DF = createRandomDF(random_domain0_source)
-    random_domain1_DF = createRandomDF(random_domain1_source)
-    random_domain2_DF = createRandomDF(random_domain2_source)
-    if len(domain_list) == 4:
-        random_domain3_DF = createRandomDF(random_domain3_source)
+    domain_registry = DomainRegistry.from_sources(domain_list, random_domain_source_list)
 
     ndcg_10_list = []
     ndcg_5_list = []
     ndcg_1_list = []
     mrr_list = []
-    for index, record in interDF.iterrows():
+    # Optionally evaluate a stratified sample with confidence-bounded early stopping
+    eval_interDF = interDF
+    sampling_plan = None
+    if is_sampled_evaluation:
+        eval_interDF = stratified_order(interDF, itemDF)
+        sampling_plan = EvaluationSamplingPlan(evaluation_ci_width, evaluation_llm_budget)
+    for index, record in eval_interDF.iterrows():
+        if sampling_plan is not None and sampling_plan.should_stop():
+            break
         target_itemId = record["parent_asin"]
         userId = record["user_id"]
-        target_item_title = str(itemDF[itemDF["parent_asin"] == target_itemId]["title"].values[0])
 
-        # Read user memory
-        with open(f".\\memory\\{exp_name}\\user\\user.{userId}", "r", encoding="utf-8") as file:
-            user_memory = file.read()
-
-        main_kind = itemDF[itemDF["parent_asin"] == target_itemId]["main_category"].values[0]
+        domain_idx = domain_registry.index_of(itemDF[itemDF["parent_asin"] == target_itemId]["main_category"].values[0])
+        if domain_idx is None:
+            continue
         # Construct negative candidates
-        if main_kind == get_main_kind(domain_list[0]):
-            random_itemId_list = [random_domain0_DF[random_domain0_DF["Unnamed: 0"] == userId][f"item_{random.randint(0, 99)}"].values[0] for i in range(candidate_num - 1)]
-            random_itemId_list.append(target_itemId)
-        elif main_kind == get_main_kind(domain_list[1]):
-            random_itemId_list = [random_domain1_DF[random_domain1_DF["Unnamed: 0"] == userId][f"item_{random.randint(0, 99)}"].values[0] for i in range(candidate_num - 1)]
-            random_itemId_list.append(target_itemId)
-        elif main_kind == get_main_kind(domain_list[2]):
-            random_itemId_list = [random_domain2_DF[random_domain2_DF["Unnamed: 0"] == userId][f"item_{random.randint(0, 99)}"].values[0] for i in range(candidate_num - 1)]
-            random_itemId_list.append(target_itemId)
-        elif len(domain_list) == 4 and main_kind == get_main_kind(domain_list[3]):
-            random_itemId_list = [random_domain3_DF[random_domain3_DF["Unnamed: 0"] == userId][f"item_{random.randint(0, 99)}"].values[0] for i in range(candidate_num - 1)]
-            random_itemId_list.append(target_itemId)
+        random_itemId_list = domain_registry.sample_candidates(domain_idx, userId, target_itemId, candidate_num)
         
         # Randomly shuffle data
         random.shuffle(random_itemId_list)
 
-        # Read candidate-related information
-        cdt_item_memory_list = []
-        cdt_item_title_list = []
-        for cdt_itemId in random_itemId_list:
-            try:
-                with open(f".\\memory\\{exp_name}\\item\\item.{cdt_itemId}", "r", encoding="utf-8") as file:
-                    cdt_item_memory_list.append(file.read())
-                cdt_item_title_list.append(str(itemDF[itemDF["parent_asin"] == cdt_itemId]["title"].values[0]))
-            except Exception as e:
-                # Print error message and continue the loop if any exception occurs
-                print(f"Error processing item {cdt_itemId}: {e}")
-                cdt_item_memory_list.append('nan')
-                cdt_item_title_list.append('nan')
-                continue
-
-        # Construct user description and item description
-        user_description = user_memory
-        example_list_of_item_description = ''
-        for cdt_item_memory, cdt_item_title in zip(cdt_item_memory_list, cdt_item_title_list):
-            example_list_of_item_description += f"title:{cdt_item_title.strip()}. description:{cdt_item_memory.strip()}\n"
-
-        # Choose the appropriate prompt strategy
-        if prompt_strategy == "B":
-            system_evaluation_prompt = system_prompt_template_evaluation_basic_g(user_description, candidate_num, example_list_of_item_description)
-        elif prompt_strategy == "B+H":
+        # The basic strategy is the prompt of AgentRanker; the other strategies share its user, candidate and group memories
+        try:
+            if prompt_strategy == "B":
+                system_evaluation_prompt, ranking_parser = agent_ranker.build(userId, domain_idx, random_itemId_list)
+            else:
+                user_description = agent_ranker.user_description(userId, domain_list[domain_idx])
+                example_list_of_item_description, cdt_item_memory_list, cdt_item_title_list, candidate_labels = agent_ranker.candidate_description(random_itemId_list)
+                group_Mem_txt = agent_ranker.group_memory_text(userId, domain_idx)
+                rank_format = get_rank_format(candidate_id_style, prompt_strategy)
+                # Map the ranking back to candidates; the target is the candidate at target_idx
+                ranking_parser = RankingParser(cdt_item_title_list, candidate_labels)
+        except Exception as e:
+            # Print error message and continue the loop if any exception occurs
+            print(f"Error processing item {target_itemId}: {e}")
+            continue
+
+        if prompt_strategy == "B+H":
             historical_inter_itemId_list = list(interDF[interDF['user_id'] == userId]["parent_asin"])  # Select historical interacted items
             historical_inter_itemId_list = [x for x in historical_inter_itemId_list if x != target_itemId]  # Filter out the current target
             historical_inter_item_memory_list = []
@@ -155,31 +89,27 @@ if __name__ == "__main__":
 
             for historical_inter_item_memory, historical_inter_item_title in zip(historical_inter_item_memory_list, historical_inter_item_title_list):
                 historical_interactions += f"title:{historical_inter_item_title.strip()}. description:{historical_inter_item_memory.strip()}\n"
-            system_evaluation_prompt = system_prompt_template_evaluation_sequential_g(user_description, historical_interactions, candidate_num, example_list_of_item_description)
+            system_evaluation_prompt = system_prompt_template_evaluation_sequential_g(user_description, historical_interactions, candidate_num, example_list_of_item_description, group_Mem_txt, rank_format=rank_format)
 
         elif prompt_strategy == "B+R":  # Use retrieval from long-term memory as the prompt strategy
-            # Read user_long_memory
-            with open(f".\\memory\\{exp_name}\\user-long\\user.{userId}", "r", encoding="utf-8") as file:
-                user_long_memory = file.read()
-            user_long_memory_list = user_long_memory.split("\n=====\n")[:-1]  # Exclude current short-term memory
-            if len(user_long_memory_list) == 0:
-                user_long_memory_list.append(user_long_memory.split("\n=====\n")[-1])
+            # Retrieve from the user's long-term memory index, excluding the current short-term memory
             cdt_retrieval_prompt = " ".join(cdt_item_memory_list)
-            most_similar_user_memory = find_most_similar_memory(user_long_memory_list, cdt_retrieval_prompt)
-            system_evaluation_prompt = system_prompt_template_evaluation_retrieval_g(most_similar_user_memory, user_description, candidate_num, example_list_of_item_description)        
+            most_similar_user_memory = memory_index.most_similar(userId, cdt_retrieval_prompt)[0]
+            system_evaluation_prompt = system_prompt_template_evaluation_retrieval_g(most_similar_user_memory, user_description, candidate_num, example_list_of_item_description, group_Mem_txt, rank_format=rank_format)
+
+        target_idx = random_itemId_list.index(target_itemId)
 
         # Sort multiple times to reduce randomness
         for i in range(evaluation_times):
-            # Get similarity score list
-            similarity_score_list = get_similarity_score_list(system_evaluation_prompt, model)
+            # Get the relevance score list of the ranking
+            relevance_score_list, is_complete = ranking_parser.parse(get_response_from_openai(system_evaluation_prompt, model), target_idx)
             retries = 0
-            # If the similarity score list has issues, regenerate
-            while len(similarity_score_list) != candidate_num and retries < max_retries:
+            # If the ranking is incomplete, regenerate
+            while not is_complete and retries < max_retries:
                 retries += 1
                 print(f"retry {retries} ...")
-                similarity_score_list = get_similarity_score_list(system_evaluation_prompt, model)
+                relevance_score_list, is_complete = ranking_parser.parse(get_response_from_openai(system_evaluation_prompt, model), target_idx)
 
-            relevance_score_list = [1 if x == max(similarity_score_list) else 0 for x in similarity_score_list]
             target_rank = relevance_score_list.index(1) + 1  # Find the ranking of the target
             ndcg_at_10 = calculate_ndcg(relevance_score_list, 10)
             ndcg_10_list.append(ndcg_at_10)
@@ -189,10 +119,15 @@ if __name__ == "__main__":
             ndcg_1_list.append(ndcg_at_1)
 
             mrr_list.append(1.0 / target_rank)
+            if sampling_plan is not None:
+                sampling_plan.add(ndcg_at_10, 1.0 / target_rank, num_llm_calls=retries + 1)
             print(f"ndcg@10: {ndcg_at_10} mean: {sum(ndcg_10_list) / len(ndcg_10_list)}")
             print(f"ndcg@5: {ndcg_at_5} mean: {sum(ndcg_5_list) / len(ndcg_5_list)}")
             print(f"ndcg@1: {ndcg_at_1} mean: {sum(ndcg_1_list) / len(ndcg_1_list)}")
             print(f"1/rank: {1.0 / target_rank} mrr: {sum(mrr_list) / len(mrr_list)}")
 
     with open(".\\log\\result.txt", mode="a", encoding="utf-8") as file:
-        file.write(f"{exp_name}:\nPrompt strategy: {prompt_strategy}\nNDCG@10:  {sum(ndcg_10_list) / len(ndcg_10_list)}\nNDCG@5:  {sum(ndcg_5_list) / len(ndcg_5_list)}\nNDCG@1:  {sum(ndcg_1_list) / len(ndcg_1_list)}\nMRR:  {sum(mrr_list) / len(mrr_list)}\n\n")
\ No newline at end of file
+        file.write(f"{exp_name}:\nPrompt strategy: {prompt_strategy}\nNDCG@10:  {sum(ndcg_10_list) / len(ndcg_10_list)}\nNDCG@5:  {sum(ndcg_5_list) / len(ndcg_5_list)}\nNDCG@1:  {sum(ndcg_1_list) / len(ndcg_1_list)}\nMRR:  {sum(mrr_list) / len(mrr_list)}\n\n")
+        if sampling_plan is not None:
+            file.write(sampling_plan.report() + "\n")
+            print(sampling_plan.report())
\ No newline at end of file
@@ -0,0 +1,221 @@
+"""
+Export user and item factors of the collaborative baselines and retrieve top-N items from them with an ANN index
+"""
+import os
+import json
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+def save_factors(directory, user_ids, user_factors, item_ids, item_factors, item_biases=None, model_name=""):
+    '''
+    Write a factor export: user_factors.npy and item_factors.npy (float32, memory-mappable), user_ids.txt and item_ids.txt
+    (one ID per line, in row order) and meta.json. An item bias is folded in as one more dimension, 1 on the user side,
+    so that every score is a plain inner product.
+    '''
+    user_factors = np.asarray(user_factors, dtype=np.float32)
+    item_factors = np.asarray(item_factors, dtype=np.float32)
+    if item_biases is not None:
+        user_factors = np.hstack([user_factors, np.ones((len(user_factors), 1), dtype=np.float32)])
+        item_factors = np.hstack([item_factors, np.asarray(item_biases, dtype=np.float32).reshape(-1, 1)])
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, "user_factors.npy"), np.ascontiguousarray(user_factors))
+    np.save(os.path.join(directory, "item_factors.npy"), np.ascontiguousarray(item_factors))
+    for name, ids in (("user_ids.txt", user_ids), ("item_ids.txt", item_ids)):
+        with open(os.path.join(directory, name), "w", encoding="utf-8") as file:
+            file.write("".join(f"{i}\n" for i in ids))
+    with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as file:
+        json.dump({"model": model_name, "dim": int(item_factors.shape[1]), "num_users": len(user_factors), "num_items": len(item_factors)}, file)
+
+def read_ids(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return file.read().splitlines()
+
+class FactorSet:
+    '''
+    A factor export opened with the matrices memory-mapped, so several processes share the pages of one copy
+    '''
+    def __init__(self, user_ids, user_factors, item_ids, item_factors, meta=None):
+        self.user_ids = list(user_ids)
+        self.item_ids = list(item_ids)
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.meta = meta or {}
+        self.user_index = {user_id: row for row, user_id in enumerate(self.user_ids)}
+        self.item_index = {item_id: row for row, item_id in enumerate(self.item_ids)}
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        mmap_mode = "r" if mmap else None
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as file:
+            meta = json.load(file)
+        return cls(read_ids(os.path.join(directory, "user_ids.txt")), np.load(os.path.join(directory, "user_factors.npy"), mmap_mode=mmap_mode),
+                   read_ids(os.path.join(directory, "item_ids.txt")), np.load(os.path.join(directory, "item_factors.npy"), mmap_mode=mmap_mode), meta)
+
+    @property
+    def dim(self):
+        return self.item_factors.shape[1]
+
+    def user_rows(self, user_ids):
+        return np.array([self.user_index.get(user_id, -1) for user_id in user_ids], dtype=np.int64)
+
+    def user_vectors(self, user_ids):
+        '''
+        (n, d) factors of the users; unknown users get a zero vector
+        '''
+        rows = self.user_rows(user_ids)
+        vectors = np.zeros((len(rows), self.dim), dtype=np.float32)
+        vectors[rows >= 0] = self.user_factors[rows[rows >= 0]]
+        return vectors
+
+    def item_rows(self, item_ids):
+        return np.array([self.item_index.get(item_id, -1) for item_id in item_ids], dtype=np.int64)
+
+class FactorIndex:
+    '''
+    Top-N maximum inner product search over item vectors.
+    "hnsw": an hnswlib graph (inner product space), used when hnswlib is installed, otherwise "ivf".
+    "ivf": an inverted file in NumPy; items are grouped by k-means and a query scans the nprobe lists whose centroids score highest.
+    "flat": exact search with one matrix product per batch of queries.
+    '''
+    def __init__(self, item_vectors, method="hnsw", nlist=None, nprobe=8, seed=42):
+        self.item_vectors = item_vectors
+        self.method = "ivf" if method == "hnsw" and hnswlib is None else method
+        self.nprobe = nprobe
+        self.index = None
+        if self.method == "hnsw":
+            self.index = hnswlib.Index(space="ip", dim=item_vectors.shape[1])
+            self.index.init_index(max_elements=len(item_vectors), ef_construction=200, M=16, random_seed=seed)
+            self.index.add_items(np.asarray(item_vectors, dtype=np.float32), np.arange(len(item_vectors)))
+        elif self.method == "ivf":
+            nlist = nlist or max(1, int(np.sqrt(len(item_vectors))))
+            kmeans = MiniBatchKMeans(n_clusters=min(nlist, len(item_vectors)), random_state=seed, n_init=3).fit(item_vectors)
+            self.set_lists(kmeans.cluster_centers_, kmeans.labels_)
+        elif self.method != "flat":
+            raise ValueError(f"Unknown index method: {method}")
+
+    def set_lists(self, centroids, labels):
+        # Inverted lists in CSR layout: the items of list c are list_items[list_offsets[c]:list_offsets[c + 1]]
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.list_items = np.argsort(labels, kind="stable").astype(np.int64)
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=len(self.centroids)))])
+
+    def save(self, path):
+        '''
+        Save the index structure; the item vectors stay in the factor export
+        '''
+        if self.method == "hnsw":
+            self.index.save_index(path)
+        elif self.method == "ivf":
+            np.savez(path, centroids=self.centroids, list_items=self.list_items, list_offsets=self.list_offsets)
+
+    @classmethod
+    def load(cls, path, item_vectors, method, nprobe=8, ef=128):
+        index = cls.__new__(cls)
+        index.item_vectors = item_vectors
+        index.method = method
+        index.nprobe = nprobe
+        index.index = None
+        if method == "hnsw":
+            index.index = hnswlib.Index(space="ip", dim=item_vectors.shape[1])
+            index.index.load_index(path, max_elements=len(item_vectors))
+            index.index.set_ef(ef)
+        elif method == "ivf":
+            data = np.load(path)
+            index.centroids, index.list_items, index.list_offsets = data["centroids"], data["list_items"], data["list_offsets"]
+        return index
+
+    def candidate_rows(self, query):
+        if self.method == "flat":
+            return None
+        # Items of the nprobe lists whose centroids score highest for the query
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self.list_items[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probes])
+
+    def search(self, query_vectors, top_n, exclude=None, batch_size=1024):
+        '''
+        Item rows (n, top_n) and scores of the best items of every query, best first; exclude[i] holds item rows
+        never returned for query i (e.g. its training items). Missing results are padded with row -1 and score -inf.
+        '''
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        num_queries = len(query_vectors)
+        rows = np.full((num_queries, top_n), -1, dtype=np.int64)
+        scores = np.full((num_queries, top_n), -np.inf, dtype=np.float32)
+        excluded = [np.asarray(list(exclude[i]) if exclude is not None else [], dtype=np.int64) for i in range(num_queries)]
+        if self.method == "hnsw":
+            max_excluded = max((len(e) for e in excluded), default=0)
+            k = min(len(self.item_vectors), top_n + max_excluded)
+            self.index.set_ef(max(k, 128))
+            labels, distances = self.index.knn_query(query_vectors, k=k)
+            for i in range(num_queries):
+                keep = ~np.isin(labels[i], excluded[i])
+                found = labels[i][keep][:top_n]
+                rows[i, :len(found)] = found
+                scores[i, :len(found)] = 1 - distances[i][keep][:top_n]  # hnswlib "ip" distance is 1 - inner product
+            return rows, scores
+        for start in range(0, num_queries, batch_size):
+            batch = query_vectors[start:start + batch_size]
+            batch_scores = batch @ np.asarray(self.item_vectors).T if self.method == "flat" else None
+            for j, query in enumerate(batch):
+                i = start + j
+                candidates = self.candidate_rows(query)
+                if candidates is None:
+                    candidates, candidate_scores = np.arange(len(self.item_vectors)), batch_scores[j].copy()
+                else:
+                    candidate_scores = np.asarray(self.item_vectors[candidates]) @ query
+                candidate_scores[np.isin(candidates, excluded[i])] = -np.inf
+                k = min(top_n, len(candidates))
+                if k == 0:
+                    continue
+                best = np.argpartition(-candidate_scores, k - 1)[:k]
+                best = best[np.argsort(-candidate_scores[best], kind="stable")]
+                best = best[np.isfinite(candidate_scores[best])]
+                rows[i, :len(best)] = candidates[best]
+                scores[i, :len(best)] = candidate_scores[best]
+        return rows, scores
+
+def build_factor_index(directory, method="hnsw", nlist=None, nprobe=8):
+    '''
+    Build the ANN index of a factor export and save it next to the factors
+    '''
+    factors = FactorSet.load(directory)
+    index = FactorIndex(factors.item_factors, method=method, nlist=nlist, nprobe=nprobe)
+    index.save(os.path.join(directory, "index.bin" if index.method == "hnsw" else "index.npz"))
+    meta = dict(factors.meta, index_method=index.method, nprobe=nprobe)
+    with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as file:
+        json.dump(meta, file)
+    return index
+
+class FactorRetriever:
+    '''
+    Top-N items per user from a factor export and its saved index, in raw IDs.
+    Users unknown to the model get no items.
+    '''
+    def __init__(self, directory, nprobe=None):
+        self.factors = FactorSet.load(directory)
+        method = self.factors.meta.get("index_method", "flat")
+        path = os.path.join(directory, "index.bin" if method == "hnsw" else "index.npz")
+        if method == "hnsw" and hnswlib is None:
+            raise ImportError("hnswlib is required to load an HNSW index")
+        self.index = FactorIndex.load(path, self.factors.item_factors, method, nprobe=nprobe or self.factors.meta.get("nprobe", 8)) if method != "flat" else FactorIndex(self.factors.item_factors, method="flat")
+
+    def retrieve_vectors(self, query_vectors, top_n, exclude_items=None):
+        '''
+        [[item_id, ...], ...] of every query vector, best first; exclude_items[i] holds raw item IDs to leave out for query i
+        '''
+        exclude = None
+        if exclude_items is not None:
+            exclude = [self.factors.item_rows(items) for items in exclude_items]
+        rows, _ = self.index.search(query_vectors, top_n, exclude)
+        return [[self.factors.item_ids[row] for row in item_rows if row >= 0] for item_rows in rows]
+
+    def retrieve(self, user_ids, top_n, exclude_items=None):
+        '''
+        Top-N items of every user from the exported user factors
+        '''
+        item_lists = self.retrieve_vectors(self.factors.user_vectors(user_ids), top_n, exclude_items)
+        return [item_list if user_row >= 0 else [] for user_row, item_list in zip(self.factors.user_rows(user_ids), item_lists)]
@@ -1,16 +1,19 @@
 import os
 
 # Concatenate all user cross-domain memories
-def concatenate_crossdomain_preference(folder_path):
+# With a prompt budget, every domain's memory is held to the user memory cap
+def concatenate_crossdomain_preference(memory_store, userId, prompt_budget=None):
     combined_content = ""
-    # Traverse all files in the folder
-    for filename in os.listdir(folder_path):
+    # Traverse all memories of the user
+    for key in memory_store.keys(f"user/user.{userId}/"):
+        filename = key.split("/")[-1]
         # Check if the file is in txt format and not named 1.txt
         if filename.endswith('.txt') and filename.startswith('private'):
-            file_path = os.path.join(folder_path, filename)
             # Read the file content and concatenate
-            with open(file_path, 'r', encoding='utf-8') as file:
-                combined_content += f"--- preferences in {os.path.splitext(filename)[0].split('-')[-1]} ---\n"
-                combined_content += file.read() + "\n\n"  # Add a newline to separate content
+            combined_content += f"--- preferences in {os.path.splitext(filename)[0].split('-')[-1]} ---\n"
+            domain_memory = memory_store.read(key)
+            if prompt_budget is not None:
+                domain_memory = prompt_budget.fit("user_memory", domain_memory, key)
+            combined_content += domain_memory + "\n\n"  # Add a newline to separate content
 
     return combined_content
\ No newline at end of file
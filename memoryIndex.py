@@ -0,0 +1,149 @@
+import os
+import pickle
+import numpy as np
+from scipy.sparse import vstack
+from sklearn.feature_extraction.text import HashingVectorizer
+
+class LongMemoryIndex:
+    '''
+    Persistent per-user retrieval index over long-term memory (user-long).
+    Every memory is hashed once into a fixed global vocabulary when it is appended; document frequencies
+    are accumulated globally so queries are TF-IDF cosine similarities without refitting a vectorizer.
+    Each user file holds a sequence of appended records, so adding a memory writes only that memory;
+    stats.npz is written by save() and recomputed on load when a user file is newer.
+    build() indexes every user once after training; evaluators open the built index with read_only, so the idf
+    does not depend on which users are evaluated or in which order, and nothing is written during evaluation.
+    '''
+    def __init__(self, index_dir, long_memory_dir=None, n_features=2 ** 18, read_only=False):
+        self.index_dir = index_dir
+        self.long_memory_dir = long_memory_dir
+        self.read_only = read_only
+        self.vectorizer = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None)
+        self.users = {}  # user_id -> {"texts": [...], "counts": csr_matrix}
+        self.doc_freq = np.zeros(n_features, dtype=np.int64)
+        self.n_docs = 0
+        stats_path = os.path.join(index_dir, "stats.npz")
+        if not os.path.exists(index_dir):
+            return
+        user_filenames = [filename for filename in os.listdir(index_dir) if filename.startswith("user.") and filename.endswith(".pkl")]
+        if os.path.exists(stats_path) and all(os.path.getmtime(os.path.join(index_dir, filename)) < os.path.getmtime(stats_path) for filename in user_filenames):
+            stats = np.load(stats_path)
+            self.doc_freq = stats["doc_freq"]
+            self.n_docs = int(stats["n_docs"])
+        else:
+            # stats.npz is missing or older than some user entries: recover global statistics from the persisted user entries
+            for filename in user_filenames:
+                counts = self._load_user(filename[len("user."):-len(".pkl")])["counts"]
+                if counts is not None:
+                    self._update_stats(counts)
+
+    def _user_path(self, user_id):
+        return os.path.join(self.index_dir, f"user.{user_id}.pkl")
+
+    def _load_user(self, user_id):
+        if user_id not in self.users:
+            texts, counts_list = [], []
+            with open(self._user_path(user_id), "rb") as file:
+                while True:
+                    try:
+                        record = pickle.load(file)
+                    except EOFError:
+                        break
+                    texts += record["texts"]
+                    counts_list.append(record["counts"])
+            self.users[user_id] = {"texts": texts, "counts": vstack(counts_list).tocsr() if counts_list else None}
+        return self.users[user_id]
+
+    def _update_stats(self, counts):
+        np.add.at(self.doc_freq, counts.indices, 1)
+        self.n_docs += counts.shape[0]
+
+    def _get_user(self, user_id):
+        if user_id in self.users or os.path.exists(self._user_path(user_id)):
+            return self._load_user(user_id)
+        if self.read_only:
+            if not os.path.exists(self.index_dir):
+                raise FileNotFoundError(f"No long-term memory index in {self.index_dir}, build it with memoryIndex.py")
+            # A user without an entry had no long-term memory when the index was built
+            self.users[user_id] = {"texts": [], "counts": None}
+            return self.users[user_id]
+        # First access: index the legacy long-term memory file once
+        texts = []
+        if self.long_memory_dir is not None and os.path.exists(os.path.join(self.long_memory_dir, f"user.{user_id}")):
+            with open(os.path.join(self.long_memory_dir, f"user.{user_id}"), "r", encoding="utf-8") as file:
+                texts = file.read().split("\n=====\n")
+        counts = self.vectorizer.transform(texts) if texts else None
+        self.users[user_id] = {"texts": texts, "counts": counts}
+        if counts is not None:
+            self._update_stats(counts)
+            self._append_user(user_id, texts, counts)
+        return self.users[user_id]
+
+    def _check_writable(self):
+        if self.read_only:
+            raise ValueError(f"The long-term memory index in {self.index_dir} is opened read-only")
+
+    def _append_user(self, user_id, texts, counts):
+        # One record per call; _load_user concatenates the records of a user
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(self._user_path(user_id), "ab") as file:
+            pickle.dump({"texts": texts, "counts": counts}, file)
+
+    def add(self, user_id, text):
+        '''
+        Append a memory for the user. Call before the memory is appended to the user-long file.
+        '''
+        self._check_writable()
+        user = self._get_user(user_id)
+        counts = self.vectorizer.transform([text])
+        self._update_stats(counts)
+        user["texts"].append(text)
+        user["counts"] = counts if user["counts"] is None else vstack([user["counts"], counts]).tocsr()
+        self._append_user(user_id, [text], counts)
+
+    def _tfidf(self, counts):
+        idf = np.log((1 + self.n_docs) / (1 + self.doc_freq[counts.indices])) + 1
+        tfidf = counts.copy().astype(np.float64)
+        tfidf.data *= idf
+        norms = np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return tfidf.multiply(1 / norms[:, None]).tocsr()
+
+    def most_similar(self, user_id, target, k=1, exclude_latest=True):
+        '''
+        Return the k long-term memories most similar to the target, excluding the current short-term memory (the latest one)
+        unless it is the only memory.
+        '''
+        user = self._get_user(user_id)
+        num_texts = len(user["texts"])
+        if num_texts == 0:
+            return [""]
+        if exclude_latest and num_texts > 1:
+            num_texts -= 1
+        memory_vectors = self._tfidf(user["counts"][:num_texts])
+        target_vector = self._tfidf(self.vectorizer.transform([target]))
+        cosine_sims = np.asarray((memory_vectors @ target_vector.T).todense()).ravel()
+        top_idx = np.argsort(-cosine_sims, kind="stable")[:k]
+        return [user["texts"][i] for i in top_idx]
+
+    def build(self):
+        '''
+        Index the long-term memory of every user not indexed yet and save the statistics
+        '''
+        self._check_writable()
+        for filename in sorted(os.listdir(self.long_memory_dir)):
+            if filename.startswith("user."):
+                self._get_user(filename[len("user."):])
+        self.save()
+
+    def save(self):
+        self._check_writable()
+        os.makedirs(self.index_dir, exist_ok=True)
+        np.savez(os.path.join(self.index_dir, "stats.npz"), doc_freq=self.doc_freq, n_docs=self.n_docs)
+
+if __name__ == "__main__":
+    # Build the long-term memory index of the trained experiments before evaluating with the B+R strategy
+    from config import domain_list
+    for exp_name in ("AgentCF" + " " + " ".join(domain_list), "AgentCF++" + " " + " ".join(domain_list)):
+        if os.path.exists(f"memory/{exp_name}/user-long"):
+            LongMemoryIndex(f"memory/{exp_name}/user-long-index", f"memory/{exp_name}/user-long").build()
@@ -0,0 +1,256 @@
+"""
+Memory storage: the legacy one-file-per-entity directory layout or a packed archive
+"""
+import io
+import os
+import mmap
+import shutil
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+from config import memory_format, is_memory_compressed
+
+class MemoryStore(ABC):
+    '''
+    Key-value access to memories. Keys are "/"-separated paths relative to the memory directory,
+    e.g. "item/item.{itemId}", "user/user.{userId}/private-{domain}.txt" or "groupMem/{group_id}.txt".
+    '''
+    @abstractmethod
+    def read(self, key):
+        pass
+
+    @abstractmethod
+    def write(self, key, text):
+        pass
+
+    @abstractmethod
+    def exists(self, key):
+        pass
+
+    @abstractmethod
+    def keys(self, prefix=""):
+        pass
+
+    def read_lines(self, key):
+        # Same lines as file.readlines() on the legacy file
+        return io.StringIO(self.read(key), newline=None).readlines()
+
+    def write_many(self, key_text_list):
+        for key, text in key_text_list:
+            self.write(key, text)
+
+    def flush(self):
+        pass
+
+    @abstractmethod
+    def copy_to(self, memory_dir):
+        '''
+        Copy the whole store to another memory directory in the same format
+        '''
+
+    def export_to_dir(self, directory):
+        '''
+        Write every memory to the legacy directory layout for inspection
+        '''
+        for key in self.keys():
+            path = os.path.join(directory, *key.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(self.read(key))
+
+    def import_from_dir(self, directory):
+        '''
+        Load every file of a legacy memory directory into the store
+        '''
+        key_text_list = []
+        for root, _, filenames in os.walk(directory):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                with open(path, "r", encoding="utf-8") as file:
+                    key_text_list.append(("/".join(os.path.relpath(path, directory).split(os.sep)), file.read()))
+        self.write_many(key_text_list)
+        self.flush()
+
+TEMP_SUFFIX = ".writing"
+
+class DirectoryMemoryStore(MemoryStore):
+    '''
+    One file per memory under memory_dir (the legacy layout)
+    '''
+    def __init__(self, memory_dir):
+        self.memory_dir = memory_dir
+
+    def _path(self, key):
+        return os.path.join(self.memory_dir, *key.split("/"))
+
+    def read(self, key):
+        with open(self._path(key), "r", encoding="utf-8") as file:
+            return file.read()
+
+    def write(self, key, text):
+        # Write a temporary file next to the memory and rename it over the memory, so a concurrent read
+        # (e.g. during background compaction) sees either the old or the new text, never a partial file
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=os.path.dirname(path), prefix=".", suffix=TEMP_SUFFIX, delete=False) as file:
+            file.write(text)
+        try:
+            os.replace(file.name, path)
+        except OSError:
+            os.remove(file.name)
+            raise
+
+    def write_many(self, key_text_list, max_workers=16):
+        # Many small files are written concurrently
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda key_text: self.write(*key_text), key_text_list))
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def keys(self, prefix=""):
+        # Only walk the directory named by the prefix
+        prefix_dir = self._path(prefix.rsplit("/", 1)[0]) if "/" in prefix else self.memory_dir
+        key_list = []
+        for root, _, filenames in os.walk(prefix_dir):
+            for filename in filenames:
+                if filename.endswith(TEMP_SUFFIX):
+                    continue
+                key = "/".join(os.path.relpath(os.path.join(root, filename), self.memory_dir).split(os.sep))
+                if key.startswith(prefix):
+                    key_list.append(key)
+        return sorted(key_list)
+
+    def copy_to(self, memory_dir):
+        # The target may already hold other subtrees, e.g. groupMem/ or user-long-index/
+        shutil.copytree(self.memory_dir, memory_dir, dirs_exist_ok=True)
+
+class MemoryArchive(MemoryStore):
+    '''
+    All memories of a memory directory packed into memory.data, with an offset table in memory.index.npz.
+    Records are appended on write (optionally zstd-compressed) and read through mmap; the offset table is
+    written on flush. copy_to writes only the live records, which also compacts the archive.
+    '''
+    def __init__(self, memory_dir, compress=False):
+        self.memory_dir = memory_dir
+        self.data_path = os.path.join(memory_dir, "memory.data")
+        self.index_path = os.path.join(memory_dir, "memory.index.npz")
+        self.compress = compress and zstandard is not None
+        self.index = {}  # key -> (offset, length, is_compressed)
+        self.lock = threading.Lock()
+        self._mmap = None
+        self._data_file = None
+        self._load_index()
+
+    def _load_index(self):
+        self.index = {}
+        if os.path.exists(self.index_path):
+            index = np.load(self.index_path, allow_pickle=False)
+            self.index = {key: (int(offset), int(length), bool(is_compressed)) for key, offset, length, is_compressed in zip(index["keys"].tolist(), index["offsets"], index["lengths"], index["is_compressed"])}
+
+    @staticmethod
+    def exists_in(memory_dir):
+        return os.path.exists(os.path.join(memory_dir, "memory.index.npz"))
+
+    def _view(self, end):
+        # (Re)map the data file when a record lies beyond the current mapping
+        if self._mmap is None or len(self._mmap) < end:
+            if self._data_file is not None:
+                self._data_file.flush()
+            if self._mmap is not None:
+                self._mmap.close()
+            with open(self.data_path, "rb") as file:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def read(self, key):
+        with self.lock:
+            offset, length, is_compressed = self.index[key]
+            if length == 0:
+                return ""
+            data = bytes(self._view(offset + length)[offset:offset + length])
+        if is_compressed:
+            data = zstandard.ZstdDecompressor().decompress(data)
+        return data.decode("utf-8")
+
+    def write(self, key, text):
+        data = text.encode("utf-8")
+        if self.compress:
+            data = zstandard.ZstdCompressor().compress(data)
+        with self.lock:
+            if self._data_file is None:
+                os.makedirs(self.memory_dir, exist_ok=True)
+                self._data_file = open(self.data_path, "ab")
+            offset = self._data_file.seek(0, os.SEEK_END)
+            self._data_file.write(data)
+            self.index[key] = (offset, len(data), self.compress)
+
+    def exists(self, key):
+        return key in self.index
+
+    def keys(self, prefix=""):
+        return sorted(key for key in self.index if key.startswith(prefix))
+
+    def flush(self):
+        with self.lock:
+            if self._data_file is not None:
+                self._data_file.flush()
+            os.makedirs(self.memory_dir, exist_ok=True)
+            keys = list(self.index)
+            values = np.array([self.index[key] for key in keys], dtype=np.int64).reshape(len(keys), 3)
+            tmp_path = self.index_path + ".tmp.npz"
+            np.savez(tmp_path, keys=np.array(keys, dtype=str), offsets=values[:, 0], lengths=values[:, 1], is_compressed=values[:, 2].astype(bool))
+            os.replace(tmp_path, self.index_path)
+
+    def copy_to(self, memory_dir):
+        self.flush()
+        target = MemoryArchive(memory_dir, self.compress)
+        target.write_many((key, self.read(key)) for key in self.keys())
+        target.flush()
+        target.close()
+
+    def compact(self):
+        '''
+        Rewrite the archive without the superseded versions of updated memories
+        '''
+        compact_dir = self.memory_dir.rstrip("/\\") + ".compact"
+        self.copy_to(compact_dir)
+        self.close()
+        os.replace(os.path.join(compact_dir, "memory.data"), self.data_path)
+        os.replace(os.path.join(compact_dir, "memory.index.npz"), self.index_path)
+        shutil.rmtree(compact_dir)
+        self._load_index()
+
+    def close(self):
+        with self.lock:
+            if self._data_file is not None:
+                self._data_file.close()
+                self._data_file = None
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+
+def open_memory_store(memory_dir):
+    '''
+    Open the memory under memory_dir in the format selected by memory_format
+    '''
+    if memory_format == "archive":
+        return MemoryArchive(memory_dir, is_memory_compressed)
+    return DirectoryMemoryStore(memory_dir)
+
+def memory_store_exists(memory_dir):
+    if memory_format == "archive":
+        return MemoryArchive.exists_in(memory_dir)
+    return os.path.exists(os.path.join(memory_dir, "item")) or os.path.exists(os.path.join(memory_dir, "user"))
+
+if __name__ == "__main__":
+    # Export the AgentCF++ memory archive to the legacy directory layout for inspection
+    from config import domain_list
+    exp_name = "AgentCF++" + " " + " ".join(domain_list)
+    MemoryArchive(f"memory/{exp_name}").export_to_dir(f"memory/{exp_name} export")
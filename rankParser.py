@@ -0,0 +1,143 @@
+"""
+Parse LLM rankings and choices back to candidate items
+"""
+import re
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+try:
+    # rapidfuzz computes the whole similarity matrix in C in one call
+    from rapidfuzz import fuzz, process
+except ImportError:
+    from fuzzywuzzy import fuzz
+    process = None
+
+def normalize_title(title):
+    return " ".join(str(title).lower().split())
+
+def parse_rank_lines(responseText):
+    '''
+    Extract the item text of every numbered line after "Rank:"
+    '''
+    lines = responseText.split("Rank:")[-1].splitlines()
+    return [re.split(r'\d\.', line)[-1].strip() for line in lines if line.strip() and line[0].isdigit()]
+
+class TitleMatcher:
+    '''
+    Match free-text titles echoed by the LLM to the candidate titles of one prompt.
+    Candidate titles are normalized once; all lines are scored against all candidates in one batched call
+    and each candidate is assigned to at most one line.
+    '''
+    def __init__(self, candidate_titles):
+        self.candidate_titles = [normalize_title(title) for title in candidate_titles]
+
+    def similarity_matrix(self, texts):
+        queries = [normalize_title(text) for text in texts]
+        if process is not None:
+            return process.cdist(queries, self.candidate_titles, scorer=fuzz.ratio)
+        return np.array([[fuzz.ratio(query, title) for title in self.candidate_titles] for query in queries], dtype=np.float32).reshape(len(queries), len(self.candidate_titles))
+
+    def match(self, texts):
+        '''
+        Return the candidate index assigned to each text (-1 if there are more texts than candidates)
+        '''
+        assignment = np.full(len(texts), -1)
+        if len(texts) == 0:
+            return assignment
+        rows, cols = linear_sum_assignment(self.similarity_matrix(texts), maximize=True)
+        assignment[rows] = cols
+        return assignment
+
+    def best(self, text):
+        '''
+        Return the index of the candidate most similar to a single text (ties go to the first candidate)
+        '''
+        return int(np.argmax(self.similarity_matrix([text])[0]))
+
+    def relevance_score_list(self, texts, target_idx):
+        '''
+        Relevance list over the ranked texts; a target missing from the ranking is ranked last among the candidates
+        '''
+        relevance_score_list = [1 if idx == target_idx else 0 for idx in self.match(texts)]
+        if 1 not in relevance_score_list:
+            relevance_score_list = [0] * (len(self.candidate_titles) - 1) + [1]
+        return relevance_score_list
+
+def get_candidate_labels(candidate_itemId_list, candidate_id_style):
+    '''
+    Short stable tokens used to refer to candidates in the prompt: letters (A, B, ...) or the item ASINs.
+    Returns None when candidates are referred to by title.
+    '''
+    if candidate_id_style == "title":
+        return None
+    if candidate_id_style == "letter":
+        return [chr(ord("A") + i) if i < 26 else f"Z{i - 25}" for i in range(len(candidate_itemId_list))]
+    if candidate_id_style == "asin":
+        return [str(itemId) for itemId in candidate_itemId_list]
+    raise ValueError(f"Unknown candidate id style: {candidate_id_style}")
+
+def parse_id_ranking(responseText, candidate_labels):
+    '''
+    Parse a ranking expressed in candidate labels in a single pass over the response.
+    On every numbered line the bracketed label is used, otherwise the first known label on the line.
+    Unknown and repeated labels are dropped. Returns the ranked candidate indices.
+    '''
+    label_index = {}
+    for idx, label in enumerate(candidate_labels):
+        label_index.setdefault(label.upper(), idx)
+    ranking = []
+    seen = set()
+    for line in responseText.split("Rank:")[-1].splitlines():
+        line = line.strip()
+        if not line or not line[0].isdigit():
+            continue
+        line = re.sub(r"^\d+\s*[.):]?", "", line)
+        tokens = re.findall(r"\[\s*([A-Za-z0-9]+)\s*\]", line) or re.findall(r"[A-Za-z0-9]+", line)
+        for token in tokens:
+            idx = label_index.get(token.upper())
+            if idx is not None:
+                if idx not in seen:
+                    seen.add(idx)
+                    ranking.append(idx)
+                break
+    return ranking
+
+class RankingParser:
+    '''
+    Turn one ranking response into a relevance list over the ranked candidates.
+    With candidate labels the response is parsed by exact ID, otherwise titles are fuzzy matched.
+    '''
+    def __init__(self, candidate_titles, candidate_labels=None, min_coverage=0.5):
+        self.candidate_num = len(candidate_titles)
+        self.candidate_labels = candidate_labels
+        self.min_coverage = min_coverage
+        self.title_matcher = TitleMatcher(candidate_titles) if candidate_labels is None else None
+
+    def parse(self, responseText, target_idx):
+        '''
+        Return (relevance_score_list, is_complete); incomplete answers are worth a retry
+        '''
+        responseText = responseText or ""
+        if self.title_matcher is not None:
+            ranked_lines = parse_rank_lines(responseText)
+            return self.title_matcher.relevance_score_list(ranked_lines, target_idx), len(ranked_lines) == self.candidate_num
+        ranking = parse_id_ranking(responseText, self.candidate_labels)
+        is_complete = len(ranking) >= self.min_coverage * self.candidate_num
+        # Partial-answer repair: unranked candidates follow in their prompt order
+        seen = set(ranking)
+        ranking += [idx for idx in range(self.candidate_num) if idx not in seen]
+        return [1 if idx == target_idx else 0 for idx in ranking], is_complete
+
+    def ranking(self, responseText):
+        '''
+        Return (ranked candidate indices, is_complete) covering every candidate; unranked candidates follow in their prompt order
+        '''
+        responseText = responseText or ""
+        if self.title_matcher is not None:
+            ranked_lines = parse_rank_lines(responseText)
+            ranking = [int(idx) for idx in self.title_matcher.match(ranked_lines) if idx >= 0]
+            is_complete = len(ranked_lines) == self.candidate_num
+        else:
+            ranking = parse_id_ranking(responseText, self.candidate_labels)
+            is_complete = len(ranking) >= self.min_coverage * self.candidate_num
+        seen = set(ranking)
+        return ranking + [idx for idx in range(self.candidate_num) if idx not in seen], is_complete
@@ -0,0 +1,125 @@
+"""
+Token budgets for the memory sections of prompts, with background LLM compaction of memories over budget
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+from prompt import memory_compaction_prompt
+from request import get_response_from_openai
+
+class TokenCounter:
+    '''
+    Count and truncate text in tokens of the model's tiktoken encoding.
+    Without tiktoken, tokens are approximated as 4 characters each.
+    '''
+    chars_per_token = 4
+
+    def __init__(self, model):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("o200k_base")
+
+    def count(self, text):
+        if self.encoding is None:
+            return -(-len(text) // self.chars_per_token)
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text, max_tokens):
+        '''
+        Keep the first max_tokens tokens, cut back to the last complete sentence or word when possible
+        '''
+        if self.encoding is None:
+            truncated = text[:max_tokens * self.chars_per_token]
+        else:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text
+            truncated = self.encoding.decode(tokens[:max_tokens])
+        if len(truncated) == len(text):
+            return text
+        for end in (". ", " "):
+            cut = truncated.rfind(end)
+            if cut > len(truncated) // 2:
+                return truncated[:cut + 1].rstrip()
+        return truncated
+
+class PromptBudget:
+    '''
+    Enforce a token cap per prompt section (e.g. "user_memory", "cross_domain_memory", "item_memory").
+    fit() returns the section text within its cap. When a stored memory is over its cap, a background LLM
+    call rewrites it below the cap, so the memory and the prompts built from it stay flat over training;
+    until the rewrite lands the prompt uses the truncated text.
+    '''
+    def __init__(self, section_caps, model, memory_store=None, compact=True, max_workers=2):
+        self.section_caps = dict(section_caps)
+        self.model = model
+        self.counter = TokenCounter(model)
+        self.memory_store = memory_store
+        self.compact = compact and memory_store is not None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers) if self.compact else None
+        self.pending = {}  # Memory key -> future of its compaction
+        self.lock = threading.Lock()
+        self.num_truncated = 0
+        self.num_compacted = 0
+
+    def fit(self, section, text, key=None):
+        '''
+        Text of a prompt section within the section's cap. key is the memory the text was read from;
+        if given and the text is over the cap, the memory is compacted in the background.
+        '''
+        cap = self.section_caps.get(section)
+        if cap is None or self.counter.count(text) <= cap:
+            return text
+        if key is not None and self.compact:
+            self.schedule_compaction(key, text, cap)
+        self.num_truncated += 1
+        return self.counter.truncate(text, cap)
+
+    def schedule_compaction(self, key, text, cap):
+        with self.lock:
+            if key in self.pending and not self.pending[key].done():
+                return
+            self.pending[key] = self.executor.submit(self._compact, key, text, cap)
+
+    def _compact(self, key, text, cap):
+        # About 0.75 words per token, with a margin for the model overshooting the word limit
+        responseText = get_response_from_openai(memory_compaction_prompt(text, int(cap * 0.6)), self.model)
+        if responseText is None:
+            return
+        compacted = self.counter.truncate(responseText.split("Compacted memory:")[-1].strip(), cap)
+        with self.lock:
+            # The memory may have been rewritten by training since it was read; keep the newer version then
+            if self.memory_store.read(key) == text:
+                self.memory_store.write(key, compacted)
+                self.num_compacted += 1
+
+    def write(self, key, text):
+        '''
+        Write a memory without racing a compaction of the same memory
+        '''
+        with self.lock:
+            self.memory_store.write(key, text)
+
+    def wait(self):
+        '''
+        Block until the scheduled compactions are written, e.g. before a memory snapshot
+        '''
+        with self.lock:
+            futures = list(self.pending.values())
+            self.pending = {}
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Memory compaction failed: {e}")
+
+    def close(self):
+        self.wait()
+        if self.executor is not None:
+            self.executor.shutdown()
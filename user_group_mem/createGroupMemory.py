@@ -6,55 +6,98 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from config import domain_list, get_main_kind
+from dataPrepare import InteractionReader
+from memoryStore import open_memory_store
+from user_group_mem.groupMembership import load_group_membership
 
-def process(exp_name, name_suffix, ratio):
-    # Import group-user table
-    group_user_df = pd.read_csv(f"user_group_mem/output/group_user {name_suffix}.csv", encoding="utf-8")
-    group_user_df["group_users"] = group_user_df["group_users"].apply(eval)
+class GroupMemoryBuilder:
+    '''
+    Incrementally maintain group memory from an ordered interaction stream.
+    Each interaction appends the item title to the per-domain buffers of the user's groups in O(1),
+    and the group memory files can be written out (snapshotted) at any point.
+    '''
+    def __init__(self, group_membership, item_df, domain_list):
+        self.domain_list = domain_list
+        self.group_names = group_membership.group_names
+        self.group_ids = group_membership.group_ids
+        # Per group, one title buffer per domain
+        self.buffers = [[[] for _ in domain_list] for _ in self.group_names]
+        # Sparse users x groups matrix; looks up the groups containing a user
+        self.group_membership = group_membership
+        # main_category -> domain index
+        self.domain_index = {get_main_kind(domain): idx for idx, domain in enumerate(domain_list)}
+        item_df = item_df.drop_duplicates("parent_asin").set_index("parent_asin")
+        self.item_title = item_df["title"].to_dict()
+        self.item_main_category = item_df["main_category"].to_dict()
+        self.num_interactions = 0
+
+    def add_interaction(self, user_id, item_id):
+        self.num_interactions += 1
+        group_idx_list = self.group_membership.groups_of(user_id)
+        domain_idx = self.domain_index.get(self.item_main_category.get(item_id))
+        if not group_idx_list or domain_idx is None:
+            return
+        title = self.item_title[item_id]
+        for group_idx in group_idx_list:
+            self.buffers[group_idx][domain_idx].append(title)
+
+    def render(self, group_idx):
+        group_name = self.group_names[group_idx]
+        domain_txt_list = [f"{domain}:" + "".join(f"{title};" for title in titles) for domain, titles in zip(self.domain_list, self.buffers[group_idx])]
+        return f"Users who have similar preferences to me in {group_name} have interacted with the following items recently:\n\n" + f"{domain_txt_list[0]} \n\n " + "\n\n ".join(domain_txt_list[1:])
+
+    def save(self, memory_store):
+        '''
+        Write the current state of every group memory to groupMem in the memory store
+        '''
+        memory_store.write_many((f"groupMem/{group_id}.txt", self.render(group_idx)) for group_idx, group_id in enumerate(self.group_ids))
 
-    # Import the main item table
+def load_group_memory_builder(name_suffix):
+    '''
+    Build an empty group memory builder from the current user grouping, or return None if no grouping exists yet
+    '''
+    group_membership = load_group_membership(name_suffix)
+    if group_membership is None:
+        return None
     item_df = pd.read_csv(f"dataset/crossDomainData/user_item_data/{' '.join(domain_list)}/meta_crossdomain.csv", encoding="utf-8")
+    return GroupMemoryBuilder(group_membership, item_df, domain_list)
 
-    # Import interaction table
-    inter_df = pd.read_csv(f"dataset/crossDomainData/user_item_data/{' '.join(domain_list)}/timesequence/inter_crossdomain_timesequence_train.csv", encoding="utf-8")
-    inter_df = pd.merge(inter_df, item_df[["parent_asin", "title", "main_category", "categories"]], on="parent_asin", how="inner")
-    num_rows = len(inter_df)
-    inter_df = inter_df.iloc[:int(num_rows * 0.10 * ratio)]
-
-    # Create a txt file for each group and write group memory
-    for _, group in group_user_df.iterrows():
-        group_name = group["group_name"].replace('"', '')
-        group_user_list = group["group_users"]
-
-        # Filter interaction records for this group's users from inter_df
-        group_interactions = inter_df[inter_df["user_id"].isin(group_user_list)]
-
-        # Write interactions in group memory
-        if not os.path.exists(f"memory/{exp_name}/groupMem"):
-            os.makedirs(f"memory/{exp_name}/groupMem")
-
-        with open(f"memory/{exp_name}/groupMem/{group_name}.txt", "w", encoding="utf-8") as file:
-            file.write(f"Users who have similar preferences to me in {group_name} have interacted with the following items recently:\n\n")
-            domain0_txt = f"{domain_list[0]}:"
-            domain1_txt = f"{domain_list[1]}:"
-            domain2_txt = f"{domain_list[2]}:"
-            if len(domain_list) == 4:
-                domain3_txt = f"{domain_list[3]}"
-
-            for _, interaction in group_interactions.iterrows():
-                if interaction["main_category"] == get_main_kind(domain_list[0]):
-                    domain0_txt += interaction['title'] + ";"
-                if interaction["main_category"] == get_main_kind(domain_list[1]):
-                    domain1_txt += interaction['title'] + ";"
-                if interaction["main_category"] == get_main_kind(domain_list[2]):
-                    domain2_txt += interaction['title'] + ";"
-                if len(domain_list) == 4 and interaction["main_category"] == get_main_kind(domain_list[3]):
-                    domain3_txt += interaction['title'] + ";"
-
-            if len(domain_list) == 4:
-                file.write(f"{domain0_txt} \n\n {domain1_txt}\n\n {domain2_txt}\n\n {domain3_txt}")
-            else:
-                file.write(f"{domain0_txt} \n\n {domain1_txt}\n\n {domain2_txt}")
+def save_group_memory(builder, memory_dir):
+    memory_store = open_memory_store(memory_dir)
+    builder.save(memory_store)
+    memory_store.flush()
+
+def process_snapshots(exp_name, name_suffix, ratios):
+    '''
+    Replay the training interactions once and snapshot the group memory at each ratio (in tenths of the training set).
+    Ratio 10 is written to the experiment memory, other ratios to the matching intermediate memory saved during training.
+    '''
+    builder = load_group_memory_builder(name_suffix)
+    inter_reader = InteractionReader(f"dataset/crossDomainData/user_item_data/{' '.join(domain_list)}/timesequence/inter_crossdomain_timesequence_train.csv")
+    num_rows = inter_reader.count_rows()
+    snapshot_list = sorted((int(num_rows * 0.10 * ratio), ratio) for ratio in ratios)
+
+    snapshot_idx = 0
+    for _, record in inter_reader.iter_records():
+        user_id, item_id = record["user_id"], record["parent_asin"]
+        while snapshot_idx < len(snapshot_list) and builder.num_interactions >= snapshot_list[snapshot_idx][0]:
+            ratio = snapshot_list[snapshot_idx][1]
+            save_group_memory(builder, f"memory/{exp_name}" if ratio >= 10 else f"memory/{exp_name}_{ratio}")
+            snapshot_idx += 1
+        if snapshot_idx == len(snapshot_list):
+            break
+        builder.add_interaction(user_id, item_id)
+    for _, ratio in snapshot_list[snapshot_idx:]:
+        save_group_memory(builder, f"memory/{exp_name}" if ratio >= 10 else f"memory/{exp_name}_{ratio}")
+
+def process(exp_name, name_suffix, ratio):
+    # Build group memory from the first ratio/10 of the training interactions
+    builder = load_group_memory_builder(name_suffix)
+    inter_reader = InteractionReader(f"dataset/crossDomainData/user_item_data/{' '.join(domain_list)}/timesequence/inter_crossdomain_timesequence_train.csv")
+    num_rows = inter_reader.count_rows()
+    for _, record in inter_reader.iter_records(0, int(num_rows * 0.10 * ratio)):
+        builder.add_interaction(record["user_id"], record["parent_asin"])
+    save_group_memory(builder, f"memory/{exp_name}")
 
 if __name__ == "__main__":
     exp_name = "AgentCF++ " + ' '.join(domain_list)
@@ -0,0 +1,104 @@
+"""
+This script stores user-group membership as sparse matrices
+"""
+import os
+import numpy as np
+from scipy.sparse import csr_matrix
+
+def build_user_tag_matrix(user_tag_dict):
+    '''
+    Binary users x tags CSR matrix from {user_id: [tag, ...]}. Returns (matrix, user_ids, tags).
+    '''
+    user_ids = np.array([str(user_id) for user_id in user_tag_dict], dtype=str)
+    tag_lists = list(user_tag_dict.values())
+    all_tags = np.array([str(tag) for tags in tag_lists for tag in tags], dtype=str)
+    tags, tag_idx = np.unique(all_tags, return_inverse=True)
+    user_idx = np.repeat(np.arange(len(user_ids)), [len(tags_of_user) for tags_of_user in tag_lists])
+    matrix = csr_matrix((np.ones(len(tag_idx), dtype=np.float32), (user_idx, tag_idx)), shape=(len(user_ids), len(tags)))
+    matrix.data[:] = 1  # Tags repeated for one user count once
+    return matrix, user_ids, tags
+
+def build_tag_cluster_matrix(tags, tag_cluster, n_clusters):
+    '''
+    Binary tags x clusters CSR matrix from {tag: cluster}; tags without a cluster have an empty row.
+    '''
+    cluster_idx = np.array([tag_cluster.get(tag, -1) for tag in tags], dtype=np.int64)
+    has_cluster = cluster_idx >= 0
+    return csr_matrix((np.ones(has_cluster.sum(), dtype=np.float32), (np.flatnonzero(has_cluster), cluster_idx[has_cluster])), shape=(len(tags), n_clusters))
+
+class GroupMembership:
+    '''
+    Users x groups membership as a sparse boolean matrix, with the group names and ids.
+    Group ids are stable across regrouping runs and name the group memory files; names are for display only.
+    '''
+    def __init__(self, matrix, user_ids, group_names, group_ids=None):
+        self.matrix = csr_matrix(matrix, dtype=bool)
+        self.user_ids = np.asarray(user_ids, dtype=str)
+        self.group_names = [str(group_name).replace('"', '') for group_name in group_names]
+        self.group_ids = list(group_ids) if group_ids is not None else list(self.group_names)
+        self.user_index = {user_id: idx for idx, user_id in enumerate(self.user_ids)}
+        self._group_users = None
+
+    @classmethod
+    def from_user_tags(cls, user_tag_matrix, tag_cluster_matrix, user_ids, cluster_list, group_names, group_ids=None):
+        '''
+        A user belongs to the group of a cluster if any of their tags is in the cluster: one sparse matrix product
+        '''
+        user_cluster_matrix = (user_tag_matrix @ tag_cluster_matrix[:, cluster_list]).tocsr()
+        return cls(user_cluster_matrix > 0, user_ids, group_names, group_ids)
+
+    @property
+    def group_sizes(self):
+        return np.asarray(self.matrix.sum(axis=0)).ravel()
+
+    @property
+    def coverage(self):
+        '''
+        Fraction of users that belong to at least one group
+        '''
+        if len(self.user_ids) == 0:
+            return 0.0
+        return float((np.diff(self.matrix.indptr) > 0).mean())
+
+    def groups_of(self, user_id):
+        '''
+        Indices of the groups containing the user
+        '''
+        user_idx = self.user_index.get(str(user_id))
+        if user_idx is None:
+            return []
+        return self.matrix.indices[self.matrix.indptr[user_idx]:self.matrix.indptr[user_idx + 1]].tolist()
+
+    def group_names_of(self, user_id):
+        return [self.group_names[group_idx] for group_idx in self.groups_of(user_id)]
+
+    def group_ids_of(self, user_id):
+        return [self.group_ids[group_idx] for group_idx in self.groups_of(user_id)]
+
+    def group_users(self, group_idx):
+        if self._group_users is None:
+            self._group_users = self.matrix.tocsc()
+        return self.user_ids[self._group_users.indices[self._group_users.indptr[group_idx]:self._group_users.indptr[group_idx + 1]]].tolist()
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(path, indptr=self.matrix.indptr, indices=self.matrix.indices, shape=np.array(self.matrix.shape),
+                            user_ids=self.user_ids, group_names=np.array(self.group_names, dtype=str), group_ids=np.array(self.group_ids, dtype=str))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=False)
+        matrix = csr_matrix((np.ones(len(data["indices"]), dtype=bool), data["indices"], data["indptr"]), shape=tuple(data["shape"]))
+        return cls(matrix, data["user_ids"], data["group_names"].tolist(), data["group_ids"].tolist())
+
+def group_membership_path(name_suffix):
+    return f"user_group_mem/output/group_user {name_suffix}.npz"
+
+def load_group_membership(name_suffix):
+    '''
+    Load the current user grouping, or return None if no grouping exists yet
+    '''
+    path = group_membership_path(name_suffix)
+    if not os.path.exists(path):
+        return None
+    return GroupMembership.load(path)
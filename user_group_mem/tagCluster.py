@@ -0,0 +1,75 @@
+"""
+This script clusters interest tag embeddings and assigns new tags to existing clusters
+"""
+import os
+import json
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+class CentroidIndex:
+    '''
+    Nearest-centroid lookup for tag embeddings.
+    Uses an HNSW index when hnswlib is installed, otherwise exact search with one matrix product per batch.
+    '''
+    def __init__(self, centroids, use_hnsw=True):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.index = None
+        if use_hnsw and hnswlib is not None:
+            self.index = hnswlib.Index(space="l2", dim=self.centroids.shape[1])
+            self.index.init_index(max_elements=len(self.centroids), ef_construction=200, M=16)
+            self.index.add_items(self.centroids, np.arange(len(self.centroids)))
+            self.index.set_ef(64)
+        self.centroid_sq_norms = (self.centroids ** 2).sum(axis=1)
+
+    def assign(self, embeddings, batch_size=65536):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(embeddings) == 0:
+            return np.zeros(0, dtype=np.int64)
+        if self.index is not None:
+            labels, _ = self.index.knn_query(embeddings, k=1)
+            return labels[:, 0].astype(np.int64)
+        # argmin ||x - c||^2 = argmin (||c||^2 - 2 x.c)
+        labels = np.empty(len(embeddings), dtype=np.int64)
+        for i in range(0, len(embeddings), batch_size):
+            batch = embeddings[i:i + batch_size]
+            labels[i:i + batch_size] = np.argmin(self.centroid_sq_norms[None, :] - 2 * batch @ self.centroids.T, axis=1)
+        return labels
+
+def fit_tag_clusters(embeddings, weights, n_clusters, batch_size=4096, random_state=42):
+    '''
+    Mini-batch k-means over deduplicated tags, each weighted by how often it occurs. Returns (labels, centroids).
+    '''
+    n_clusters = min(n_clusters, len(embeddings))
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size, n_init=3, random_state=random_state)
+    kmeans.fit(embeddings, sample_weight=weights)
+    return kmeans.labels_, kmeans.cluster_centers_.astype(np.float32)
+
+def cluster_tags(tags, weights, embeddings, n_clusters, centroids_path, tag_cluster_path, refit=False):
+    '''
+    Cluster unique tags. When a clustering with the same number of clusters and dimension exists and refit is False,
+    known tags keep their cluster and new tags are assigned to the nearest existing centroid.
+    '''
+    # fit_tag_clusters never fits more clusters than tags, so the cached centroids are compared with the same bound
+    n_clusters = min(n_clusters, len(embeddings))
+    if not refit and os.path.exists(centroids_path) and os.path.exists(tag_cluster_path):
+        centroids = np.load(centroids_path)
+        if centroids.shape == (n_clusters, embeddings.shape[1]):
+            with open(tag_cluster_path, "r", encoding="utf-8") as file:
+                tag_cluster = json.load(file)
+            is_new = np.array([tag not in tag_cluster for tag in tags], dtype=bool)
+            labels = np.array([tag_cluster.get(tag, -1) for tag in tags], dtype=np.int64)
+            labels[is_new] = CentroidIndex(centroids).assign(embeddings[is_new])
+            save_tag_clusters(tags, labels, centroids, centroids_path, tag_cluster_path)
+            return labels
+    labels, centroids = fit_tag_clusters(embeddings, weights, n_clusters)
+    save_tag_clusters(tags, labels, centroids, centroids_path, tag_cluster_path)
+    return labels
+
+def save_tag_clusters(tags, labels, centroids, centroids_path, tag_cluster_path):
+    np.save(centroids_path, centroids)
+    with open(tag_cluster_path, "w", encoding="utf-8") as file:
+        json.dump({tag: int(label) for tag, label in zip(tags, labels)}, file)
@@ -2,30 +2,23 @@
 This script is used to group users
 """
 import pandas as pd
+import numpy as np
 import json
-import ast
-from itertools import chain
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from prompt import get_call_llm_for_summary
 from request import get_response_from_openai
 from config import model, domain_list
+from user_group_mem.groupMembership import build_user_tag_matrix, build_tag_cluster_matrix, GroupMembership, group_membership_path
 
 """
 Hyperparameters
 """
 num_groups = 10
-
-"""
-Define a function to get a list of user IDs based on a list of tags
-"""
-def get_user_ids_by_tags(tags, tag_user_dict):
-    user_ids = set()
-    for tag in tags:
-        if tag in tag_user_dict:
-            user_ids.update(tag_user_dict[tag])
-    return list(user_ids)
+summary_workers = 8
 
 """
 Summarize preferences for each group
@@ -34,6 +27,30 @@ def call_llm_for_summary(tag_list):
     prompt = get_call_llm_for_summary(tag_list=tag_list)
     return get_response_from_openai(prompt=prompt, model=model)
 
+"""
+Stable group ID derived from the group's tag set, independent of the order of the tags and of the group name
+"""
+def get_group_id(tag_list):
+    return "group_" + hashlib.sha1("\n".join(sorted(set(tag_list))).encode("utf-8")).hexdigest()[:16]
+
+"""
+Summarize the groups concurrently; names are cached by group ID so only new tag sets are sent to the LLM
+"""
+def summarize_groups(group_tag_lists, cache_path="user_group_mem/output/group_name_cache.json"):
+    group_name_cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as file:
+            group_name_cache = json.load(file)
+    group_ids = [get_group_id(tag_list) for tag_list in group_tag_lists]
+    new_groups = {group_id: tag_list for group_id, tag_list in zip(group_ids, group_tag_lists) if group_id not in group_name_cache}
+    with ThreadPoolExecutor(max_workers=summary_workers) as executor:
+        for group_id, group_name in zip(new_groups, executor.map(call_llm_for_summary, new_groups.values())):
+            if group_name is not None:
+                group_name_cache[group_id] = group_name
+    with open(cache_path, "w", encoding="utf-8") as file:
+        json.dump(group_name_cache, file, ensure_ascii=False)
+    return group_ids, [group_name_cache.get(group_id, group_id) for group_id in group_ids]
+
 def process(exp_name, name_suffix):
     """
     Import user-tag data and tag clustering data
@@ -41,43 +58,37 @@ def process(exp_name, name_suffix):
     # Import user-tag data
     with open(f"user_group_mem/llm4embedding/input/user_tag {name_suffix}.json", "r", encoding="utf-8") as file:
         user_tag_dict = json.load(file)
-    # Import cluster-tags data
-    cluster_tags_df = pd.read_csv(f"user_group_mem/output/cluster_tags {name_suffix}.csv", encoding="utf-8")
+    # Import tag-cluster data
+    with open(f"user_group_mem/output/tag_cluster {name_suffix}.json", "r", encoding="utf-8") as file:
+        tag_cluster = json.load(file)
+    n_clusters = max(tag_cluster.values()) + 1
 
     """
-    Calculate and select the largest categories containing the most users
+    Users x tags and tags x clusters as sparse matrices
     """
-    cluster_tags_df['0'] = cluster_tags_df['0'].apply(lambda x: ast.literal_eval(x))
-    cluster_tags_df["num_user"] = cluster_tags_df["0"].apply(lambda x: len(x))
-    cluster_tags_df = cluster_tags_df.sort_values(by="num_user", ascending=False)
-    top_groups = cluster_tags_df.head(num_groups)
+    user_tag_matrix, user_ids, tags = build_user_tag_matrix(user_tag_dict)
+    tag_cluster_matrix = build_tag_cluster_matrix(tags, tag_cluster, n_clusters)
 
     """
-    Convert user-tag dictionary to tag-user dictionary
+    Calculate and select the largest categories containing the most users
     """
-    tag_user_dict = {}
-    for user_id, tags in user_tag_dict.items():
-        for tag in tags:
-            if tag not in tag_user_dict:
-                tag_user_dict[tag] = []
-            tag_user_dict[tag].append(user_id)
+    num_user = np.asarray(((user_tag_matrix @ tag_cluster_matrix) > 0).sum(axis=0)).ravel()
+    top_clusters = np.argsort(-num_user, kind="stable")[:num_groups]
 
     """
-    Assign users to different groups
+    Assign users to different groups and name each group
     """
-    top_groups['group_users'] = top_groups['0'].apply(lambda tags: get_user_ids_by_tags(tags, tag_user_dict))
-    # Combine all list elements from the DataFrame column into an iterator
-    all_elements = chain.from_iterable(top_groups['group_users'])
-    # Convert the iterator to a set to remove duplicates
-    unique_users = set(all_elements)
-    num_unique_users = len(unique_users)
-
-    top_groups["group_name"] = top_groups["0"].apply(call_llm_for_summary)
-    top_groups.drop(columns=["0", "cluster", "num_user"], inplace=True)
+    tag_cluster_csc = tag_cluster_matrix.tocsc()
+    group_tag_lists = [tags[tag_cluster_csc.indices[tag_cluster_csc.indptr[cluster]:tag_cluster_csc.indptr[cluster + 1]]].tolist() for cluster in top_clusters]
+    group_ids, group_names = summarize_groups(group_tag_lists)
+    group_membership = GroupMembership.from_user_tags(user_tag_matrix, tag_cluster_matrix, user_ids, top_clusters, group_names, group_ids)
+    group_membership.save(group_membership_path(name_suffix))
 
-    top_groups.to_csv(f"user_group_mem/output/group_user {name_suffix}.csv", index=False)
+    group_stats_df = pd.DataFrame({"group_id": group_ids, "group_name": group_membership.group_names, "cluster": top_clusters, "num_user": group_membership.group_sizes})
+    group_stats_df.to_csv(f"user_group_mem/output/group_stats {name_suffix}.csv", index=False)
+    print(f"{len(top_clusters)} groups cover {group_membership.coverage:.2%} of {len(user_ids)} users")
 
 if __name__ == "__main__":
     exp_name = "AgentCF++ " + " ".join(domain_list)
     name_suffix = exp_name.replace("AgentCF++ ", "")
-    process(exp_name, name_suffix)
\ No newline at end of file
+    process(exp_name, name_suffix)
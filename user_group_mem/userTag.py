@@ -9,18 +9,25 @@ import pandas as pd
 from prompt import get_user_tag_prompt
 from request import get_response_from_openai
 import json
+import re
+import hashlib
 import numpy as np
-from sklearn.cluster import KMeans
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
-from openai import OpenAI
 from functions import concatenate_crossdomain_preference
+from embeddingClient import EmbeddingClient
+from memoryStore import open_memory_store
+from user_group_mem.tagCluster import cluster_tags
 
 class Args:
     def __init__(self, domain_list):
         self.exp_name = "AgentCF++" + " " + " ".join(domain_list)
         self.model = 'text-embedding-3-large'
         self.dim = 128
-        self.batch_size = 1
+        self.batch_size = 2048
+        self.tag_workers = 8
+        self.incremental_tagging = True  # Only re-tag users whose memory changed since the last tagging pass
+        self.refit_clusters = False  # Assign new tags to the existing centroids instead of refitting
     @property
     def name_suffix(self):
         return self.exp_name.replace("AgentCF++ ", "")
@@ -34,33 +41,59 @@ class Args:
     def output_file(self):
         return f'user_group_mem/llm4embedding/output/{self.dataset_name}_embedding.npy'
 
-os.environ['OPENAI_API_KEY'] = ''
-client = OpenAI()
+def parse_user_tags(responseText):
+    '''
+    Extract the interest tag list from an LLM reply, repairing common formatting problems
+    (Markdown code fences, surrounding text, unquoted tags). Returns None if no tag list can be recovered.
+    '''
+    if not responseText:
+        return None
+    text = re.sub(r"```(?:json)?", "", responseText).strip()
+    match = re.search(r"\{.*\}", text, re.S)
+    if match:
+        try:
+            tags = json.loads(match.group(0)).get("interest_tags")
+            if isinstance(tags, list):
+                return [str(tag).strip() for tag in tags if str(tag).strip()]
+        except (json.JSONDecodeError, AttributeError):
+            pass
+    match = re.search(r"interest_tags\W*\[(.*?)\]", text, re.S)
+    if match:
+        tags = [tag.strip().strip("'\"").strip() for tag in match.group(1).split(",")]
+        return [tag for tag in tags if tag] or None
+    return None
 
-def normalize_l2(x):
-    x = np.array(x)
-    if x.ndim == 1:
-        norm = np.linalg.norm(x)
-        if norm == 0:
-            return x
-        return x / norm
-    else:
-        norm = np.linalg.norm(x, 2, axis=1, keepdims=True)
-        return np.where(norm == 0, x, x / norm)
+def tag_user(userId, memory_store, cache_dir, incremental=True, max_retries=3):
+    '''
+    Tag one user from their memory and persist the result with the hash of the memory it was computed from.
+    With incremental tagging, a user whose memory is unchanged keeps the cached tags without an LLM call.
+    '''
+    private_domain_description = concatenate_crossdomain_preference(memory_store, userId)
+    memory_hash = hashlib.sha1(private_domain_description.encode("utf-8")).hexdigest()
+    cache_path = f"{cache_dir}/user.{userId}.json"
+    if incremental and os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as file:
+            cached = json.load(file)
+        if cached["memory_hash"] == memory_hash:
+            return cached["interest_tags"]
 
-def get_embeddings_batch(texts, dim=64, model="text-embedding-3-small"):
-    texts = [text.replace("\n", " ") for text in texts]
-    response = client.embeddings.create(input=texts, model=model)
-    return [normalize_l2(response.data[i].embedding[:dim]) for i in range(len(response.data))]
+    user_tag_prompt = get_user_tag_prompt(private_domain_description)
+    for _ in range(max_retries):
+        interest_tags = parse_user_tags(get_response_from_openai(user_tag_prompt, model))
+        if interest_tags is not None:
+            with open(cache_path, "w", encoding="utf-8") as file:
+                json.dump({"memory_hash": memory_hash, "interest_tags": interest_tags}, file)
+            return interest_tags
+    print(f"Failed to tag user {userId} after {max_retries} attempts, skipping")
+    return None
 
-def gen_user_tag_dict(user_id_all, exp_name, name_suffix):
-    user_tag_dict = {}
-    for userId in user_id_all:
-        private_domain_description = concatenate_crossdomain_preference(f"memory/{exp_name}/user/user.{userId}")
-        user_tag_prompt = get_user_tag_prompt(private_domain_description)
-        responseText = get_response_from_openai(user_tag_prompt, model)
-        data = json.loads(responseText)
-        user_tag_dict[userId] = data["interest_tags"]
+def gen_user_tag_dict(user_id_all, exp_name, name_suffix, max_workers=8, incremental=True):
+    cache_dir = f"user_group_mem/llm4embedding/input/user_tag {name_suffix}"
+    os.makedirs(cache_dir, exist_ok=True)
+    memory_store = open_memory_store(f"memory/{exp_name}")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        interest_tags_list = list(tqdm(executor.map(lambda userId: tag_user(userId, memory_store, cache_dir, incremental), user_id_all), total=len(user_id_all)))
+    user_tag_dict = {str(userId): interest_tags for userId, interest_tags in zip(user_id_all, interest_tags_list) if interest_tags is not None}
 
     save_path = f"user_group_mem/llm4embedding/input/user_tag {name_suffix}.json"
     with open(save_path, 'w') as file:
@@ -74,35 +107,31 @@ def process(args, ratio):
     user_id_all = inter_timesequence_df["user_id"].unique()
 
     # 2. For each user, use the current user memory to get labels from the large model, resulting in a user-tag matrix.
-    user_tag_dict = gen_user_tag_dict(user_id_all, args.exp_name, args.name_suffix)
+    user_tag_dict = gen_user_tag_dict(user_id_all, args.exp_name, args.name_suffix, args.tag_workers, args.incremental_tagging)
 
     # 3. Generate embeddings using the large model
     with open(args.input_file, 'r', encoding='utf-8') as f:
         data = json.load(f)
-    all_tags = [tag for tags in data.values() for tag in tags]
-    df = pd.DataFrame(all_tags, columns=['text'])
+    # Deduplicate tags; each unique tag is embedded and clustered once, weighted by its number of occurrences
+    tag_counts = pd.Series([tag for tags in data.values() for tag in tags]).value_counts(sort=False)
+    df = pd.DataFrame({'text': tag_counts.index, 'count': tag_counts.values})
 
     with open(f"user_group_mem/llm4embedding/output/column_list {args.name_suffix}.json", "w", encoding="utf-8") as file:
         json.dump(list(df['text']), file)
-    embeddings = []
-    for i in tqdm(range(0, len(df), args.batch_size)):
-        batch_texts = df['text'][i:i + args.batch_size].tolist()
-        batch_embeddings = get_embeddings_batch(batch_texts, dim=args.dim, model=args.model)
-        embeddings.extend(batch_embeddings)
+    # Cached embeddings are reused across runs; only new tags are sent to the API
+    embedding_client = EmbeddingClient(args.model, batch_size=args.batch_size)
+    embeddings = embedding_client.embed(list(df['text']), dim=args.dim)
     np.save(args.output_file, embeddings)
 
-    # Perform k-means clustering on the embeddings
-    embedding_array = np.load(args.output_file)
+    # Perform mini-batch k-means clustering on the embeddings, or assign new tags to the existing centroids
     n_clusters = int(group_n_cluster * ratio / 10)
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-    kmeans.fit(embedding_array)
-    labels = kmeans.labels_
+    labels = cluster_tags(list(df['text']), df['count'].values, embeddings, n_clusters,
+                          f"user_group_mem/output/cluster_centroids {args.name_suffix}.npy",
+                          f"user_group_mem/output/tag_cluster {args.name_suffix}.json", refit=args.refit_clusters)
 
     # Combine clustering results with the text of the labels
-    with open(f"user_group_mem/llm4embedding/output/column_list {args.name_suffix}.json", encoding="utf-8") as file:
-        tags = json.load(file)
-    tags_cluster_df = pd.DataFrame(labels, index=tags, columns=["cluster"])
-    cluster_tags_df = tags_cluster_df.groupby("cluster").apply(lambda x: x.index.tolist()).reset_index()
+    tags_cluster_df = pd.DataFrame({"cluster": labels, "tag": df['text'], "count": df['count']})
+    cluster_tags_df = tags_cluster_df.groupby("cluster").agg(**{"0": ("tag", list), "num_tag": ("count", "sum")}).reset_index()
     cluster_tags_df.to_csv(f"user_group_mem/output/cluster_tags {args.name_suffix}.csv", index=False)
 
 if __name__ == "__main__":